@@ -12,7 +12,8 @@
 # License along with this library.
 
 from oiopy import exceptions
-from oiopy.http import requests
+from oiopy.http import requests, PooledAdapter, PROXY_POOL_SIZE, \
+    PROXY_POOL_BLOCK, PROXY_IDLE_TIMEOUT
 
 
 class API(object):
@@ -20,13 +21,61 @@ class API(object):
     The base class for all API.
     """
 
-    def __init__(self, session=None, endpoint=None, **kwargs):
+    def __init__(self, session=None, endpoint=None,
+                 pool_size=PROXY_POOL_SIZE, pool_block=PROXY_POOL_BLOCK,
+                 pool_idle_timeout=PROXY_IDLE_TIMEOUT, keep_alive=True,
+                 **kwargs):
+        """
+        :param session: requests session, shared with other APIs,
+                        the pool parameters are ignored if set
+        :param pool_size: max number of connections kept for each service
+        :param pool_block: wait for a connection to be released instead
+                           of opening a new one when pool_size connections
+                           are in use
+        :param pool_idle_timeout: idle connections older than this
+                                  are not reused
+        :param keep_alive: reuse the connections
+        """
         super(API, self).__init__()
         if not session:
             session = requests.Session()
+            adapter = PooledAdapter(
+                pool_maxsize=pool_size, pool_block=pool_block,
+                idle_timeout=pool_idle_timeout, keep_alive=keep_alive)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
         self.session = session
         self.endpoint = endpoint
 
+    def _grow_pool(self, size):
+        """
+        Make the session keep at least size connections for each host,
+        so that many coroutines do not open and close connections.
+        """
+        for prefix in ('http://', 'https://'):
+            adapter = self.session.get_adapter(prefix)
+            if getattr(adapter, '_pool_maxsize', size) >= size:
+                continue
+            if isinstance(adapter, PooledAdapter):
+                adapter.resize(size)
+                continue
+            self.session.mount(prefix, type(adapter)(
+                pool_connections=adapter._pool_connections,
+                pool_maxsize=size, pool_block=adapter._pool_block,
+                max_retries=adapter.max_retries))
+
+    def pool_stats(self):
+        """
+        :returns: dict of the number of connections to the services
+                  reused (hits), opened (misses) and closed because
+                  they were idle for too long (discarded)
+        """
+        stats = {'hits': 0, 'misses': 0, 'discarded': 0}
+        for adapter in set(self.session.adapters.values()):
+            for key, value in getattr(adapter, 'stats', {}).items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
     def _request(self, method, url, endpoint=None, session=None, **kwargs):
         if not endpoint:
             endpoint = self.endpoint
@@ -58,6 +58,13 @@ class ClientManager(object):
         endpoint = self._options['proxyd_url']
         return endpoint
 
+    def get_io_settings(self):
+        """
+        :returns: the I/O settings given on the command line
+        """
+        settings = self._options.get('io_settings') or {}
+        return dict((k, v) for k, v in settings.items() if v is not None)
+
     def get_account(self):
         account_name = self._options.get('account_name', None)
         if not account_name:
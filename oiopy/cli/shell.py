@@ -84,6 +84,55 @@ class OpenIOShell(app.App):
             default=utils.env('OIO_PROXYD_URL'),
             help='Proxyd URL (Env: OIO_PROXYD_URL)'
         )
+        parser.add_argument(
+            '--oio-write-chunk-size',
+            metavar='<bytes>',
+            dest='write_chunk_size',
+            type=int,
+            help='Size of the blocks sent to the rawx services'
+        )
+        parser.add_argument(
+            '--oio-read-chunk-size',
+            metavar='<bytes>',
+            dest='read_chunk_size',
+            type=int,
+            help='Size of the blocks read from the rawx services'
+        )
+        parser.add_argument(
+            '--oio-put-queue-depth',
+            metavar='<blocks>',
+            dest='put_queue_depth',
+            type=int,
+            help='Number of blocks queued for each rawx upload'
+        )
+        parser.add_argument(
+            '--oio-connection-timeout',
+            metavar='<seconds>',
+            dest='connection_timeout',
+            type=float,
+            help='Timeout of the connections to the rawx services'
+        )
+        parser.add_argument(
+            '--oio-chunk-timeout',
+            metavar='<seconds>',
+            dest='chunk_timeout',
+            type=float,
+            help='Timeout of the chunk reads and writes'
+        )
+        parser.add_argument(
+            '--oio-client-timeout',
+            metavar='<seconds>',
+            dest='client_timeout',
+            type=float,
+            help='Timeout of the reads of the uploaded data'
+        )
+        parser.add_argument(
+            '--oio-io-autotune',
+            dest='io_autotune',
+            action='store_true',
+            help='Grow the block size and queue depth of the uploads '
+                 'while the throughput improves'
+        )
 
         return clientmanager.build_plugin_option_parser(parser)
 
@@ -103,7 +152,16 @@ class OpenIOShell(app.App):
         options = {
             'namespace': self.options.ns,
             'account_name': self.options.account_name,
-            'proxyd_url': self.options.proxyd_url
+            'proxyd_url': self.options.proxyd_url,
+            'io_settings': {
+                'write_chunk_size': self.options.write_chunk_size,
+                'read_chunk_size': self.options.read_chunk_size,
+                'put_queue_depth': self.options.put_queue_depth,
+                'connection_timeout': self.options.connection_timeout,
+                'chunk_timeout': self.options.chunk_timeout,
+                'client_timeout': self.options.client_timeout,
+                'io_autotune': self.options.io_autotune,
+            }
         }
 
         self.print_help_if_requested()
@@ -1,3 +1,4 @@
+import functools
 import logging
 from oiopy.object_storage import ObjectStorageAPI
 
@@ -11,10 +12,23 @@ def make_client(instance):
     client = ObjectStorageAPI(
         session=instance.session,
         endpoint=endpoint,
-        namespace=instance.namespace
+        namespace=instance.namespace,
+        **instance.get_io_settings()
     )
     return client
 
 
+def client_factory(instance):
+    """
+    Returns a function building new clients,
+    for the worker processes that cannot share the session.
+    """
+    endpoint = instance.get_endpoint('storage')
+    return functools.partial(ObjectStorageAPI,
+                             endpoint=endpoint,
+                             namespace=instance.namespace,
+                             **instance.get_io_settings())
+
+
 def build_option_parser(parser):
     return parser
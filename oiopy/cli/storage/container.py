@@ -1,10 +1,33 @@
+import errno
 import os
 import logging
+import time
 from cliff import show
 from cliff import command
 from cliff import lister
 
+from oiopy.cli.storage.client import client_factory
 from oiopy.cli.utils import KeyValueAction
+from oiopy.cli.workers import process_map, log_throughput
+
+
+def _save_object(storage, account, container, obj_name):
+    meta, stream = storage.object_fetch(account, container, obj_name)
+
+    dirname = os.path.dirname(obj_name)
+    if dirname and not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            # created meanwhile by another worker
+            if e.errno != errno.EEXIST:
+                raise
+    size = 0
+    with open(obj_name, 'wb') as f:
+        for chunk in stream:
+            f.write(chunk)
+            size += len(chunk)
+    return obj_name, size
 
 
 class CreateContainer(lister.Lister):
@@ -172,6 +195,7 @@ class ListContainer(lister.Lister):
         parser.add_argument(
             '--limit',
             metavar='<limit>',
+            type=int,
             help='Limit of results to return'
         )
         return parser
@@ -191,14 +215,15 @@ class ListContainer(lister.Lister):
         if parsed_args.limit:
             kwargs['limit'] = parsed_args.limit
 
-        l, meta = self.app.client_manager.storage.container_list(
+        # the pages are requested while the rows are printed
+        containers = self.app.client_manager.storage.container_list_iter(
             self.app.client_manager.get_account(),
             **kwargs
         )
 
         columns = ('Name', 'Bytes', 'Count')
 
-        results = ((v[0], v[2], v[1]) for v in l)
+        results = ((v[0], v[2], v[1]) for v in containers)
         return columns, results
 
 
@@ -248,6 +273,12 @@ class SaveContainer(command.Command):
             'container',
             metavar='<container>',
             help='Container to save')
+        parser.add_argument(
+            '--workers',
+            metavar='<workers>',
+            type=int,
+            default=1,
+            help='Number of processes downloading objects in parallel')
         return parser
 
     def take_action(self, parsed_args):
@@ -255,20 +286,24 @@ class SaveContainer(command.Command):
 
         account = self.app.client_manager.get_account()
         container = parsed_args.container
-        objs = self.app.client_manager.storage.object_list(
+        objs = self.app.client_manager.storage.object_list_iter(
             account, container)
 
-        for obj in objs['objects']:
-            obj_name = obj['name']
-            meta, stream = self.app.client_manager.storage.object_fetch(
-                account, container, obj_name)
-
-            if not os.path.exists(os.path.dirname(obj_name)):
-                if len(os.path.dirname(obj_name)) > 0:
-                    os.makedirs(os.path.dirname(obj_name))
-            with open(obj_name, 'wb') as f:
-                for chunk in stream:
-                    f.write(chunk)
+        tasks = ((account, container, obj['name']) for obj in objs)
+
+        factory = None
+        if parsed_args.workers > 1:
+            factory = client_factory(self.app.client_manager)
+
+        start = time.time()
+        nb_objects = 0
+        nb_bytes = 0
+        for _name, size in process_map(
+                _save_object, tasks, self.app.client_manager.storage,
+                workers=parsed_args.workers, client_factory=factory):
+            nb_objects += 1
+            nb_bytes += size
+        log_throughput(self.log, nb_objects, nb_bytes, time.time() - start)
 
 
 class AnalyzeContainer(show.ShowOne):
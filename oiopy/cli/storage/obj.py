@@ -1,12 +1,48 @@
 import io
 import logging
 import os
+import sys
+import time
 
 from cliff import command
 from cliff import lister
 from cliff import show
 
+from oiopy.cli.storage.client import client_factory
+from oiopy import exceptions
 from oiopy.cli.utils import KeyValueAction
+from oiopy.cli.workers import process_map, log_throughput
+
+
+def _get_file_size(f):
+    currpos = f.tell()
+    f.seek(0, 2)
+    total_size = f.tell()
+    f.seek(currpos)
+    return total_size
+
+
+def _create_object(storage, account, container, path, name, policy):
+    if path == '-':
+        if not name:
+            raise exceptions.CommandError(
+                'Set the name of the object read from standard input '
+                'with --name')
+        f = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+    else:
+        f = io.open(path, 'rb')
+    with f:
+        name = name or os.path.basename(f.name)
+        # the length of pipes is only known once they are read
+        content_length = _get_file_size(f) if f.seekable() else None
+        data = storage.object_create(
+            account,
+            container,
+            file_or_path=f,
+            obj_name=name,
+            content_length=content_length,
+            policy=policy)
+    return name, data[1], data[2].upper()
 
 
 class CreateObject(lister.Lister):
@@ -25,7 +61,7 @@ class CreateObject(lister.Lister):
             'objects',
             metavar='<filename>',
             nargs='+',
-            help='Local filename(s) to upload'
+            help='Local filename(s) to upload, - for standard input'
         )
         parser.add_argument(
             '--name',
@@ -39,43 +75,52 @@ class CreateObject(lister.Lister):
             metavar='<policy>',
             help='Storage Policy'
         )
+        parser.add_argument(
+            '--workers',
+            metavar='<workers>',
+            type=int,
+            default=1,
+            help='Number of processes uploading objects in parallel'
+        )
         return parser
 
     def take_action(self, parsed_args):
         self.log.debug('take_action(%s)', parsed_args)
 
+        account = self.app.client_manager.get_account()
         container = parsed_args.container
         policy = parsed_args.policy
         objs = parsed_args.objects
         names = parsed_args.name
 
-        def get_file_size(f):
-            currpos = f.tell()
-            f.seek(0, 2)
-            total_size = f.tell()
-            f.seek(currpos)
-            return total_size
+        # the worker processes do not share the standard input
+        if parsed_args.workers > 1 and '-' in objs:
+            raise exceptions.CommandError(
+                'Standard input cannot be uploaded with --workers')
 
-        results = []
+        tasks = []
         for obj in objs:
-            with io.open(obj, 'rb') as f:
-                name = names.pop(0) if names else os.path.basename(f.name)
-                data = self.app.client_manager.storage.object_create(
-                    self.app.client_manager.get_account(),
-                    container,
-                    file_or_path=f,
-                    obj_name=name,
-                    content_length=get_file_size(f),
-                    policy=policy)
-
-                results.append((name, data[1], data[2].upper()))
+            name = names.pop(0) if names else None
+            tasks.append((account, container, obj, name, policy))
+
+        factory = None
+        if parsed_args.workers > 1:
+            factory = client_factory(self.app.client_manager)
+
+        start = time.time()
+        results = list(process_map(
+            _create_object, tasks, self.app.client_manager.storage,
+            workers=parsed_args.workers, client_factory=factory))
+        log_throughput(self.log, len(results),
+                       sum(size for _name, size, _hash in results),
+                       time.time() - start)
 
         l = (obj for obj in results)
         columns = ('Name', 'Size', 'Hash')
         return columns, l
 
 
-class DeleteObject(command.Command):
+class DeleteObject(lister.Lister):
     """Delete object from container"""
 
     log = logging.getLogger(__name__ + '.DeleteObject')
@@ -90,22 +135,64 @@ class DeleteObject(command.Command):
         parser.add_argument(
             'objects',
             metavar='<object>',
-            nargs='+',
+            nargs='*',
             help='Object(s) to delete'
         )
+        parser.add_argument(
+            '--prefix',
+            metavar='<prefix>',
+            help='Also delete the objects whose name begins with <prefix>'
+        )
+        parser.add_argument(
+            '--concurrency',
+            metavar='<concurrency>',
+            type=int,
+            default=1,
+            help='Number of objects deleted at the same time'
+        )
         return parser
 
     def take_action(self, parsed_args):
         self.log.debug('take_action(%s)', parsed_args)
 
+        if not parsed_args.objects and parsed_args.prefix is None:
+            raise exceptions.CommandError(
+                'Missing <object> or --prefix')
+
         container = parsed_args.container
 
-        for obj in parsed_args.objects:
-            self.app.client_manager.storage.object_delete(
-                self.app.client_manager.get_account(),
-                container,
-                obj
-            )
+        results = self.app.client_manager.storage.object_delete_many(
+            self.app.client_manager.get_account(),
+            container,
+            objs=parsed_args.objects,
+            prefix=parsed_args.prefix,
+            concurrency=parsed_args.concurrency
+        )
+
+        def _results():
+            for name, error in results:
+                if isinstance(error, exceptions.NoSuchObject):
+                    self.log.warn('Object %s not found', name)
+                elif error is not None:
+                    self.log.error('Failed to delete %s: %s', name, error)
+                if error is not None:
+                    # as with a single deletion, a missing object
+                    # makes the command fail
+                    self.failed.append(name)
+                yield name, error is None
+
+        self.failed = []
+        columns = ('Name', 'Deleted')
+        return columns, _results()
+
+    def run(self, parsed_args):
+        # the rows are produced while they are displayed,
+        # the failures are only known once they all are
+        result = super(DeleteObject, self).run(parsed_args)
+        if self.failed:
+            raise exceptions.CommandError(
+                'Failed to delete %d object(s)' % len(self.failed))
+        return result
 
 
 class ShowObject(show.ShowOne):
@@ -277,8 +364,23 @@ class ListObject(lister.Lister):
         parser.add_argument(
             '--limit',
             metavar='<limit>',
+            type=int,
             help='Limit the number of objects returned'
         )
+        parser.add_argument(
+            '--concurrency',
+            metavar='<concurrency>',
+            type=int,
+            default=1,
+            help='Number of ranges of names listed at the same time, '
+                 'not compatible with --delimiter'
+        )
+        parser.add_argument(
+            '--alphabet',
+            metavar='<characters>',
+            help='Characters following the prefix '
+                 'at the start of the ranges listed at the same time'
+        )
         return parser
 
     def take_action(self, parsed_args):
@@ -286,17 +388,34 @@ class ListObject(lister.Lister):
 
         container = parsed_args.container
 
-        resp = self.app.client_manager.storage.object_list(
-            self.app.client_manager.get_account(),
-            container,
-            limit=parsed_args.limit,
-            marker=parsed_args.marker,
-            end_marker=parsed_args.end_marker,
-            prefix=parsed_args.prefix,
-            delimiter=parsed_args.delimiter
-        )
-        l = resp['objects']
-        results = ((obj['name'], obj['size'], obj['hash']) for obj in l)
+        storage = self.app.client_manager.storage
+        account = self.app.client_manager.get_account()
+        # the pages are requested while the rows are printed
+        if parsed_args.concurrency > 1 and not parsed_args.delimiter:
+            kwargs = {}
+            if parsed_args.alphabet:
+                kwargs['alphabet'] = parsed_args.alphabet
+            objs = storage.object_list_parallel(
+                account,
+                container,
+                limit=parsed_args.limit,
+                marker=parsed_args.marker,
+                end_marker=parsed_args.end_marker,
+                prefix=parsed_args.prefix,
+                concurrency=parsed_args.concurrency,
+                **kwargs
+            )
+        else:
+            objs = storage.object_list_iter(
+                account,
+                container,
+                limit=parsed_args.limit,
+                marker=parsed_args.marker,
+                end_marker=parsed_args.end_marker,
+                prefix=parsed_args.prefix,
+                delimiter=parsed_args.delimiter
+            )
+        results = ((obj['name'], obj['size'], obj['hash']) for obj in objs)
         columns = ('Name', 'Size', 'Hash')
         return (columns, results)
 
@@ -0,0 +1,80 @@
+import itertools
+import logging
+import multiprocessing
+
+from eventlet import hubs
+
+from oiopy import io
+
+
+LOG = logging.getLogger(__name__)
+
+# number of tasks handed to the pool at once, for each worker
+TASKS_PER_WORKER = 16
+
+# the storage client of the current worker process
+_client = None
+
+
+def _init_worker(client_factory):
+    global _client
+    # the hub and the idle connections are inherited
+    # from the parent process, the worker needs its own
+    hubs.use_hub()
+    io.CONNECTION_POOL.clear()
+    _client = client_factory()
+
+
+def _run_task(args):
+    func, task = args
+    return func(_client, *task)
+
+
+def process_map(func, tasks, client, workers=1, client_factory=None):
+    """
+    Run func(client, *task) for each task.
+
+    With more than one worker, the tasks are spread across a pool
+    of processes, each one with its own client and eventlet hub,
+    so hashing and EC coding are not bound to a single core.
+
+    :param func: module level function called with a storage client
+                 and the arguments of a task
+    :param tasks: iterable of tuples of arguments,
+                  consumed as the results are yielded
+    :param client: the storage client used without workers
+    :param workers: number of processes
+    :param client_factory: builds the storage client of a worker process
+    :returns: generator of the results, in the order of the tasks
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield func(client, *task)
+        return
+
+    LOG.debug('Starting %d workers', workers)
+    pool = multiprocessing.Pool(workers, _init_worker, (client_factory,))
+    tasks = iter(tasks)
+    try:
+        # the tasks are read from this thread, by batches,
+        # as they may come from a generator using the eventlet hub
+        while True:
+            batch = [(func, task) for task in
+                     itertools.islice(tasks, workers * TASKS_PER_WORKER)]
+            if not batch:
+                break
+            for result in pool.imap(_run_task, batch):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def log_throughput(log, nb_objects, nb_bytes, elapsed):
+    """
+    Log the aggregate throughput of an operation on several objects.
+    """
+    elapsed = max(elapsed, 0.000001)
+    log.info('%d object(s), %d bytes in %.3fs (%.3f MB/s, %.3f objects/s)',
+             nb_objects, nb_bytes, elapsed,
+             nb_bytes / elapsed / 1048576, nb_objects / elapsed)
@@ -15,8 +15,10 @@ import collections
 import math
 import hashlib
 import logging
+import time
 from urlparse import urlparse
 from eventlet import Queue, Timeout, GreenPile
+from eventlet.semaphore import Semaphore
 from oiopy import utils
 from greenlet import GreenletExit
 from oiopy import exceptions as exc
@@ -29,6 +31,14 @@ from oiopy.constants import chunk_headers
 
 logger = logging.getLogger(__name__)
 
+# number of fragment readers opened in addition to the ec_nb_data
+# needed, each segment is then decoded from the first fragments received
+EC_EXTRA_READERS = 0
+# number of fragments a reader may read ahead of the decoded segment
+FRAGMENT_READ_AHEAD = 2
+# number of consecutive useless fragments before a reader is cancelled
+SLOW_READER_LAG = 3
+
 
 def segment_range_to_fragment_range(segment_start, segment_end, segment_size,
                                     fragment_size):
@@ -60,46 +70,50 @@ def obj_range_to_meta_chunk_range(obj_start, obj_end, meta_sizes):
 
     Examples:
 
-    TODO complete examples
     (20, 150, [50, 50]) = {0: (20, None), 1: (None, None)}
-    (20, 150, [50, 100]) = {0: (20, None), 1: (None, 100)}
+    (20, 120, [50, 100]) = {0: (20, None), 1: (0, 70)}
     (150, None, [100, 100]) = {1: (50, None)}
+    (None, 10, [100, 100]) = {1: (90, None)}
 
-    :returns: a tuple list (pos, meta_chunk_start, meta_chunk_end)
+    :returns: a dict {pos: (meta_chunk_start, meta_chunk_end)}
 
         * pos is the meta chunk position
 
         * meta_chunk_start is the first byte of the meta chunk,
-          or None if this is a suffix byte range
+          or None if the whole meta chunk is requested
 
         * meta_chunk_end is the last byte of the meta_chunk,
           or None if this is a prefix byte range
     """
+    if obj_start is None and obj_end is not None:
+        # suffix byte range
+        if obj_end == 0:
+            return {}
+        obj_start = max(0, sum(meta_sizes) - obj_end)
+        obj_end = None
 
     offset = 0
-    found_start = False
-    found_end = False
     meta_chunk_ranges = {}
     for pos, meta_size in enumerate(meta_sizes):
-        if found_start:
-            meta_chunk_start = None
-        elif obj_start is not None and obj_start > offset + meta_size:
+        if obj_end is not None and obj_end < offset:
+            # found end
+            break
+        if obj_start is not None and obj_start >= offset + meta_size:
+            # the range starts after this meta chunk
             offset += meta_size
             continue
-        elif obj_start is not None and obj_start <= offset + meta_size:
+
+        if obj_start is not None and obj_start > offset:
             meta_chunk_start = obj_start - offset
-            found_start = True
         else:
             meta_chunk_start = None
-        if obj_end is not None and offset + meta_size >= obj_end:
+        if obj_end is not None and obj_end < offset + meta_size - 1:
             meta_chunk_end = obj_end - offset
-            # found end
-            found_end = True
+            if meta_chunk_start is None:
+                meta_chunk_start = 0
         else:
             meta_chunk_end = None
         meta_chunk_ranges[pos] = (meta_chunk_start, meta_chunk_end)
-        if found_end:
-            break
         offset += meta_size
 
     return meta_chunk_ranges
@@ -140,7 +154,8 @@ class ECChunkDownloadHandler(object):
     """
     def __init__(self, storage_method, chunks, meta_start, meta_end, headers,
                  connection_timeout=None, response_timeout=None,
-                 read_timeout=None):
+                 read_timeout=None, extra_readers=EC_EXTRA_READERS,
+                 read_chunk_size=None):
         self.storage_method = storage_method
         self.chunks = chunks
         self.meta_start = meta_start
@@ -149,6 +164,8 @@ class ECChunkDownloadHandler(object):
         self.connection_timeout = connection_timeout
         self.response_timeout = response_timeout
         self.read_timeout = read_timeout
+        self.extra_readers = extra_readers
+        self.read_chunk_size = read_chunk_size
 
     def _get_range_infos(self):
         """
@@ -180,28 +197,49 @@ class ECChunkDownloadHandler(object):
             'req_fragment_end': fragment_end})
         return range_infos
 
-    def _get_fragment(self, chunk_iter, storage_method):
-        # TODO generate proper headers
+    def _get_fragment(self, chunk_iter, range_infos, storage_method):
         headers = {}
+        if range_infos:
+            # only read the fragments of the requested segments
+            headers['Range'] = utils.http_header_from_ranges(
+                [(r['req_fragment_start'], r['req_fragment_end'])
+                 for r in range_infos])
         reader = io.ChunkReader(chunk_iter, storage_method.ec_fragment_size,
                                 headers, self.connection_timeout,
-                                self.response_timeout, self.read_timeout)
+                                self.response_timeout, self.read_timeout,
+                                read_chunk_size=self.read_chunk_size)
         return (reader, reader.get_iter())
 
+    def _sort_chunks(self):
+        """
+        Put the data fragments first, unless their service is unhealthy,
+        then try the fastest services first.
+
+        With all the data fragments, systematic codes rebuild the segments
+        by concatenating them, which is much faster than decoding.
+        """
+        nb_data = self.storage_method.ec_nb_data
+        return io.HOST_STATS.sort(
+            self.chunks, key=lambda chunk: chunk.get('num', 0) >= nb_data)
+
     def get_stream(self):
         range_infos = self._get_range_infos()
 
         # the meta chunk length
         # (the amount of actual data stored into the meta chunk)
         meta_length = self.chunks[0]['size']
-        chunk_iter = iter(self.chunks)
+        chunk_iter = iter(self._sort_chunks())
+
+        nb_readers = min(self.storage_method.ec_nb_data + self.extra_readers,
+                         len(self.chunks))
 
         # we use eventlet GreenPool to manage readers
-        with utils.ContextPool(self.storage_method.ec_nb_data) as pool:
+        with utils.ContextPool(nb_readers) as pool:
             pile = GreenPile(pool)
             # we use eventlet GreenPile to spawn readers
-            for _j in range(self.storage_method.ec_nb_data):
-                pile.spawn(self._get_fragment, chunk_iter, self.storage_method)
+            for _j in range(nb_readers):
+                pile.spawn(self._get_fragment, chunk_iter, range_infos,
+                           self.storage_method)
 
             readers = []
             for reader, parts_iter in pile:
@@ -358,6 +396,103 @@ class ECStream(object):
 
                 yield segment
 
+    def _decode_fastest_segments(self, fragment_iterators):
+        """
+        Reads from more fragment iterators than needed,
+        each segment is decoded from the first fragments received,
+        so a slow reader does not stall the stream.
+        """
+        nb_data = self.storage_method.ec_nb_data
+        nb_readers = len(fragment_iterators)
+
+        # the fragments of all the readers, as (reader index, fragment)
+        arrivals = Queue()
+        # limit the number of fragments read ahead by each reader
+        tokens = [Semaphore(FRAGMENT_READ_AHEAD) for _j in range(nb_readers)]
+
+        def read_fragments(index, fragment_iterator):
+            """
+            Coroutine to read the fragments from the iterator
+            """
+            try:
+                for fragment in fragment_iterator:
+                    tokens[index].acquire()
+                    arrivals.put((index, fragment))
+            except GreenletExit:
+                # ignore
+                pass
+            except ChunkReadTimeout:
+                logger.error("Timeout on reading")
+            except Exception:
+                logger.exception("Exception on reading")
+            finally:
+                # put None to indicate the decoding loop
+                # this reader is over
+                arrivals.put((index, None))
+                # close the iterator
+                fragment_iterator.close()
+
+        # we use eventlet GreenPool to manage the read of fragments
+        with utils.ContextPool(nb_readers) as pool:
+            readers = [pool.spawn(read_fragments, index, fragment_iterator)
+                       for index, fragment_iterator
+                       in enumerate(fragment_iterators)]
+
+            # number of fragments received from each reader
+            positions = [0] * nb_readers
+            # consecutive useless fragments received from each reader
+            late = [0] * nb_readers
+            alive = set(range(nb_readers))
+            # segment position -> {reader index: fragment}
+            fragments = collections.defaultdict(dict)
+            current = 0
+
+            # main decoding loop
+            while True:
+                received = fragments[current]
+                if len(received) >= nb_data:
+                    del fragments[current]
+                    for index in received:
+                        tokens[index].release()
+                    current += 1
+                    # actually decode the fragments into a segment
+                    try:
+                        segment = self.storage_method.driver.decode(
+                            received.values())
+                    except exc.ECError:
+                        # something terrible happened
+                        logger.exception("ERROR decoding fragments")
+                        raise
+
+                    yield segment
+                    continue
+
+                # the readers which may still give a fragment
+                # of the current segment
+                nb_candidates = len([index for index in alive
+                                     if positions[index] <= current])
+                if len(received) + nb_candidates < nb_data:
+                    # impossible to read segment
+                    break
+
+                index, fragment = arrivals.get()
+                if not fragment:
+                    alive.discard(index)
+                    continue
+                position = positions[index]
+                positions[index] += 1
+                if position < current:
+                    # the segment has been decoded without it
+                    tokens[index].release()
+                    late[index] += 1
+                    if late[index] >= SLOW_READER_LAG and \
+                            len(alive) > nb_data:
+                        logger.warn("Cancelling slow fragment reader")
+                        readers[index].kill()
+                    continue
+                late[index] = 0
+                fragments[position][index] = fragment
+
     def _convert_range(self, req_start, req_end, length):
         try:
             ranges = utils.ranges_from_http_header("bytes=%s-%s" % (
@@ -456,7 +591,11 @@ class ECStream(object):
                     results.setdefault(k, []).append(range_info)
 
                 range_info = results[(fragment_start, fragment_end)].pop(0)
-                segment_iter = self._decode_segments(fragment_iters)
+                if len(fragment_iters) > self.storage_method.ec_nb_data:
+                    segment_iter = self._decode_fastest_segments(
+                        fragment_iters)
+                else:
+                    segment_iter = self._decode_segments(fragment_iters)
 
                 if not range_info['satisfiable']:
                     io.consume(segment_iter)
@@ -482,81 +621,69 @@ class ECStream(object):
 def ec_encode(storage_method, n):
     """
     Encode EC segments
+
+    Input data is copied into a reusable segment buffer,
+    which is given to the EC driver without copy once full.
+    Yields the list of the fragments of each encoded segment.
     """
     segment_size = storage_method.ec_segment_size
 
-    buf = collections.deque()
-    total_len = 0
+    segment = bytearray(segment_size)
+    segment_view = memoryview(segment)
+    filled = 0
 
     data = yield
     while data:
-        buf.append(data)
-        total_len += len(data)
-
-        if total_len >= segment_size:
-            data_to_encode = []
-
-            while total_len >= segment_size:
-                # take data from buf
-                amount = segment_size
-                # the goal here is to encode a full segment
-                parts = []
-                while amount > 0:
-                    part = buf.popleft()
-                    if len(part) > amount:
-                        # too much data taken
-                        # put the extra data back into the buf
-                        buf.appendleft(part[amount:])
-                        part = part[:amount]
-                    parts.append(part)
-                    amount -= len(part)
-                    total_len -= len(part)
-                data_to_encode.append(''.join(parts))
-
-            # let's encode!
-            encode_result = []
-            for d in data_to_encode:
-                encode_result.append(storage_method.driver.encode(d))
-
-            # transform the result
-            #
-            # from:
+        data_view = memoryview(data)
+        data_len = len(data_view)
+        encode_result = []
+        offset = 0
+        while offset < data_len:
+            # fill the segment
+            amount = min(segment_size - filled, data_len - offset)
+            segment_view[filled:filled + amount] = \
+                data_view[offset:offset + amount]
+            filled += amount
+            offset += amount
+
+            if filled == segment_size:
+                # let's encode!
+                # the driver only accepts the old buffer interface
+                encode_result.append(
+                    storage_method.driver.encode(buffer(segment)))
+                filled = 0
+
+        if encode_result:
             # [[fragment_0_0, fragment_1_0, fragment_2_0, ...],
             #  [fragment_0_1, fragment_1_1, fragment_2_1, ...], ...]
             #
-            # to:
-            #
-            # [(fragment_0_0 + fragment_0_1 + ...), # write to chunk 0
-            # [(fragment_1_0 + fragment_1_1 + ...), # write to chunk 1
-            # [(fragment_2_0 + fragment_2_1 + ...), # write to chunk 2
-            #  ...]
-
-            result = [''.join(p) for p in zip(*encode_result)]
-            data = yield result
+            # each segment fragments are written in turn to the chunks,
+            # fragment_0_x to chunk 0, fragment_1_x to chunk 1...
+            data = yield encode_result
         else:
             # not enough data to encode
             data = yield None
 
     # empty input data
     # which means end of stream
-    # encode what is left in the buf
-    whats_left = ''.join(buf)
-    if whats_left:
-        last_fragments = storage_method.driver.encode(whats_left)
-        yield last_fragments
+    # encode what is left in the segment
+    if filled:
+        yield [storage_method.driver.encode(buffer(segment, 0, filled))]
     else:
-        yield [''] * n
+        yield []
 
 
 class ECWriter(object):
     """
     Writes an EC chunk
     """
-    def __init__(self, chunk, conn):
+    def __init__(self, chunk, conn, settings=None):
         self._chunk = chunk
         self._conn = conn
+        self.settings = settings or io.IOSettings()
         self.failed = False
         self.bytes_transferred = 0
+        self.send_time = 0.0
         self.checksum = hashlib.md5()
 
     @property
@@ -568,7 +695,8 @@ class ECWriter(object):
         return self._conn
 
     @classmethod
-    def connect(cls, chunk, sysmeta):
+    def connect(cls, chunk, sysmeta, settings=None):
+        settings = settings or io.IOSettings()
         raw_url = chunk["url"]
         parsed = urlparse(raw_url)
         chunk_path = parsed.path.split('/')[-1]
@@ -587,15 +715,16 @@ class ECWriter(object):
         # metachunk_size & metachunk_hash
         h["Trailer"] = (chunk_headers["metachunk_size"],
                         chunk_headers["metachunk_hash"])
-        with ConnectionTimeout(io.CONNECTION_TIMEOUT):
+        with ConnectionTimeout(settings.connection_timeout):
             conn = io.http_connect(
-                parsed.netloc, 'PUT', parsed.path, h)
+                parsed.netloc, 'PUT', parsed.path, h,
+                pool=io.CONNECTION_POOL)
             conn.chunk = chunk
-        return cls(chunk, conn)
+        return cls(chunk, conn, settings=settings)
 
     def start(self, pool):
         # we use eventlet Queue to pass data to the send coroutine
-        self.queue = Queue(io.PUT_QUEUE_DEPTH)
+        self.queue = Queue(self.settings.put_queue_depth)
         # spawn the send coroutine
         pool.spawn(self._send)
 
@@ -607,11 +736,11 @@ class ECWriter(object):
             # use HTTP transfer encoding chunked
             # to write data to RAWX
             if not self.failed:
-                # format the chunk
-                to_send = "%x\r\n%s\r\n" % (len(d), d)
                 try:
-                    with ChunkWriteTimeout(io.CHUNK_TIMEOUT):
-                        self.conn.send(to_send)
+                    with ChunkWriteTimeout(self.settings.chunk_timeout):
+                        start = time.time()
+                        self.conn.send(io.frame_chunk(d))
+                        self.send_time += time.time() - start
                         self.bytes_transferred += len(d)
                 except (Exception, ChunkWriteTimeout) as e:
                     self.failed = True
@@ -650,19 +779,33 @@ class ECWriter(object):
 
     def getresponse(self):
         # read the HTTP response from the connection
-        with Timeout(io.CHUNK_TIMEOUT):
+        with Timeout(self.settings.chunk_timeout):
             self.resp = self.conn.getresponse(True)
+            # drain the response so the connection can be reused
+            self.resp.read()
             return self.resp
 
+    def close(self):
+        io.release_conn(self.conn, getattr(self, 'resp', None))
+
 
 class ECChunkWriteHandler(object):
-    def __init__(self, sysmeta, meta_chunk, checksum, storage_method):
+    def __init__(self, sysmeta, meta_chunk, checksum, storage_method,
+                 settings=None):
         self.sysmeta = sysmeta
         self.meta_chunk = meta_chunk
         self.checksum = checksum
         self.storage_method = storage_method
+        self.settings = settings or io.IOSettings()
 
     def stream(self, source, size):
+        self.write(source, size)
+        return self.wait()
+
+    def write(self, source, size):
+        """
+        Writes the data to the chunks, without waiting for the responses.
+        """
         writers = self._get_writers()
 
         failed_chunks = []
@@ -673,20 +816,38 @@ class ECChunkWriteHandler(object):
             else:
                 current_writers.append(writer)
         # write the data
-        bytes_transferred = self._stream(source, size, current_writers)
+        self._bytes_transferred = self._stream(source, size, current_writers)
+        # each connection received its share of the data,
+        # the slowest one is measured without the source reads
+        sent = [w for w in current_writers if not w.failed]
+        if sent:
+            slowest = max(sent, key=lambda w: w.send_time)
+            self.settings.add_transfer(slowest.bytes_transferred,
+                                       slowest.send_time)
+        self._writers = current_writers
+        self._failed_chunks = failed_chunks
+        self._meta_checksum = self.checksum.hexdigest()
 
+    def wait(self):
+        """
+        Reads the responses of the chunks.
+        """
         # get the chunks from writers
-        chunks, quorum = self._get_results(current_writers)
+        chunks, quorum = self._get_results(self._writers)
 
         if not quorum:
             logger.error('Quorum not reached during write')
             raise exc.OioException('Write failure')
 
-        meta_checksum = self.checksum.hexdigest()
+        final_chunks = chunks + self._failed_chunks
 
-        final_chunks = chunks + failed_chunks
+        # chunks checksum is the metachunk hash
+        # chunks size is the metachunk size
+        for chunk in final_chunks:
+            chunk['hash'] = self._meta_checksum
+            chunk['size'] = self._bytes_transferred
 
-        return bytes_transferred, meta_checksum, final_chunks
+        return self._bytes_transferred, self._meta_checksum, final_chunks
 
     def _stream(self, source, size, writers):
         bytes_transferred = 0
@@ -699,19 +860,20 @@ class ECChunkWriteHandler(object):
         def send(data):
             self.checksum.update(data)
             # get the encoded fragments
-            fragments = ec_stream.send(data)
-            if fragments is None:
+            segments = ec_stream.send(data)
+            if segments is None:
                 # not enough data given
                 return
 
             current_writers = list(writers)
-            for writer in current_writers:
-                fragment = fragments[chunk_index[writer]]
-                if not writer.failed:
-                    writer.checksum.update(fragment)
-                    writer.send(fragment)
-                else:
-                    current_writers.remove(writer)
+            for fragments in segments:
+                for writer in list(current_writers):
+                    fragment = fragments[chunk_index[writer]]
+                    if not writer.failed:
+                        writer.checksum.update(fragment)
+                        writer.send(fragment)
+                    else:
+                        current_writers.remove(writer)
             self._check_quorum(current_writers)
             # TODO handle no quorum
 
@@ -726,16 +888,27 @@ class ECChunkWriteHandler(object):
                 for writer in writers:
                     writer.start(pool)
 
+                # read directly into a reusable buffer when possible,
+                # the data is copied into the segment by the encoder
+                readinto = getattr(source, 'readinto', None)
+                chunk_size = self.settings.write_chunk_size
+                if readinto is not None:
+                    read_view = memoryview(bytearray(chunk_size))
+
                 # the main write loop
                 while True:
                     remaining_bytes = size - bytes_transferred
-                    if io.WRITE_CHUNK_SIZE < remaining_bytes:
-                        read_size = io.WRITE_CHUNK_SIZE
+                    if chunk_size < remaining_bytes:
+                        read_size = chunk_size
                     else:
                         read_size = remaining_bytes
-                    with SourceReadTimeout(io.CLIENT_TIMEOUT):
+                    with SourceReadTimeout(self.settings.client_timeout):
                         try:
-                            data = source.read(read_size)
+                            if readinto is not None:
+                                nb_read = readinto(read_view[:read_size])
+                                data = read_view[:nb_read]
+                            else:
+                                data = source.read(read_size)
                         except (ValueError, IOError) as e:
                             raise SourceReadError(str(e))
                     if len(data) == 0:
@@ -788,7 +961,8 @@ class ECChunkWriteHandler(object):
     def _get_writer(self, chunk):
         # spawn writer
         try:
-            writer = ECWriter.connect(chunk, self.sysmeta)
+            writer = ECWriter.connect(chunk, self.sysmeta,
+                                      settings=self.settings)
             return writer, chunk
         except (Exception, Timeout) as e:
             msg = str(e)
@@ -825,6 +999,9 @@ class ECChunkWriteHandler(object):
         for (writer, resp) in pile:
             _handle_resp(writer, resp)
 
+        for writer in writers:
+            writer.close()
+
         quorum = self._check_quorum(success_chunks)
 
         return success_chunks + failed_chunks, quorum
@@ -857,7 +1034,7 @@ class ECWriteHandler(io.WriteHandler):
     """
     def stream(self):
         # the checksum context for the content
-        global_checksum = hashlib.md5()
+        global_checksum = self.checksum
         total_bytes_transferred = 0
         content_chunks = []
 
@@ -878,21 +1055,16 @@ class ECWriteHandler(io.WriteHandler):
         #  ..}
         #
         # iterate through the meta chunks
-        for pos in xrange(len(self.chunks)):
-            meta_chunk = self.chunks[pos]
-
-            handler = ECChunkWriteHandler(self.sysmeta, meta_chunk,
-                                          global_checksum,
-                                          self.storage_method)
-            bytes_transferred, checksum, chunks = handler.stream(self.source,
-                                                                 max_size)
-
-            # chunks checksum is the metachunk hash
-            # chunks size is the metachunk size
-            for chunk in chunks:
-                chunk['hash'] = checksum
-                chunk['size'] = bytes_transferred
-
+        def handlers():
+            for pos, meta_chunk in self._meta_chunks():
+                handler = ECChunkWriteHandler(self.sysmeta, meta_chunk,
+                                              global_checksum,
+                                              self.storage_method,
+                                              settings=self.settings)
+                yield handler, max_size
+
+        for bytes_transferred, checksum, chunks in \
+                self._stream_meta_chunks(handlers()):
             total_bytes_transferred += bytes_transferred
             # add the chunks to the content chunk list
             content_chunks += chunks
@@ -920,12 +1092,15 @@ class ECRebuildHandler(object):
         try:
             with ConnectionTimeout(self.connection_timeout):
                 conn = io.http_connect(
-                    parsed.netloc, 'GET', parsed.path, headers)
+                    parsed.netloc, 'GET', parsed.path, headers,
+                    pool=io.CONNECTION_POOL)
 
             with Timeout(self.response_timeout):
                 resp = conn.getresponse()
+                resp.conn = conn
             if resp.status != 200:
                 logger.warning('Invalid GET response from %s', chunk)
+                io.close_source(resp)
                 resp = None
         except (Exception, Timeout):
             logger.exception('ERROR fetching %s', chunk)
@@ -968,20 +1143,24 @@ class ECRebuildHandler(object):
 
         def frag_iter():
             pile = GreenPile(len(resps))
-            while True:
+            try:
+                while True:
+                    for resp in resps:
+                        pile.spawn(_get_frag, resp)
+                    try:
+                        with Timeout(self.read_timeout):
+                            frag = [frag for frag in pile]
+                    except (Exception, Timeout):
+                        # TODO complete error message
+                        logger.exception('ERROR rebuilding')
+                        break
+                    if not all(frag):
+                        break
+                    rebuilt_frag = self._reconstruct(frag)
+                    yield rebuilt_frag
+            finally:
                 for resp in resps:
-                    pile.spawn(_get_frag, resp)
-                try:
-                    with Timeout(self.read_timeout):
-                        frag = [frag for frag in pile]
-                except (Exception, Timeout):
-                    # TODO complete error message
-                    self.logger.exception('ERROR rebuilding')
-                    break
-                if not all(frag):
-                    break
-                rebuilt_frag = self._reconstruct(frag)
-                yield rebuilt_frag
+                    io.close_source(resp)
 
         return frag_iter()
 
@@ -39,6 +39,9 @@ def set_http_requests(cb):
             self.req = req
             self.resp = None
 
+        def send(self, data):
+            self.req.setdefault('body', []).append(data)
+
         def getresponse(self, junk=False):
             self.resp = cb(self.req)
             return self.resp
@@ -50,7 +53,7 @@ def set_http_requests(cb):
         def __len__(self):
             return len(self.records)
 
-        def __call__(self, host, method, path, headers):
+        def __call__(self, host, method, path, headers, **kwargs):
             req = {'host': host,
                    'method': method,
                    'path': path,
@@ -144,6 +147,8 @@ def fake_http_connect(*status_iter, **kwargs):
         if kwargs.get("slow_connect", False):
             sleep(1)
         i, status = next(conn_id_status_iter)
+        if kwargs.get('cb_request'):
+            kwargs['cb_request'](i, *args, **ckwargs)
         return FakeConn(status, body=body, headers=headers, conn_id=i,
                         cb_body=kwargs.get('cb_body'))
 
@@ -11,15 +11,304 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+import collections
 import re
+import select
+import socket
+import time
 from eventlet import patcher
-from eventlet.green.httplib import HTTPConnection
+from eventlet.green.httplib import HTTPConnection, BadStatusLine
 
 requests = patcher.import_patched('requests.__init__')
+# imported after requests, to get the modules using green sockets
+from requests.adapters import HTTPAdapter  # noqa
+from urllib3.connectionpool import HTTPConnectionPool, \
+    HTTPSConnectionPool  # noqa
+from urllib3.poolmanager import PoolManager  # noqa
 
+# max number of idle connections kept by a pool
+POOL_MAX_IDLE = 128
+# max number of idle connections kept for a single host
+POOL_MAX_PER_HOST = 16
+# idle connections older than this are not reused
+POOL_IDLE_TIMEOUT = 4
+# max number of bytes sent on a reused connection kept to be sent again
+# on a new connection, if the reused one turns out to be closed
+POOL_REPLAY_SIZE = 262144
 
-def http_connect(host, method, path, headers=None):
-    conn = HTTPConnection(host)
+# max number of connections kept for each proxy or account service
+PROXY_POOL_SIZE = 10
+# wait for a connection to be released instead of opening a new one
+# when PROXY_POOL_SIZE connections are in use
+PROXY_POOL_BLOCK = False
+# idle connections to the proxy older than this are not reused
+PROXY_IDLE_TIMEOUT = POOL_IDLE_TIMEOUT
+
+
+def _is_dropped(conn):
+    """
+    Check if an idle connection has been closed by the remote end.
+
+    An idle keep-alive socket should not be readable,
+    if it is, we either got EOF or garbage.
+    """
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable, _w, _x = select.select([sock], [], [], 0)
+    except Exception:
+        return True
+    return bool(readable)
+
+
+class PooledConnection(HTTPConnection):
+    """
+    HTTP connection which may be kept alive by a ConnectionPool.
+
+    The remote end may close an idle connection after it has been
+    checked and before the request is sent: the first failure of a
+    reused connection is retried once on a new connection,
+    as long as the data already sent can be sent again.
+    """
+    pool_key = None
+
+    def __init__(self, *args, **kwargs):
+        HTTPConnection.__init__(self, *args, **kwargs)
+        # data sent since the connection has been reused,
+        # None when the request cannot be retried
+        self._replay = None
+        self._replay_size = 0
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        # send the small writes (headers, chunk trailers) right away
+        # instead of waiting for the ACK of the previous ones
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def reuse(self):
+        """
+        Mark the connection as taken from the idle connections.
+        """
+        self._replay = []
+        self._replay_size = 0
+
+    def _reconnect(self):
+        replay = self._replay
+        self._replay = None
+        # do not use close(), it would reset the state of the request
+        sock, self.sock = self.sock, None
+        if sock:
+            sock.close()
+        self.connect()
+        for data in replay:
+            HTTPConnection.send(self, data)
+
+    def send(self, data):
+        if self._replay is None or hasattr(data, 'read'):
+            self._replay = None
+            return HTTPConnection.send(self, data)
+        try:
+            HTTPConnection.send(self, data)
+        except socket.error:
+            self._reconnect()
+            HTTPConnection.send(self, data)
+            return
+        self._replay_size += len(data)
+        if self._replay_size > POOL_REPLAY_SIZE:
+            self._replay = None
+        else:
+            self._replay.append(data)
+
+    def getresponse(self, *args, **kwargs):
+        if self._replay is None:
+            return HTTPConnection.getresponse(self, *args, **kwargs)
+        try:
+            return HTTPConnection.getresponse(self, *args, **kwargs)
+        except (socket.error, BadStatusLine):
+            self._reconnect()
+            return HTTPConnection.getresponse(self, *args, **kwargs)
+        finally:
+            self._replay = None
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle HTTP keep-alive connections, indexed by host.
+    """
+    def __init__(self, max_idle=POOL_MAX_IDLE,
+                 max_per_host=POOL_MAX_PER_HOST,
+                 idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        # host -> deque of (conn, release time), most recent on the right
+        self._idle = collections.defaultdict(collections.deque)
+        self._nb_idle = 0
+        self.stats = {'hits': 0, 'misses': 0, 'released': 0,
+                      'discarded': 0}
+
+    def __len__(self):
+        return self._nb_idle
+
+    def get(self, host):
+        """
+        Get a connection to host, reuse an idle one if possible.
+        """
+        idle = self._idle.get(host)
+        now = time.time()
+        while idle:
+            conn, released = idle.pop()
+            self._nb_idle -= 1
+            if now - released < self.idle_timeout and not _is_dropped(conn):
+                self.stats['hits'] += 1
+                conn.reuse()
+                return conn
+            self.stats['discarded'] += 1
+            conn.close()
+        self.stats['misses'] += 1
+        conn = PooledConnection(host)
+        conn.pool_key = host
+        return conn
+
+    def release(self, conn, resp=None):
+        """
+        Give back a connection to the pool.
+
+        The connection is only kept if resp has been fully read
+        and the remote end did not ask to close the connection,
+        otherwise the connection is closed.
+        """
+        key = getattr(conn, 'pool_key', None)
+        if key is None or resp is None or not self._reusable(resp):
+            conn.close()
+            return
+        idle = self._idle[key]
+        if len(idle) >= self.max_per_host:
+            old_conn, _released = idle.popleft()
+            self._nb_idle -= 1
+            self.stats['discarded'] += 1
+            old_conn.close()
+        if self._nb_idle >= self.max_idle:
+            self.stats['discarded'] += 1
+            conn.close()
+            return
+        idle.append((conn, time.time()))
+        self._nb_idle += 1
+        self.stats['released'] += 1
+
+    def _reusable(self, resp):
+        # a fully read response with a known length is closed
+        # and its remaining length is 0
+        return (resp.isclosed() and not resp.will_close and
+                not resp.chunked and not resp.length)
+
+    def clear(self):
+        """
+        Close all the idle connections.
+        """
+        for idle in self._idle.values():
+            while idle:
+                conn, _released = idle.pop()
+                conn.close()
+        self._idle.clear()
+        self._nb_idle = 0
+
+
+class _CountingPoolMixin(object):
+    """
+    Counts the connections of a urllib3 pool reused or opened,
+    and closes the ones idle for too long.
+    """
+    adapter = None
+
+    def _get_conn(self, timeout=None):
+        conn = super(_CountingPoolMixin, self)._get_conn(timeout=timeout)
+        stats = self.adapter.stats
+        idle_since = getattr(conn, 'idle_since', None)
+        if conn.sock is not None and idle_since is not None and \
+                time.time() - idle_since >= self.adapter.idle_timeout:
+            stats['discarded'] += 1
+            conn.close()
+        if conn.sock is None:
+            stats['misses'] += 1
+        else:
+            stats['hits'] += 1
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            if not self.adapter.keep_alive:
+                conn.close()
+            conn.idle_since = time.time()
+        super(_CountingPoolMixin, self)._put_conn(conn)
+
+
+class _CountingHTTPPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CountingPoolManager(PoolManager):
+    def __init__(self, adapter, *args, **kwargs):
+        super(_CountingPoolManager, self).__init__(*args, **kwargs)
+        self.adapter = adapter
+        self.pool_classes_by_scheme = {'http': _CountingHTTPPool,
+                                       'https': _CountingHTTPSPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(_CountingPoolManager, self)._new_pool(
+            scheme, host, port, request_context=request_context)
+        pool.adapter = self.adapter
+        return pool
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Adapter of a requests session, keeping the connections to each
+    service alive, unless they are idle for too long.
+
+    The connections reused (hits), opened (misses) and closed because
+    they were idle for too long (discarded) are counted in stats.
+    """
+    def __init__(self, pool_connections=PROXY_POOL_SIZE,
+                 pool_maxsize=PROXY_POOL_SIZE, max_retries=0,
+                 pool_block=PROXY_POOL_BLOCK, idle_timeout=PROXY_IDLE_TIMEOUT,
+                 keep_alive=True):
+        self.idle_timeout = idle_timeout
+        self.keep_alive = keep_alive
+        self.stats = {'hits': 0, 'misses': 0, 'discarded': 0}
+        super(PooledAdapter, self).__init__(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            max_retries=max_retries, pool_block=pool_block)
+
+    def init_poolmanager(self, connections, maxsize, block=False,
+                         **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _CountingPoolManager(
+            self, num_pools=connections, maxsize=maxsize, block=block,
+            strict=True, **pool_kwargs)
+
+    def resize(self, maxsize):
+        """
+        Keep up to maxsize connections for each service,
+        the current connections are closed.
+        """
+        self.poolmanager.clear()
+        self.init_poolmanager(self._pool_connections, maxsize,
+                              block=self._pool_block)
+
+
+def http_connect(host, method, path, headers=None, pool=None):
+    if pool is not None:
+        conn = pool.get(host)
+    else:
+        conn = PooledConnection(host)
     conn.path = path
     conn.putrequest(method, path)
     if headers:
@@ -11,14 +11,22 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+import collections
+import hashlib
 import itertools
 import logging
+import sys
+import time
 from urlparse import urlparse
-from eventlet import sleep, Timeout
+import eventlet
+from eventlet import sleep, Queue, Timeout
+from eventlet.queue import Empty
+from greenlet import GreenletExit
 from oiopy.exceptions import ConnectionTimeout, ChunkReadTimeout
 from oiopy import exceptions as exc
 from oiopy import utils
-from oiopy.http import http_connect, parse_content_type, parse_content_range
+from oiopy.http import http_connect, parse_content_type, \
+    parse_content_range, ConnectionPool
 
 logger = logging.getLogger(__name__)
 
@@ -34,25 +42,513 @@ CLIENT_TIMEOUT = 3
 
 PUT_QUEUE_DEPTH = 10
 
+# the automatic tuning doubles the write block size and the queue depth
+# until the throughput per connection improves by less than this ratio
+TUNE_MIN_GAIN = 0.1
+# number of transfers measured before each tuning step
+TUNE_SAMPLES = 4
+# transfers of less than this number of blocks are not measured
+TUNE_MIN_BLOCKS = 8
+# upper bounds of the automatic tuning
+TUNE_MAX_CHUNK_SIZE = 4194304
+TUNE_MAX_QUEUE_DEPTH = 64
+
+# delay before a read request is also sent to the next replica,
+# if the previous ones did not answer yet, None disables hedged reads,
+# HEDGE_AUTO derives it from the observed response times
+HEDGE_DELAY = None
+HEDGE_AUTO = 'auto'
+# percentile of the response times used as automatic delay
+HEDGE_PERCENTILE = 95
+# number of response times kept
+HEDGE_SAMPLES = 256
+# no automatic delay below this number of response times
+HEDGE_MIN_SAMPLES = 20
+
+# weight of a new measure in the moving averages of the RAWX services
+HOST_STATS_ALPHA = 0.2
+# the errors of a RAWX service are halved after this number of seconds
+HOST_ERROR_HALF_LIFE = 60
+# RAWX services with at least this (decayed) number of errors are unhealthy
+HOST_ERROR_THRESHOLD = 0.5
+# seconds added to the cost of a RAWX service for each (decayed) error
+HOST_ERROR_PENALTY = 1.0
+# the measures of a RAWX service are forgotten after this number of seconds
+HOST_STATS_TTL = 300
+# amount of data used to weigh the throughput against the response time
+HOST_COST_BYTES = 1048576
+
+# keep-alive connections to the RAWX services, shared by the process
+CONNECTION_POOL = ConnectionPool()
+
+
+class IOTuner(object):
+    """
+    Grows the write block size and the queue depth while the throughput
+    measured per connection keeps improving, then stays at the best ones.
+    """
+    def __init__(self, write_chunk_size=WRITE_CHUNK_SIZE,
+                 put_queue_depth=PUT_QUEUE_DEPTH,
+                 max_chunk_size=TUNE_MAX_CHUNK_SIZE,
+                 max_queue_depth=TUNE_MAX_QUEUE_DEPTH,
+                 samples=TUNE_SAMPLES, min_gain=TUNE_MIN_GAIN):
+        self.write_chunk_size = write_chunk_size
+        self.put_queue_depth = put_queue_depth
+        self.max_chunk_size = max_chunk_size
+        self.max_queue_depth = max_queue_depth
+        self.samples = samples
+        self.min_gain = min_gain
+        # (throughput, write block size, queue depth)
+        self.best = None
+        self.settled = False
+        self._bytes = 0
+        self._duration = 0.0
+        self._count = 0
+
+    def add_transfer(self, nb_bytes, duration, write_chunk_size,
+                     put_queue_depth):
+        """
+        Measure a transfer to one connection.
+
+        :param duration: time spent sending the data
+        :param write_chunk_size: block size used by the transfer
+        :param put_queue_depth: queue depth used by the transfer
+        """
+        if self.settled or duration <= 0 or \
+                nb_bytes < TUNE_MIN_BLOCKS * write_chunk_size:
+            return
+        if (write_chunk_size, put_queue_depth) != \
+                (self.write_chunk_size, self.put_queue_depth):
+            # started before the last step, or with other values
+            return
+        self._bytes += nb_bytes
+        self._duration += duration
+        self._count += 1
+        if self._count < self.samples:
+            return
+        throughput = self._bytes / self._duration
+        self._bytes, self._duration, self._count = 0, 0.0, 0
+        if self.best is None or \
+                throughput > self.best[0] * (1 + self.min_gain):
+            self.best = (throughput, self.write_chunk_size,
+                         self.put_queue_depth)
+            self.settled = not self._grow()
+        else:
+            # the returns have flattened
+            _, self.write_chunk_size, self.put_queue_depth = self.best
+            self.settled = True
+
+    def _grow(self):
+        chunk_size = min(self.write_chunk_size * 2, self.max_chunk_size)
+        queue_depth = min(self.put_queue_depth * 2, self.max_queue_depth)
+        if (chunk_size, queue_depth) == \
+                (self.write_chunk_size, self.put_queue_depth):
+            return False
+        self.write_chunk_size = chunk_size
+        self.put_queue_depth = queue_depth
+        return True
+
+    def snapshot(self):
+        return {'write_chunk_size': self.write_chunk_size,
+                'put_queue_depth': self.put_queue_depth,
+                'throughput': self.best[0] if self.best else None,
+                'settled': self.settled}
+
+
+class IOSettings(object):
+    """
+    Block sizes, queue depth and timeouts of the transfers
+    with the RAWX services, the module constants are the defaults.
+    """
+    FIELDS = ('write_chunk_size', 'read_chunk_size', 'put_queue_depth',
+              'connection_timeout', 'chunk_timeout', 'client_timeout')
+
+    def __init__(self, write_chunk_size=None, read_chunk_size=None,
+                 put_queue_depth=None, connection_timeout=None,
+                 chunk_timeout=None, client_timeout=None, tuner=None):
+        self.write_chunk_size = write_chunk_size or WRITE_CHUNK_SIZE
+        self.read_chunk_size = read_chunk_size or READ_CHUNK_SIZE
+        self.put_queue_depth = put_queue_depth or PUT_QUEUE_DEPTH
+        self.connection_timeout = connection_timeout or CONNECTION_TIMEOUT
+        self.chunk_timeout = chunk_timeout or CHUNK_TIMEOUT
+        self.client_timeout = client_timeout or CLIENT_TIMEOUT
+        self.tuner = tuner
+
+    def copy(self, **kwargs):
+        """
+        :returns: settings for one operation, with the given values
+                  in place of the current ones, the write block size
+                  and queue depth come from the tuner unless given
+        """
+        values = dict((name, getattr(self, name)) for name in self.FIELDS)
+        tuner = self.tuner
+        if tuner is not None:
+            if kwargs.get('write_chunk_size') or \
+                    kwargs.get('put_queue_depth'):
+                # the transfers would not measure the tuned values
+                tuner = None
+            else:
+                values['write_chunk_size'] = tuner.write_chunk_size
+                values['put_queue_depth'] = tuner.put_queue_depth
+        values.update((k, v) for k, v in kwargs.items() if v is not None)
+        return IOSettings(tuner=tuner, **values)
+
+    def add_transfer(self, nb_bytes, duration):
+        if self.tuner is not None:
+            self.tuner.add_transfer(nb_bytes, duration,
+                                    self.write_chunk_size,
+                                    self.put_queue_depth)
+
+
+class LatencyStats(object):
+    """
+    Keeps the last response times to compute percentiles.
+    """
+    def __init__(self, size=HEDGE_SAMPLES, min_samples=HEDGE_MIN_SAMPLES):
+        self.samples = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, latency):
+        self.samples.append(latency)
+
+    def percentile(self, pct):
+        """
+        :returns: the pct percentile of the response times,
+                  or None if there are not enough of them
+        """
+        if len(self.samples) < max(self.min_samples, 1):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, len(ordered) * pct // 100)]
+
+
+# time to get the response headers from the RAWX services
+RESPONSE_LATENCY = LatencyStats()
+
+
+class HostStats(object):
+    """
+    Tracks the response time, throughput and errors of each RAWX service,
+    to try the fastest healthy ones first.
+    """
+    def __init__(self, alpha=HOST_STATS_ALPHA,
+                 error_half_life=HOST_ERROR_HALF_LIFE, ttl=HOST_STATS_TTL):
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.ttl = ttl
+        # host -> dict of measures
+        self.hosts = {}
+
+    def clear(self):
+        self.hosts.clear()
+
+    def _get(self, host, now):
+        stats = self.hosts.get(host)
+        if stats is not None and now - stats['updated'] > self.ttl:
+            # too old to tell anything about the service
+            del self.hosts[host]
+            stats = None
+        return stats
+
+    def _update(self, host, now=None):
+        now = now or time.time()
+        stats = self._get(host, now)
+        if stats is None:
+            stats = {'ttfb': None, 'throughput': None, 'errors': 0.0,
+                     'requests': 0, 'failures': 0, 'updated': now}
+            self.hosts[host] = stats
+        # decay the errors up to now
+        stats['errors'] = self._decayed_errors(stats, now)
+        stats['updated'] = now
+        return stats
+
+    def _average(self, previous, value):
+        if previous is None:
+            return value
+        return previous + self.alpha * (value - previous)
+
+    def _decayed_errors(self, stats, now):
+        if not stats['errors']:
+            return 0.0
+        elapsed = max(now - stats['updated'], 0)
+        return stats['errors'] * 0.5 ** (elapsed / self.error_half_life)
+
+    def add_response(self, host, latency):
+        """
+        :param latency: time to get the response headers
+        """
+        stats = self._update(host)
+        stats['requests'] += 1
+        stats['ttfb'] = self._average(stats['ttfb'], latency)
+
+    def add_transfer(self, host, nb_bytes, elapsed):
+        if not host or nb_bytes <= 0 or elapsed <= 0:
+            return
+        stats = self._update(host)
+        stats['throughput'] = self._average(stats['throughput'],
+                                            nb_bytes / elapsed)
+
+    def add_error(self, host):
+        if not host:
+            return
+        stats = self._update(host)
+        stats['requests'] += 1
+        stats['failures'] += 1
+        stats['errors'] += 1
+
+    def _errors(self, host, now):
+        stats = self._get(host, now)
+        if stats is None:
+            return 0.0
+        return self._decayed_errors(stats, now)
+
+    def healthy(self, host, now=None):
+        return self._errors(host, now or time.time()) < HOST_ERROR_THRESHOLD
+
+    def _measured_cost(self, stats):
+        if stats is None or \
+                (stats['ttfb'] is None and not stats['throughput']):
+            return None
+        cost = stats['ttfb'] or 0.0
+        if stats['throughput']:
+            cost += HOST_COST_BYTES / stats['throughput']
+        return cost
+
+    def prior(self, now=None):
+        """
+        :returns: the cost given to the services without measures,
+                  the median cost of the measured ones, so an unknown
+                  service is neither preferred nor avoided
+        """
+        now = now or time.time()
+        costs = sorted(
+            c for c in (self._measured_cost(self._get(host, now))
+                        for host in list(self.hosts))
+            if c is not None)
+        if not costs:
+            return 0.0
+        return costs[len(costs) // 2]
+
+    def cost(self, host, now=None, prior=None):
+        """
+        :returns: the expected time to read from host, in seconds
+        """
+        now = now or time.time()
+        if prior is None:
+            prior = self.prior(now)
+        stats = self._get(host, now)
+        cost = self._measured_cost(stats)
+        if cost is None:
+            cost = prior
+        if stats is None:
+            return cost
+        return cost + self._decayed_errors(stats, now) * HOST_ERROR_PENALTY
+
+    def sort(self, chunks, key=None):
+        """
+        Sort the chunks from the fastest healthy service to the slowest,
+        the order of chunks with the same cost is kept.
+
+        :param key: function of a chunk, its result is compared
+                    after the healthiness and before the cost of the service
+        """
+        now = time.time()
+        prior = self.prior(now)
+
+        def _key(chunk):
+            host = chunk_host(chunk)
+            return (not self.healthy(host, now),
+                    key(chunk) if key else None,
+                    self.cost(host, now, prior))
+        return sorted(chunks, key=_key)
+
+    def snapshot(self):
+        """
+        :returns: dict of the measures of each service
+        """
+        now = time.time()
+        prior = self.prior(now)
+        result = {}
+        for host in list(self.hosts):
+            stats = self._get(host, now)
+            if stats is None:
+                continue
+            result[host] = {
+                'ttfb': stats['ttfb'],
+                'throughput': stats['throughput'],
+                'errors': self._decayed_errors(stats, now),
+                'requests': stats['requests'],
+                'failures': stats['failures'],
+                'age': now - stats['updated'],
+                'healthy': self.healthy(host, now),
+                'cost': self.cost(host, now, prior),
+            }
+        return result
+
+
+# measures of the RAWX services, shared by the process
+HOST_STATS = HostStats()
+
+
+def chunk_host(chunk):
+    """
+    :returns: the address of the service hosting chunk
+    """
+    if not chunk:
+        return None
+    return urlparse(chunk['url']).netloc
+
+
+def frame_chunk(data):
+    """
+    Frame data for a chunked transfer encoding, once
+    for all the connections it is sent to.
+    """
+    return '%x\r\n%s\r\n' % (len(data), data)
+
+
+def release_conn(conn, resp=None):
+    """
+    Give back conn to the connection pool,
+    it is closed if resp has not been fully read.
+    """
+    try:
+        CONNECTION_POOL.release(conn, resp)
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 
 def close_source(source):
     try:
-        source.conn.close()
+        release_conn(source.conn, source)
     except Exception:
         pass
 
 
 class WriteHandler(object):
-    def __init__(self, source, sysmeta, chunks, storage_method, headers):
+    def __init__(self, source, sysmeta, chunks, storage_method, headers,
+                 pipeline_depth=0, settings=None, checksum=None, offset=0,
+                 checkpoint=None, prepare=None):
+        """
+        :param chunks: the meta chunks to write, by position
+        :param checksum: checksum of the content, already fed with
+                         the data of the meta chunks written before
+        :param offset: size of the meta chunks written before
+        :param checkpoint: called with the result of each meta chunk,
+                           in order, once its chunks are written
+        :param prepare: when the size of the content is unknown, called
+                        with the position of each meta chunk to get its
+                        chunks, until the source (a StreamSource) ends
+        """
         self.source = source
         self.chunks = chunks
         self.sysmeta = sysmeta
         self.storage_method = storage_method
         self.headers = headers
+        # number of meta chunks waiting for their responses
+        # while the next one is written
+        self.pipeline_depth = pipeline_depth
+        self.settings = settings or IOSettings()
+        self.checksum = checksum or hashlib.md5()
+        self.offset = offset
+        self.checkpoint = checkpoint
+        self.prepare = prepare
 
     def stream(self):
         raise NotImplementedError()
 
+    def _meta_chunks(self):
+        """
+        :returns: iterable of (position, meta chunk) to write
+        """
+        if self.prepare is None:
+            return sorted(self.chunks.items())
+        return self._prepared_meta_chunks()
+
+    def _prepared_meta_chunks(self):
+        # the previous meta chunk has been read from the source
+        # when the next one is asked, an empty content has one meta chunk
+        pos = 0
+        while pos == 0 or not self.source.at_eof():
+            yield pos, self.prepare(pos)
+            pos += 1
+
+    def _wait_meta_chunk(self, handler):
+        # spawned in a coroutine, the errors are raised by the caller
+        try:
+            return handler.wait(), None
+        except (Exception, Timeout):
+            return None, sys.exc_info()
+
+    def _meta_chunk_done(self, coroutine):
+        result, exc_info = coroutine.wait()
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if self.checkpoint is not None:
+            self.checkpoint(*result)
+        return result
+
+    def _stream_meta_chunks(self, handlers):
+        """
+        Writes the meta chunks one after the other from the source,
+        the responses of the previous meta chunks are read in coroutines.
+
+        :param handlers: iterable of (meta chunk handler, size)
+        :returns: the results of the meta chunk handlers, in order
+        """
+        results = []
+        pending = collections.deque()
+        with utils.ContextPool(self.pipeline_depth + 1) as pool:
+            for handler, size in handlers:
+                handler.write(self.source, size)
+                pending.append(pool.spawn(self._wait_meta_chunk, handler))
+                while len(pending) > self.pipeline_depth:
+                    results.append(self._meta_chunk_done(pending.popleft()))
+            while pending:
+                results.append(self._meta_chunk_done(pending.popleft()))
+        return results
+
+
+class StreamSource(object):
+    """
+    Reads a file object or an iterable of strings of unknown length,
+    and tells whether it has ended without losing any data.
+    """
+    def __init__(self, source, read_size=WRITE_CHUNK_SIZE):
+        if hasattr(source, 'read'):
+            self._iter = iter(lambda: source.read(read_size), '')
+        else:
+            self._iter = iter(source)
+        self._buf = ''
+        self._offset = 0
+
+    def _fill(self):
+        if self._offset >= len(self._buf):
+            self._buf = ''
+            self._offset = 0
+            for data in self._iter:
+                if data:
+                    self._buf = data
+                    break
+
+    def read(self, size=-1):
+        """
+        :returns: up to size bytes, an empty string once the source ended
+        """
+        self._fill()
+        if size < 0:
+            size = len(self._buf) - self._offset
+        data = self._buf[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def at_eof(self):
+        self._fill()
+        return not self._buf
+
 
 def consume(it):
     for _x in it:
@@ -84,6 +580,68 @@ def chain(iterable):
         return []
 
 
+class _Prefetched(object):
+    """
+    Reads a stream in a coroutine and buffers its data.
+    """
+    def __init__(self, pool, stream, depth):
+        self.queue = Queue(depth)
+        pool.spawn(self._run, stream)
+
+    def _run(self, stream):
+        try:
+            for data in stream:
+                self.queue.put((data, None))
+            self.queue.put((None, None))
+        except GreenletExit:
+            pass
+        except Exception:
+            # forward the error to the consumer
+            self.queue.put((None, sys.exc_info()))
+
+    def __iter__(self):
+        while True:
+            data, exc_info = self.queue.get()
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if data is None:
+                return
+            yield data
+
+
+def prefetch(streams, read_ahead, max_bytes, item_size):
+    """
+    Yields the data of each stream in order,
+    while the next `read_ahead` streams are read in coroutines.
+
+    :param streams: list of (not started) data iterators
+    :param read_ahead: number of streams read ahead of the current one
+    :param max_bytes: max amount of data buffered
+    :param item_size: max size of the data yielded by the streams
+    """
+    if read_ahead <= 0 or len(streams) < 2:
+        for stream in streams:
+            for data in stream:
+                yield data
+        return
+
+    nb_active = min(read_ahead + 1, len(streams))
+    depth = max(1, max_bytes // (nb_active * item_size))
+    streams = iter(streams)
+    # one more slot, so the next stream never waits
+    # for the end of the current coroutine
+    with utils.ContextPool(nb_active + 1) as pool:
+        pending = collections.deque(
+            _Prefetched(pool, stream, depth)
+            for stream in itertools.islice(streams, nb_active))
+        while pending:
+            current = pending.popleft()
+            for data in current:
+                yield data
+            for stream in itertools.islice(streams, 1):
+                pending.append(_Prefetched(pool, stream, depth))
+
+
 def iters_to_raw_body(parts_iter):
     try:
         body_iter = next(parts_iter)['iter']
@@ -114,7 +672,8 @@ class ChunkReader(object):
     """
     def __init__(self, chunk_iter, buf_size, headers,
                  connection_timeout=None, response_timeout=None,
-                 read_timeout=None):
+                 read_timeout=None, hedge_delay=HEDGE_DELAY,
+                 read_chunk_size=None):
         self.chunk_iter = chunk_iter
         self.source = None
         # TODO deal with provided headers
@@ -128,6 +687,8 @@ class ChunkReader(object):
         self.connection_timeout = connection_timeout or CONNECTION_TIMEOUT
         self.response_timeout = response_timeout or CHUNK_TIMEOUT
         self.read_timeout = read_timeout or CHUNK_TIMEOUT
+        self.hedge_delay = hedge_delay
+        self.read_chunk_size = read_chunk_size or READ_CHUNK_SIZE
 
     def recover(self, nb_bytes):
         """
@@ -172,30 +733,60 @@ class ChunkReader(object):
             # just add an offset to the request
             self.request_headers['Range'] = 'bytes=%d-' % nb_bytes
 
-    def _get_request(self, chunk):
-        # connect to chunk
+    def _request(self, chunk):
+        """
+        Send the request to chunk.
+
+        :returns: the response if valid, None otherwise
+        """
+        start = time.time()
+        raw_url = chunk["url"]
+        parsed = urlparse(raw_url)
         try:
             with ConnectionTimeout(self.connection_timeout):
-                raw_url = chunk["url"]
-                parsed = urlparse(raw_url)
                 conn = http_connect(parsed.netloc, 'GET', parsed.path,
-                                    self.request_headers)
+                                    self.request_headers,
+                                    pool=CONNECTION_POOL)
             with Timeout(self.response_timeout):
                 source = conn.getresponse(True)
                 source.conn = conn
         except (Exception, Timeout):
             logger.exception('Connection failed to %s', chunk)
-            return False
+            HOST_STATS.add_error(parsed.netloc)
+            return None
         if source.status in (200, 206):
-            self.status = source.status
-            self._headers = source.getheaders()
-            self.sources.append((source, chunk))
+            latency = time.time() - start
+            RESPONSE_LATENCY.add(latency)
+            HOST_STATS.add_response(parsed.netloc, latency)
+            return source
+        logger.warn("Invalid GET response from %s", chunk)
+        if source.status >= 500:
+            HOST_STATS.add_error(parsed.netloc)
+        close_source(source)
+        return None
+
+    def _use_source(self, source, chunk):
+        self.status = source.status
+        self._headers = source.getheaders()
+        self.sources.append((source, chunk))
+
+    def _get_request(self, chunk):
+        source = self._request(chunk)
+        if source:
+            self._use_source(source, chunk)
             return True
-        else:
-            logger.warn("Invalid GET response from %s", chunk)
         return False
 
+    def _get_hedge_delay(self):
+        if self.hedge_delay == HEDGE_AUTO:
+            return RESPONSE_LATENCY.percentile(HEDGE_PERCENTILE)
+        return self.hedge_delay
+
     def _get_source(self):
+        delay = self._get_hedge_delay()
+        if delay is not None:
+            return self._get_source_hedged(delay)
+
         for chunk in self.chunk_iter:
             # continue to iterate until we find a valid source
             if self._get_request(chunk):
@@ -206,6 +797,57 @@ class ChunkReader(object):
             return source, chunk
         return None, None
 
+    def _get_source_hedged(self, delay):
+        """
+        Send the request to the next replica each time the previous
+        ones did not answer within delay, the first valid response wins.
+        """
+        results = Queue()
+        # the losers close their response once a winner is found
+        found = []
+
+        def _request(chunk):
+            source = self._request(chunk)
+            if source and found:
+                close_source(source)
+            else:
+                results.put((source, chunk))
+
+        def _spawn_next():
+            for chunk in self.chunk_iter:
+                eventlet.spawn(_request, chunk)
+                return True
+            return False
+
+        pending = 0
+        more = _spawn_next()
+        if more:
+            pending += 1
+        while pending:
+            try:
+                source, chunk = results.get(timeout=delay if more else None)
+            except Empty:
+                # too slow, ask the next replica as well
+                more = _spawn_next()
+                if more:
+                    pending += 1
+                continue
+            pending -= 1
+            if source:
+                found.append(chunk)
+                # close the responses that arrived meanwhile
+                while not results.empty():
+                    loser, _chunk = results.get()
+                    if loser:
+                        close_source(loser)
+                self._use_source(source, chunk)
+                return self.sources.pop()
+            # this one failed, do not wait to try the next one
+            more = _spawn_next()
+            if more:
+                pending += 1
+        return None, None
+
     def get_iter(self):
         source, chunk = self._get_source()
         if source:
@@ -240,6 +882,7 @@ class ChunkReader(object):
 
     def _get_iter(self, chunk, source):
         source = [source]
+        chunk = [chunk]
 
         try:
             read_size = self.buf_size
@@ -254,7 +897,7 @@ class ChunkReader(object):
                 """
                 while True:
                     try:
-                        with ChunkReadTimeout(CHUNK_TIMEOUT):
+                        with ChunkReadTimeout(self.read_timeout):
                             start, end, length, headers, part = next(
                                 parts_iter[0])
                         return (start, end, length, headers, part)
@@ -265,14 +908,32 @@ class ChunkReader(object):
             def iter_from_resp(part):
                 bytes_consumed = 0
                 count = 0
-                buf = ''
+                # measure the throughput of the current source,
+                # only while reading from it
+                transfer_time = 0.0
+                transfer_bytes = 0
+                # parts of the record being built,
+                # they are joined once the record is complete
+                buf = []
+                buf_len = 0
                 while True:
+                    # only read what is needed to complete the record
+                    if self.discard_bytes:
+                        amount = min(self.read_chunk_size,
+                                     self.discard_bytes)
+                    elif read_size is not None:
+                        amount = min(self.read_chunk_size,
+                                     read_size - buf_len)
+                    else:
+                        amount = self.read_chunk_size
                     try:
                         with ChunkReadTimeout(self.read_timeout):
-                            data = part.read(READ_CHUNK_SIZE)
+                            read_start = time.time()
+                            data = part.read(amount)
+                            transfer_time += time.time() - read_start
                             count += 1
-                            buf += data
                     except ChunkReadTimeout:
+                        HOST_STATS.add_error(chunk_host(chunk[0]))
                         try:
                             self.recover(bytes_consumed)
                         except (exc.UnsatisfiableRange, ValueError):
@@ -280,7 +941,8 @@ class ChunkReader(object):
                         except exc.EmptyByteRange:
                             # we are done already
                             break
-                        buf = ''
+                        buf = []
+                        buf_len = 0
                         # find a new source to perform recovery
                         new_source, new_chunk = self._get_source()
                         if new_source:
@@ -288,6 +950,9 @@ class ChunkReader(object):
                             close_source(source[0])
                             # switch source
                             source[0] = new_source
+                            chunk[0] = new_chunk
+                            transfer_time = 0.0
+                            transfer_bytes = 0
                             parts_iter[0] = make_iter_from_resp(source[0])
                             try:
                                 _j, _j, _j, _j, part = get_next_part()
@@ -300,37 +965,56 @@ class ChunkReader(object):
                             # no valid source found to recover
                             raise
                     else:
-                        # discard bytes
-                        if buf and self.discard_bytes:
-                            if self.discard_bytes < len(buf):
-                                buf = buf[self.discard_bytes:]
-                                bytes_consumed += self.discard_bytes
-                                self.discard_bytes = 0
-                            else:
-                                self.discard_bytes -= len(buf)
-                                bytes_consumed += len(buf)
-                                buf = ''
-
                         # no data returned
                         # flush out buffer
                         if not data:
+                            HOST_STATS.add_transfer(
+                                chunk_host(chunk[0]), transfer_bytes,
+                                transfer_time)
                             if buf:
-                                bytes_consumed += len(buf)
-                                yield buf
-                            buf = ''
+                                record = ''.join(buf)
+                                bytes_consumed += len(record)
+                                yield record
+                            buf = []
                             break
 
+                        transfer_bytes += len(data)
+
+                        # discard bytes
+                        if self.discard_bytes:
+                            if self.discard_bytes < len(data):
+                                data = data[self.discard_bytes:]
+                                bytes_consumed += self.discard_bytes
+                                self.discard_bytes = 0
+                            else:
+                                self.discard_bytes -= len(data)
+                                bytes_consumed += len(data)
+                                data = ''
+
                         # buffer to read_size
                         if read_size is not None:
-                            while len(buf) >= read_size:
-                                read_d = buf[:read_size]
-                                buf = buf[read_size:]
-                                yield read_d
-                                bytes_consumed += len(read_d)
-                        else:
-                            yield buf
-                            bytes_consumed += len(buf)
-                            buf = ''
+                            while data:
+                                needed = read_size - buf_len
+                                if len(data) < needed:
+                                    buf.append(data)
+                                    buf_len += len(data)
+                                    break
+                                if len(data) > needed:
+                                    # the source gave more than requested
+                                    buf.append(data[:needed])
+                                    data = data[needed:]
+                                else:
+                                    buf.append(data)
+                                    data = ''
+                                # a single part is not copied by join
+                                record = ''.join(buf)
+                                buf = []
+                                buf_len = 0
+                                yield record
+                                bytes_consumed += len(record)
+                        elif data:
+                            yield data
+                            bytes_consumed += len(data)
 
                         # avoid starvation by forcing sleep()
                         # every once in a while
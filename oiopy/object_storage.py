@@ -13,12 +13,20 @@
 
 
 from cStringIO import StringIO
+import copy
 from functools import wraps
+import hashlib
 import json
 import logging
+import collections
+import itertools
 import os
+import string
+import sys
+import time
 from urllib import unquote
 
+import eventlet
 
 from oiopy.api import API
 from oiopy.directory import DirectoryAPI
@@ -26,24 +34,178 @@ from oiopy import exceptions as exc
 from oiopy import utils
 from oiopy.storage_method import STORAGE_METHODS
 from oiopy.ec import ECWriteHandler, ECChunkDownloadHandler, \
-    obj_range_to_meta_chunk_range
+    obj_range_to_meta_chunk_range, EC_EXTRA_READERS
 from oiopy.replication import ReplicatedWriteHandler
 from oiopy import constants
 from oiopy.constants import object_headers
 from oiopy import io
+from oiopy.http import requests
 
 
 logger = logging.getLogger(__name__)
 
+# how long a service chosen by the load balancer is kept
+SERVICE_CACHE_TTL = 30
+# max number of services kept for each service type
+SERVICE_CACHE_SIZE = 3
+
+# number of meta chunks downloaded ahead of the one being read
+READ_AHEAD = 1
+# max amount of data buffered by the meta chunks read ahead
+READ_AHEAD_BUFFER_SIZE = 8388608
+# number of meta chunks waiting for their responses
+# while the next one is uploaded
+WRITE_PIPELINE_DEPTH = 1
+
+# number of entries asked for each page of a listing
+LIST_PAGE_SIZE = 1000
+# number of shards of a parallel listing read at the same time
+LIST_CONCURRENCY = 8
+# characters starting the shards of a parallel listing
+LIST_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+# number of objects handled at the same time by the bulk operations
+BULK_CONCURRENCY = 10
+
+# size announced to prepare the first meta chunk of a content
+# of unknown length, when no size hint is given
+STREAM_PREPARE_SIZE = 1
+
 
 def get_meta_ranges(ranges, chunks):
+    """
+    Converts the requested object ranges into meta chunk ranges.
+
+    :returns: a list of (pos, meta_start, meta_end), in the order
+              the data must be returned.
+              Meta chunks outside of the ranges are skipped.
+    """
     range_infos = []
-    meta_sizes = [c[0]['size'] for _p, c in chunks.iteritems()]
+    meta_sizes = [int(chunks[pos][0]['size']) for pos in sorted(chunks)]
     for obj_start, obj_end in ranges:
         meta_ranges = obj_range_to_meta_chunk_range(obj_start, obj_end,
                                                     meta_sizes)
-        range_infos += meta_ranges
-    return meta_ranges
+        for pos, (meta_start, meta_end) in sorted(meta_ranges.iteritems()):
+            range_infos.append((pos, meta_start, meta_end))
+    return range_infos
+
+
+def paginate(list_page, marker=None, limit=None, page_size=LIST_PAGE_SIZE):
+    """
+    Yields the entries of a listing page after page,
+    the next page is requested while the current one is consumed.
+
+    :param list_page: function of (marker, max number of entries)
+                      returning (entries, next marker, truncated)
+    :param limit: max number of entries yielded, None for all of them
+    """
+    def _list_page(marker, size):
+        try:
+            return list_page(marker, size), None
+        except Exception:
+            # forward the error to the consumer
+            return None, sys.exc_info()
+
+    def _request(marker, count):
+        size = page_size
+        if limit is not None:
+            size = min(size, limit - count)
+        if size <= 0:
+            return None
+        return eventlet.spawn(_list_page, marker, size)
+
+    count = 0
+    pending = _request(marker, count)
+    try:
+        while pending is not None:
+            page, exc_info = pending.wait()
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            entries, next_marker, truncated = page
+            if limit is not None:
+                entries = entries[:limit - count]
+            count += len(entries)
+            pending = None
+            # also stop if the marker does not move forward
+            if truncated and next_marker is not None \
+                    and next_marker != marker:
+                marker = next_marker
+                pending = _request(marker, count)
+            for entry in entries:
+                yield entry
+    finally:
+        if pending is not None:
+            pending.kill()
+
+
+def map_objects(func, tasks, concurrency=BULK_CONCURRENCY):
+    """
+    Call func(*task) for each task, in coroutines.
+
+    :param tasks: iterable of tuples of arguments,
+                  starting with the name of an object
+    :param concurrency: max number of calls at the same time
+    :returns: generator of (name, result of func or exception raised),
+              in the order of the tasks
+    """
+    def _call(task):
+        try:
+            return func(*task)
+        except Exception as e:
+            return e
+
+    pending = collections.deque()
+    with utils.ContextPool(concurrency) as pool:
+        for task in tasks:
+            pending.append((task[0], pool.spawn(_call, task)))
+            # a slow call does not stop the next ones at once
+            while len(pending) >= 2 * concurrency:
+                name, coroutine = pending.popleft()
+                yield name, coroutine.wait()
+        while pending:
+            name, coroutine = pending.popleft()
+            yield name, coroutine.wait()
+
+
+def _common_prefix(name0, name1):
+    i = 0
+    for c0, c1 in itertools.izip(name0, name1):
+        if c0 != c1:
+            break
+        i += 1
+    return name0[:i]
+
+
+def shard_boundaries(prefix, alphabet, first=None, last=None,
+                     end_marker=None):
+    """
+    Split the names starting with prefix into ranges.
+
+    :param alphabet: characters following the prefix at the start
+                     of each range
+    :param first: first name of a sampled page
+    :param last: last name of the sampled page, the ranges start after it
+    :returns: sorted list of the first name of each range but the first
+    """
+    prefix = prefix or ''
+    if first and last:
+        # the sampled names probably continue with the same prefix,
+        # split on the last character of the names they share,
+        # or after it if no range can start with it (e.g. a separator)
+        shared = _common_prefix(first, last)
+        if not shared or shared[-1] in alphabet:
+            shared = shared[:-1]
+        if len(shared) > len(prefix) and shared.startswith(prefix):
+            prefix = shared
+    boundaries = []
+    for c in sorted(set(alphabet)):
+        boundary = prefix + c
+        if last is not None and boundary <= last:
+            continue
+        if end_marker is not None and boundary >= end_marker:
+            continue
+        boundaries.append(boundary)
+    return boundaries
 
 
 def handle_container_not_found(fnc):
@@ -88,6 +250,25 @@ def _sort_chunks(raw_chunks, ec_security):
     return chunks
 
 
+def _is_stream(source):
+    """
+    :returns: True if the length of the source is only known
+              once it has been read: iterables and non-seekable files
+    """
+    if isinstance(source, basestring):
+        return False
+    if hasattr(source, 'read'):
+        seekable = getattr(source, 'seekable', None)
+        if seekable is not None:
+            return not seekable()
+        try:
+            source.tell()
+        except (IOError, OSError):
+            return True
+        return False
+    return hasattr(source, '__iter__')
+
+
 def _make_object_metadata(headers):
     meta = {}
     props = {}
@@ -107,12 +288,185 @@ def _make_object_metadata(headers):
     return meta
 
 
+class UploadCheckpoint(object):
+    """
+    Local record of the meta chunks of an upload already written,
+    so that a failed upload can be resumed instead of restarted.
+
+    The checkpoint holds the chunks prepared for the content,
+    the chunks of the meta chunks written, their size and the md5
+    of their data. The md5 state cannot be saved, so the data already
+    written is read again from the source to resume the upload.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+
+    def load(self, key):
+        """
+        :param key: identifies the upload,
+                    the checkpoint of another upload is ignored
+        :returns: the state of the upload, or None
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if state.get('key') != key:
+            logger.warn('Ignoring checkpoint %s of another upload',
+                        self.path)
+            return None
+        self.state = state
+        return state
+
+    def start(self, key, sysmeta, raw_chunks):
+        self.state = {'key': key,
+                      'sysmeta': sysmeta,
+                      'chunks': copy.deepcopy(raw_chunks),
+                      'next_pos': 0,
+                      'offset': 0,
+                      'checksum': hashlib.md5().hexdigest(),
+                      'done': []}
+        self.save()
+
+    def add(self, bytes_transferred, checksum, chunks):
+        """
+        Record the result of the next meta chunk.
+        """
+        self.state['next_pos'] += 1
+        self.state['offset'] += bytes_transferred
+        self.state['checksum'] = checksum
+        self.state['done'].extend(chunks)
+        self.save()
+
+    def resume(self, source, read_size):
+        """
+        Read the data already written from the source,
+        so it is positioned at the first meta chunk to write.
+
+        :returns: the checksum of the data already written
+        :raises SourceReadError: if the source changed
+        """
+        checksum = hashlib.md5()
+        remaining = self.state['offset']
+        while remaining > 0:
+            data = source.read(min(read_size, remaining))
+            if not data:
+                break
+            checksum.update(data)
+            remaining -= len(data)
+        if remaining or checksum.hexdigest() != self.state['checksum']:
+            raise exc.SourceReadError(
+                'Source changed since checkpoint %s' % self.path)
+        return checksum
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ServiceCache(object):
+    """
+    Caches the services chosen by the load balancer.
+
+    Up to `size` services are kept for each service type, each one for
+    `ttl` seconds, and the cached services are used in turn.
+    """
+    def __init__(self, choose, ttl=SERVICE_CACHE_TTL,
+                 size=SERVICE_CACHE_SIZE):
+        self.choose = choose
+        self.ttl = ttl
+        self.size = size
+        # srv_type -> list of [url, expiration time]
+        self._services = {}
+        # srv_type -> last time the load balancer has been called
+        self._last_choose = {}
+        self._turn = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _grow(self, srv_type, services, now):
+        self._last_choose[srv_type] = now
+        chosen = self.choose(srv_type)
+        for url in chosen:
+            for service in services:
+                if service[0] == url:
+                    service[1] = now + self.ttl
+                    break
+            else:
+                if len(services) < self.size:
+                    services.append([url, now + self.ttl])
+        return chosen[0]
+
+    def get(self, srv_type):
+        """
+        Get the URL of a service of srv_type.
+        """
+        now = time.time()
+        services = [s for s in self._services.get(srv_type, [])
+                    if s[1] > now]
+        self._services[srv_type] = services
+
+        if not services:
+            self.stats['misses'] += 1
+            return self._grow(srv_type, services, now)
+
+        # try to find other services to spread the load,
+        # but do not call the load balancer more than `size` times
+        # during `ttl` seconds
+        last_choose = self._last_choose.get(srv_type, 0)
+        if len(services) < self.size and \
+                now - last_choose > float(self.ttl) / self.size:
+            try:
+                self.stats['misses'] += 1
+                return self._grow(srv_type, services, now)
+            except exc.OioException as e:
+                logger.warn("Failed to choose %s service (%s)", srv_type, e)
+
+        self.stats['hits'] += 1
+        self._turn += 1
+        return services[self._turn % len(services)][0]
+
+    def evict(self, srv_type, url):
+        """
+        Remove a service from the cache, typically after a failure.
+        """
+        services = self._services.get(srv_type, [])
+        for service in services:
+            if service[0] == url:
+                services.remove(service)
+                self.stats['evictions'] += 1
+                break
+
+    def clear(self):
+        self._services.clear()
+        self._last_choose.clear()
+
+
 class ObjectStorageAPI(API):
     """
     The Object Storage API
     """
 
-    def __init__(self, namespace, endpoint, **kwargs):
+    def __init__(self, namespace, endpoint, service_cache_ttl=None,
+                 service_cache_size=None, read_ahead=READ_AHEAD,
+                 read_ahead_buffer_size=READ_AHEAD_BUFFER_SIZE,
+                 write_pipeline_depth=WRITE_PIPELINE_DEPTH,
+                 ec_extra_readers=EC_EXTRA_READERS,
+                 hedge_delay=io.HEDGE_DELAY, write_chunk_size=None,
+                 read_chunk_size=None, put_queue_depth=None,
+                 connection_timeout=None, chunk_timeout=None,
+                 client_timeout=None, io_autotune=False, **kwargs):
         endpoint_v3 = '/'.join([endpoint.rstrip('/'), 'v3.0'])
         super(ObjectStorageAPI, self).__init__(endpoint=endpoint_v3, **kwargs)
         self.directory = DirectoryAPI(
@@ -121,6 +475,42 @@ class ObjectStorageAPI(API):
             session=self.session
         )
         self.namespace = namespace
+        self.service_cache = ServiceCache(
+            self._lb_choose,
+            ttl=service_cache_ttl or SERVICE_CACHE_TTL,
+            size=service_cache_size or SERVICE_CACHE_SIZE)
+        self.read_ahead = read_ahead
+        self.read_ahead_buffer_size = read_ahead_buffer_size
+        self.write_pipeline_depth = write_pipeline_depth
+        self.ec_extra_readers = ec_extra_readers
+        self.hedge_delay = hedge_delay
+        # block sizes, queue depth and timeouts of the RAWX transfers,
+        # each operation may override them
+        self.io_settings = io.IOSettings(
+            write_chunk_size=write_chunk_size,
+            read_chunk_size=read_chunk_size,
+            put_queue_depth=put_queue_depth,
+            connection_timeout=connection_timeout,
+            chunk_timeout=chunk_timeout, client_timeout=client_timeout)
+        if io_autotune:
+            self.io_settings.tuner = io.IOTuner(
+                self.io_settings.write_chunk_size,
+                self.io_settings.put_queue_depth)
+
+    def _io_settings(self, overrides=None):
+        """
+        :param overrides: dict of the I/O settings of one operation
+        :returns: the settings of the operation
+        """
+        return self.io_settings.copy(**(overrides or {}))
+
+    def io_tuning(self):
+        """
+        :returns: the state of the automatic I/O tuning,
+                  None if it is disabled
+        """
+        tuner = self.io_settings.tuner
+        return tuner.snapshot() if tuner is not None else None
 
     def account_create(self, account, headers=None):
         uri = '/v1.0/account/create'
@@ -207,6 +597,27 @@ class ObjectStorageAPI(API):
         del resp_body['listing']
         return listing, resp_body
 
+    def container_list_iter(self, account, limit=None, marker=None,
+                            end_marker=None, prefix=None, delimiter=None,
+                            page_size=LIST_PAGE_SIZE, headers=None):
+        """
+        Lists the containers of an account, requesting as many pages
+        as needed.
+
+        :param limit: max number of containers, None for all of them
+        :param page_size: number of containers requested at once
+        :returns: generator of [name, count, bytes, is_prefix] lists
+        """
+        def list_page(marker, size):
+            listing, _meta = self.container_list(
+                account, limit=size, marker=marker, end_marker=end_marker,
+                prefix=prefix, delimiter=delimiter, headers=headers)
+            next_marker = listing[-1][0] if listing else None
+            return listing, next_marker, len(listing) >= size
+
+        return paginate(list_page, marker=marker, limit=limit,
+                        page_size=page_size)
+
     @handle_container_not_found
     def container_show(self, account, container, headers=None):
         uri = self._make_uri('container/get_properties')
@@ -253,7 +664,19 @@ class ObjectStorageAPI(API):
     def object_create(self, account, container, file_or_path=None, data=None,
                       etag=None, obj_name=None, content_type=None,
                       content_encoding=None, content_length=None,
-                      metadata=None, policy=None, headers=None):
+                      metadata=None, policy=None, headers=None,
+                      io_settings=None, checkpoint=None, size_hint=None):
+        """
+        :param data: a string, or an iterable of strings
+                     of unknown length
+        :param size_hint: expected size of a content of unknown length,
+                          announced when preparing its chunks so the
+                          proxy can select a policy by size
+        :param checkpoint: path of a local file where the progress of the
+                           upload is saved after each meta chunk, to resume
+                           it after a failure by calling object_create again
+                           with the same arguments
+        """
         if (data, file_or_path) == (None, None):
             raise exc.MissingData()
         src = data if data is not None else file_or_path
@@ -277,7 +700,8 @@ class ObjectStorageAPI(API):
         if isinstance(data, basestring):
             content_length = len(data)
 
-        if content_length is None:
+        # the chunks of a stream are prepared as it is read
+        if content_length is None and not _is_stream(src):
             raise exc.MissingContentLength()
 
         sysmeta = {'mime_type': content_type,
@@ -285,19 +709,26 @@ class ObjectStorageAPI(API):
                    'content_length': content_length,
                    'etag': etag}
 
+        settings = self._io_settings(io_settings)
         if src is data:
+            if isinstance(data, basestring):
+                data = StringIO(data)
             return self._object_create(
-                account, container, obj_name, StringIO(data), sysmeta,
-                metadata=metadata, policy=policy, headers=headers)
+                account, container, obj_name, data, sysmeta,
+                metadata=metadata, policy=policy, headers=headers,
+                settings=settings, checkpoint=checkpoint, size_hint=size_hint)
         elif hasattr(file_or_path, "read"):
             return self._object_create(
                 account, container, obj_name, src, sysmeta, metadata=metadata,
-                policy=policy, headers=headers)
+                policy=policy, headers=headers, settings=settings,
+                checkpoint=checkpoint, size_hint=size_hint)
         else:
             with open(file_or_path, "rb") as f:
                 return self._object_create(
                     account, container, obj_name, f, sysmeta,
-                    metadata=metadata, policy=policy, headers=headers)
+                    metadata=metadata, policy=policy, headers=headers,
+                    settings=settings, checkpoint=checkpoint,
+                    size_hint=size_hint)
 
     @handle_object_not_found
     def object_delete(self, account, container, obj, headers=None):
@@ -306,10 +737,37 @@ class ObjectStorageAPI(API):
         resp, resp_body = self._request(
             'POST', uri, params=params, headers=headers)
 
-    @handle_container_not_found
-    def object_list(self, account, container, limit=None, marker=None,
-                    delimiter=None, prefix=None, end_marker=None,
-                    include_metadata=False, headers=None):
+    def object_delete_many(self, account, container, objs=None, prefix=None,
+                           concurrency=BULK_CONCURRENCY, headers=None):
+        """
+        Delete several objects, concurrency at a time.
+
+        :param objs: names of the objects to delete
+        :param prefix: also delete the objects listed with prefix,
+                       '' for all the objects of the container
+        :returns: generator of (name, exception), the exception is None
+                  if the object has been deleted, NoSuchObject if it
+                  did not exist
+        """
+        if objs is None and prefix is None:
+            raise ValueError('No object to delete')
+        names = iter(objs or [])
+        if prefix is not None:
+            listing = self.object_list_iter(account, container,
+                                            prefix=prefix, headers=headers)
+            names = itertools.chain(
+                names, (obj['name'] for obj in listing))
+
+        def _delete(name):
+            self.object_delete(account, container, name, headers=headers)
+
+        self._grow_pool(concurrency)
+        return map_objects(_delete, ((name, ) for name in names),
+                           concurrency=concurrency)
+
+    def _object_list(self, account, container, limit=None, marker=None,
+                     delimiter=None, prefix=None, end_marker=None,
+                     headers=None):
         uri = self._make_uri('container/list')
         params = self._make_params(account, container)
         d = {"max": limit,
@@ -319,8 +777,16 @@ class ObjectStorageAPI(API):
              "end_marker": end_marker}
         params.update(d)
 
-        resp, resp_body = self._request(
-            'GET', uri, params=params, headers=headers)
+        return self._request('GET', uri, params=params, headers=headers)
+
+    @handle_container_not_found
+    def object_list(self, account, container, limit=None, marker=None,
+                    delimiter=None, prefix=None, end_marker=None,
+                    include_metadata=False, headers=None):
+        resp, resp_body = self._object_list(
+            account, container, limit=limit, marker=marker,
+            delimiter=delimiter, prefix=prefix, end_marker=end_marker,
+            headers=headers)
 
         if include_metadata:
             meta = {}
@@ -333,6 +799,107 @@ class ObjectStorageAPI(API):
 
         return resp_body
 
+    @handle_container_not_found
+    def _object_list_page(self, account, container, marker, size,
+                          **kwargs):
+        resp, resp_body = self._object_list(
+            account, container, limit=size, marker=marker, **kwargs)
+        objects = resp_body.get('objects', [])
+        names = [obj['name'] for obj in objects]
+        names += resp_body.get('prefixes', [])
+        truncated = None
+        if resp is not None:
+            truncated = resp.headers.get('x-oio-list-truncated')
+        if truncated is None:
+            truncated = len(names) >= size
+        else:
+            truncated = truncated.lower() == 'true'
+        return objects, max(names) if names else None, truncated
+
+    def object_list_iter(self, account, container, limit=None, marker=None,
+                         delimiter=None, prefix=None, end_marker=None,
+                         page_size=LIST_PAGE_SIZE, headers=None):
+        """
+        Lists the objects of a container, requesting as many pages
+        as needed.
+
+        :param limit: max number of objects, None for all of them
+        :param page_size: number of objects requested at once
+        :returns: generator of object descriptions,
+                  the prefixes matching the delimiter are not returned
+        """
+        def list_page(marker, size):
+            return self._object_list_page(
+                account, container, marker, size, delimiter=delimiter,
+                prefix=prefix, end_marker=end_marker, headers=headers)
+
+        return paginate(list_page, marker=marker, limit=limit,
+                        page_size=page_size)
+
+    def _object_list_shard(self, account, container, start, end_marker,
+                           prefix=None, page_size=LIST_PAGE_SIZE,
+                           headers=None):
+        """
+        Lists the objects from start (included) to end_marker (excluded).
+        """
+        # markers are excluded, check if the first name exists
+        objects, _next, _truncated = self._object_list_page(
+            account, container, None, 1, prefix=start, headers=headers)
+        if objects and objects[0]['name'] == start:
+            yield objects[0]
+        for obj in self.object_list_iter(
+                account, container, marker=start, end_marker=end_marker,
+                prefix=prefix, page_size=page_size, headers=headers):
+            yield obj
+
+    def object_list_parallel(self, account, container, limit=None,
+                             marker=None, prefix=None, end_marker=None,
+                             concurrency=LIST_CONCURRENCY,
+                             alphabet=LIST_ALPHABET,
+                             page_size=LIST_PAGE_SIZE, headers=None):
+        """
+        Lists the objects of a container, the names are split into ranges
+        listed at the same time, then returned in order.
+
+        A first page is listed, if it is truncated, the rest of the names
+        are split on the characters of alphabet following the prefix
+        (or the prefix shared by the names of the first page).
+        The ranges do not need to match the names exactly, but the more
+        they are balanced, the faster the listing.
+
+        :param concurrency: number of ranges listed at the same time
+        :param alphabet: characters starting the ranges
+        :returns: generator of object descriptions
+        """
+        def _list():
+            objects, last, truncated = self._object_list_page(
+                account, container, marker, page_size, prefix=prefix,
+                end_marker=end_marker, headers=headers)
+            for obj in objects:
+                yield obj
+            if not truncated or last is None:
+                return
+
+            boundaries = shard_boundaries(
+                prefix, alphabet, first=objects[0]['name'], last=last,
+                end_marker=end_marker)
+            shards = [self.object_list_iter(
+                account, container, marker=last,
+                end_marker=boundaries[0] if boundaries else end_marker,
+                prefix=prefix, page_size=page_size, headers=headers)]
+            for i, start in enumerate(boundaries):
+                stop = boundaries[i + 1] if i + 1 < len(boundaries) \
+                    else end_marker
+                shards.append(self._object_list_shard(
+                    account, container, start, stop, prefix=prefix,
+                    page_size=page_size, headers=headers))
+            # the ranges are sorted, the next ones are read ahead
+            for obj in io.prefetch(shards, concurrency - 1,
+                                   concurrency * page_size, 1):
+                yield obj
+
+        return itertools.islice(_list(), limit)
+
     @handle_object_not_found
     def object_analyze(self, account, container, obj, headers=None):
         uri = self._make_uri('content/show')
@@ -343,18 +910,19 @@ class ObjectStorageAPI(API):
         return meta, resp_body
 
     def object_fetch(self, account, container, obj, ranges=None,
-                     headers=None):
+                     headers=None, io_settings=None):
         meta, raw_chunks = self.object_analyze(
             account, container, obj, headers=headers)
         chunk_method = meta['chunk-method']
         storage_method = STORAGE_METHODS.load(chunk_method)
         chunks = _sort_chunks(raw_chunks, storage_method.ec)
+        settings = self._io_settings(io_settings)
         if storage_method.ec:
             stream = self._fetch_stream_ec(meta, chunks, ranges,
-                                           storage_method, headers)
+                                           storage_method, headers, settings)
         else:
             stream = self._fetch_stream(meta, chunks, ranges, storage_method,
-                                        headers)
+                                        headers, settings)
         return meta, stream
 
     @handle_object_not_found
@@ -368,6 +936,55 @@ class ObjectStorageAPI(API):
         meta['properties'] = resp_body
         return meta
 
+    def object_show_many(self, account, container, objs,
+                         concurrency=BULK_CONCURRENCY, headers=None):
+        """
+        Get the metadata of several objects, concurrency at a time.
+
+        :param objs: names of the objects
+        :returns: generator of (name, metadata or exception)
+        """
+        def _show(name):
+            return self.object_show(account, container, name,
+                                    headers=headers)
+
+        self._grow_pool(concurrency)
+        return map_objects(_show, ((name, ) for name in objs),
+                           concurrency=concurrency)
+
+    def object_set_properties_many(self, account, container, objs,
+                                   clear=False, concurrency=BULK_CONCURRENCY,
+                                   headers=None):
+        """
+        Set the properties of several objects, concurrency at a time.
+
+        :param objs: iterable of (name, properties) pairs
+        :returns: generator of (name, None or exception)
+        """
+        def _set(name, properties):
+            self.object_set_properties(account, container, name,
+                                       properties, clear=clear,
+                                       headers=headers)
+
+        self._grow_pool(concurrency)
+        return map_objects(_set, objs, concurrency=concurrency)
+
+    def object_del_properties_many(self, account, container, objs,
+                                   concurrency=BULK_CONCURRENCY,
+                                   headers=None):
+        """
+        Delete properties of several objects, concurrency at a time.
+
+        :param objs: iterable of (name, list of property keys) pairs
+        :returns: generator of (name, None or exception)
+        """
+        def _delete(name, properties):
+            self.object_del_properties(account, container, name,
+                                       properties, headers=headers)
+
+        self._grow_pool(concurrency)
+        return map_objects(_delete, objs, concurrency=concurrency)
+
     def object_update(self, account, container, obj, metadata, clear=False,
                       headers=None):
         if clear:
@@ -397,6 +1014,20 @@ class ObjectStorageAPI(API):
             'POST', uri, data=json.dumps(properties), params=params,
             headers=headers)
 
+    def rawx_stats(self):
+        """
+        Get what this process measured of the RAWX services,
+        that is used to choose the services to read from.
+
+        :returns: dict of the measures of each service address: moving
+                  averages of the response time ('ttfb', seconds) and
+                  of the throughput (bytes per second), decayed number
+                  of errors, number of requests and failures,
+                  seconds since the last measure ('age'),
+                  'healthy' and the resulting 'cost' (seconds)
+        """
+        return io.HOST_STATS.snapshot()
+
     def _make_uri(self, action):
         uri = "%s/%s" % (self.namespace, action)
         return uri
@@ -408,22 +1039,30 @@ class ObjectStorageAPI(API):
             params.update({'path': obj})
         return params
 
-    def _get_service_url(self, srv_type):
+    def _lb_choose(self, srv_type):
         uri = self._make_uri('lb/choose')
         params = {'pool': srv_type}
         resp, resp_body = self._request('GET', uri, params=params)
-        if resp.status_code == 200:
-            instance_info = resp_body[0]
-            return 'http://%s/' % instance_info['addr']
+        if resp.status_code == 200 and resp_body:
+            return ['http://%s/' % instance_info['addr']
+                    for instance_info in resp_body]
         else:
             raise exc.ClientException(
-                "could not find account instance url"
+                resp.status_code,
+                message="could not find %s instance url" % srv_type
             )
 
+    def _get_service_url(self, srv_type):
+        return self.service_cache.get(srv_type)
+
     def _account_request(self, method, uri, **kwargs):
         account_url = self._get_service_url('account')
-        resp, resp_body = self._request(method, uri, endpoint=account_url,
-                                        **kwargs)
+        try:
+            resp, resp_body = self._request(method, uri,
+                                            endpoint=account_url, **kwargs)
+        except requests.ConnectionError:
+            self.service_cache.evict('account', account_url)
+            raise
         return resp, resp_body
 
     def _content_prepare(self, account, container, obj_name, size,
@@ -449,18 +1088,67 @@ class ObjectStorageAPI(API):
             'POST', uri, data=data, params=params, headers=headers)
         return resp.headers, resp_body
 
+    def _meta_chunks_prepare(self, account, container, obj_name, size,
+                             storage_method, first_pos=0, policy=None,
+                             headers=None):
+        """
+        Prepare the chunks of the meta chunks holding size bytes
+        of a content, the first one being at position first_pos.
+
+        :returns: the meta chunks, by position
+        """
+        _meta, raw_chunks = self._content_prepare(
+            account, container, obj_name, size, policy=policy,
+            headers=headers)
+        chunks = {}
+        for pos, meta_chunk in _sort_chunks(raw_chunks,
+                                            storage_method.ec).items():
+            pos += first_pos
+            for chunk in meta_chunk:
+                if storage_method.ec:
+                    chunk['pos'] = '%d.%d' % (pos, chunk['num'])
+                else:
+                    chunk['pos'] = str(pos)
+            chunks[pos] = meta_chunk
+        return chunks
+
     def _object_create(self, account, container, obj_name, source,
-                       sysmeta, metadata=None, policy=None, headers=None):
-        meta, raw_chunks = self._content_prepare(
-            account, container, obj_name, sysmeta['content_length'],
-            policy=policy, headers=headers)
-
-        sysmeta['chunk_size'] = int(meta['X-oio-ns-chunk-size'])
-        sysmeta['id'] = meta[object_headers['id']]
-        sysmeta['version'] = meta[object_headers['version']]
-        sysmeta['policy'] = meta[object_headers['policy']]
-        sysmeta['mime_type'] = meta[object_headers['mime_type']]
-        sysmeta['chunk_method'] = meta[object_headers['chunk_method']]
+                       sysmeta, metadata=None, policy=None, headers=None,
+                       settings=None, checkpoint=None, size_hint=None):
+        settings = settings or self._io_settings()
+        streaming = sysmeta['content_length'] is None
+        upload = state = None
+        if checkpoint:
+            if streaming:
+                raise ValueError('Cannot resume an upload of unknown length')
+            upload = UploadCheckpoint(checkpoint)
+            key = [account, container, obj_name, sysmeta['content_length'],
+                   policy, sysmeta['etag']]
+            state = upload.load(key)
+
+        if state is not None:
+            raw_chunks = state['chunks']
+            prepared = dict((k, v.encode('utf-8')
+                             if isinstance(v, unicode) else v)
+                            for k, v in state['sysmeta'].items())
+        else:
+            if streaming:
+                size = size_hint or STREAM_PREPARE_SIZE
+            else:
+                size = sysmeta['content_length']
+            meta, raw_chunks = self._content_prepare(
+                account, container, obj_name, size,
+                policy=policy, headers=headers)
+            prepared = {
+                'chunk_size': int(meta['X-oio-ns-chunk-size']),
+                'id': meta[object_headers['id']],
+                'version': meta[object_headers['version']],
+                'policy': meta[object_headers['policy']],
+                'mime_type': meta[object_headers['mime_type']],
+                'chunk_method': meta[object_headers['chunk_method']]}
+            if upload:
+                upload.start(key, prepared, raw_chunks)
+        sysmeta.update(prepared)
 
         storage_method = STORAGE_METHODS.load(sysmeta['chunk_method'])
 
@@ -468,14 +1156,58 @@ class ObjectStorageAPI(API):
         sysmeta['content_path'] = obj_name
         sysmeta['container_id'] = utils.name2cid(account, container)
 
+        if streaming or not hasattr(source, 'read'):
+            # iterables are read like files
+            source = io.StreamSource(source, settings.write_chunk_size)
+
+        kwargs = {}
+        if upload:
+            kwargs['checkpoint'] = upload.add
+        if state is not None:
+            # only write the meta chunks after the checkpoint
+            kwargs['checksum'] = upload.resume(
+                source, settings.write_chunk_size)
+            kwargs['offset'] = state['offset']
+            remaining = sysmeta['content_length'] - state['offset']
+            chunks = {}
+            if remaining or not state['next_pos']:
+                # to new chunks: the failed meta chunk, and the next ones
+                # written meanwhile, may have been stored by some services,
+                # which reject a second PUT of a chunk
+                chunks = self._meta_chunks_prepare(
+                    account, container, obj_name, remaining, storage_method,
+                    first_pos=state['next_pos'], policy=sysmeta['policy'],
+                    headers=headers)
+            logger.info('Resuming upload of %s at meta chunk %d',
+                        obj_name, state['next_pos'])
+        if streaming:
+            def prepare(pos):
+                if pos in chunks:
+                    # prepared with the size hint
+                    return chunks[pos]
+                # same policy for all the meta chunks
+                return self._meta_chunks_prepare(
+                    account, container, obj_name, sysmeta['chunk_size'],
+                    storage_method, first_pos=pos, policy=sysmeta['policy'],
+                    headers=headers)[pos]
+
+            kwargs['prepare'] = prepare
+
         if storage_method.ec:
-            handler = ECWriteHandler(source, sysmeta, chunks, storage_method,
-                                     headers=headers)
+            handler = ECWriteHandler(
+                source, sysmeta, chunks, storage_method, headers=headers,
+                pipeline_depth=self.write_pipeline_depth, settings=settings,
+                **kwargs)
         else:
-            handler = ReplicatedWriteHandler(source, sysmeta, chunks,
-                                             storage_method, headers=headers)
+            handler = ReplicatedWriteHandler(
+                source, sysmeta, chunks, storage_method, headers=headers,
+                pipeline_depth=self.write_pipeline_depth, settings=settings,
+                **kwargs)
 
         final_chunks, bytes_transferred, content_checksum = handler.stream()
+        if upload:
+            final_chunks = upload.state['done']
+            bytes_transferred = upload.state['offset']
 
         etag = sysmeta['etag']
         if etag and etag.lower() != content_checksum.lower():
@@ -484,7 +1216,7 @@ class ObjectStorageAPI(API):
         sysmeta['etag'] = content_checksum
 
         h = {}
-        h[object_headers['size']] = bytes_transferred
+        h[object_headers['size']] = str(bytes_transferred)
         h[object_headers['hash']] = sysmeta['etag']
         h[object_headers['version']] = sysmeta['version']
         h[object_headers['id']] = sysmeta['id']
@@ -498,38 +1230,75 @@ class ObjectStorageAPI(API):
 
         m, body = self._content_create(account, container, obj_name,
                                        final_chunks, headers=h)
+        if upload:
+            upload.remove()
         return final_chunks, bytes_transferred, content_checksum
 
-    def _fetch_stream(self, meta, chunks, ranges, storage_method, headers):
-        total_bytes = 0
+    def _fetch_meta_chunk(self, meta_chunk, meta_start, meta_end, headers,
+                          settings):
+        # readers update their request headers
+        headers = dict(headers)
+        headers.pop('Range', None)
+        if meta_start is not None or meta_end is not None:
+            headers['Range'] = utils.http_header_from_ranges(
+                [(meta_start or 0, meta_end)])
+        # do not ask to yield aligned records, ranges may start anywhere
+        # try the fastest healthy services first
+        chunks = io.HOST_STATS.sort(meta_chunk)
+        reader = io.ChunkReader(iter(chunks), None, headers,
+                                settings.connection_timeout,
+                                settings.chunk_timeout,
+                                settings.chunk_timeout,
+                                hedge_delay=self.hedge_delay,
+                                read_chunk_size=settings.read_chunk_size)
+        it = reader.get_iter()
+        if not it:
+            raise exc.OioException("Error while downloading")
+        for part in it:
+            for d in part['iter']:
+                yield d
+
+    def _fetch_stream(self, meta, chunks, ranges, storage_method, headers,
+                      settings):
         headers = headers or {}
         ranges = ranges or [(None, None)]
 
         meta_ranges = get_meta_ranges(ranges, chunks)
 
-        for pos, meta_range in meta_ranges.iteritems():
-            meta_start, meta_end = meta_range
-            reader = io.ChunkReader(iter(chunks[pos]), io.READ_CHUNK_SIZE,
-                                    headers)
-            it = reader.get_iter()
-            if not it:
-                raise exc.OioException("Error while downloading")
-            for part in it:
-                for d in part['iter']:
-                    total_bytes += len(d)
+        streams = []
+        for pos, meta_start, meta_end in meta_ranges:
+            streams.append(self._fetch_meta_chunk(
+                chunks[pos], meta_start, meta_end, headers, settings))
+        return io.prefetch(streams, self.read_ahead,
+                           self.read_ahead_buffer_size,
+                           settings.read_chunk_size)
+
+    def _fetch_meta_chunk_ec(self, meta_chunk, meta_start, meta_end,
+                             storage_method, headers, settings):
+        handler = ECChunkDownloadHandler(
+            storage_method, meta_chunk, meta_start, meta_end, headers,
+            settings.connection_timeout, settings.chunk_timeout,
+            settings.chunk_timeout, extra_readers=self.ec_extra_readers,
+            read_chunk_size=settings.read_chunk_size)
+        stream = handler.get_stream()
+        try:
+            for part_info in stream:
+                for d in part_info['iter']:
                     yield d
+        finally:
+            stream.close()
 
-    def _fetch_stream_ec(self, meta, chunks, ranges, storage_method, headers):
+    def _fetch_stream_ec(self, meta, chunks, ranges, storage_method, headers,
+                         settings):
         ranges = ranges or [(None, None)]
 
         meta_ranges = get_meta_ranges(ranges, chunks)
 
-        for pos, meta_range in meta_ranges.iteritems():
-            meta_start, meta_end = meta_range
-            handler = ECChunkDownloadHandler(storage_method, chunks[pos],
-                                             meta_start, meta_end, headers)
-            stream = handler.get_stream()
-            for part_info in stream:
-                for d in part_info['iter']:
-                    yield d
-            stream.close()
+        streams = []
+        for pos, meta_start, meta_end in meta_ranges:
+            streams.append(self._fetch_meta_chunk_ec(
+                chunks[pos], meta_start, meta_end, storage_method, headers,
+                settings))
+        return io.prefetch(streams, self.read_ahead,
+                           self.read_ahead_buffer_size,
+                           storage_method.ec_segment_size)
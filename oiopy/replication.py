@@ -12,7 +12,7 @@
 # License along with this library.
 
 import logging
-import hashlib
+import time
 from eventlet import Timeout, GreenPile
 from eventlet.queue import Queue
 from urlparse import urlparse
@@ -28,25 +28,38 @@ logger = logging.getLogger(__name__)
 
 
 class ReplicatedChunkWriteHandler(object):
-    def __init__(self, sysmeta, meta_chunk, checksum, storage_method):
+    def __init__(self, sysmeta, meta_chunk, checksum, storage_method,
+                 content_length=None, settings=None):
         self.sysmeta = sysmeta
         self.meta_chunk = meta_chunk
         self.checksum = checksum
         self.storage_method = storage_method
+        # when the exact size is known, the data is sent as is,
+        # instead of using a chunked transfer encoding
+        self.content_length = content_length
+        self.settings = settings or io.IOSettings()
 
     def _check_quorum(self, conns):
         return len(conns) >= self.storage_method.quorum
 
     def stream(self, source, size):
-        bytes_transferred = 0
+        self.write(source, size)
+        return self.wait()
 
+    def write(self, source, size):
+        """
+        Writes the data to the chunks, without waiting for the responses.
+        """
         def _connect_put(chunk):
             raw_url = chunk["url"]
             parsed = urlparse(raw_url)
             try:
                 chunk_path = parsed.path.split('/')[-1]
                 h = {}
-                h["transfer-encoding"] = "chunked"
+                if chunked:
+                    h["transfer-encoding"] = "chunked"
+                else:
+                    h["content-length"] = str(self.content_length)
                 h[chunk_headers["content_id"]] = self.sysmeta['id']
                 h[chunk_headers["content_version"]] = self.sysmeta['version']
                 h[chunk_headers["content_path"]] = \
@@ -57,9 +70,10 @@ class ReplicatedChunkWriteHandler(object):
                 h[chunk_headers["container_id"]] = self.sysmeta['container_id']
                 h[chunk_headers["chunk_pos"]] = chunk["pos"]
                 h[chunk_headers["chunk_id"]] = chunk_path
-                with ConnectionTimeout(io.CONNECTION_TIMEOUT):
+                with ConnectionTimeout(self.settings.connection_timeout):
                     conn = io.http_connect(
-                        parsed.netloc, 'PUT', parsed.path, h)
+                        parsed.netloc, 'PUT', parsed.path, h,
+                        pool=io.CONNECTION_POOL)
                     conn.chunk = chunk
                 return conn, chunk
             except (Exception, Timeout) as e:
@@ -68,6 +82,10 @@ class ReplicatedChunkWriteHandler(object):
                 chunk['error'] = msg
                 return None, chunk
 
+        chunked = self.content_length is None
+        if not chunked:
+            size = self.content_length
+
         meta_chunk = self.meta_chunk
 
         pile = GreenPile(len(meta_chunk))
@@ -97,40 +115,8 @@ class ReplicatedChunkWriteHandler(object):
             with utils.ContextPool(len(meta_chunk)) as pool:
                 for conn in current_conns:
                     conn.failed = False
-                    conn.queue = Queue(io.PUT_QUEUE_DEPTH)
-                    pool.spawn(self._send_data, conn)
-
-                while True:
-                    remaining_bytes = size - bytes_transferred
-                    if io.WRITE_CHUNK_SIZE < remaining_bytes:
-                        read_size = io.WRITE_CHUNK_SIZE
-                    else:
-                        read_size = remaining_bytes
-                    with SourceReadTimeout(io.CLIENT_TIMEOUT):
-                        try:
-                            data = source.read(read_size)
-                        except (ValueError, IOError) as e:
-                            raise SourceReadError(str(e))
-                        if len(data) == 0:
-                            for conn in current_conns:
-                                conn.queue.put('0\r\n\r\n')
-                            break
-                    self.checksum.update(data)
-                    bytes_transferred += len(data)
-                    for conn in current_conns:
-                        if not conn.failed:
-                            conn.queue.put('%x\r\n%s\r\n' % (len(data),
-                                                             data))
-                        else:
-                            current_conns.remove(conn)
-
-                    quorum = self._check_quorum(current_conns)
-                    if not quorum:
-                        raise exc.OioException("RAWX write failure")
-
-                for conn in current_conns:
-                    if conn.queue.unfinished_tasks:
-                        conn.queue.join()
+                bytes_transferred = self._send_queued(
+                    pool, source, size, current_conns)
 
         except SourceReadTimeout:
             logger.warn('Source read timeout')
@@ -145,11 +131,88 @@ class ReplicatedChunkWriteHandler(object):
             logger.exception('Exception writing data')
             raise
 
+        # every connection received all the data,
+        # the slowest one is measured without the source reads
+        sent = [conn for conn in current_conns if not conn.failed]
+        if sent:
+            self.settings.add_transfer(
+                bytes_transferred, max(conn.send_time for conn in sent))
+
+        self._conns = current_conns
+        self._failed_chunks = failed_chunks
+        self._bytes_transferred = bytes_transferred
+        self._meta_checksum = self.checksum.hexdigest()
+
+    def _send_queued(self, pool, source, size, current_conns):
+        """
+        Read the data from the source and queue it to the connections.
+        """
+        chunked = self.content_length is None
+        chunk_size = self.settings.write_chunk_size
+        bytes_transferred = 0
+        for conn in current_conns:
+            conn.queue = Queue(self.settings.put_queue_depth)
+            conn.send_time = 0.0
+            pool.spawn(self._send_data, conn)
+
+        while True:
+            remaining_bytes = size - bytes_transferred
+            if chunk_size < remaining_bytes:
+                read_size = chunk_size
+            else:
+                read_size = remaining_bytes
+            with SourceReadTimeout(self.settings.client_timeout):
+                try:
+                    data = source.read(read_size)
+                except (ValueError, IOError) as e:
+                    raise SourceReadError(str(e))
+                if len(data) == 0:
+                    if not chunked:
+                        if bytes_transferred < size:
+                            raise SourceReadError(
+                                'Source ended after %d bytes, %d expected'
+                                % (bytes_transferred, size))
+                        break
+                    for conn in current_conns:
+                        conn.queue.put('0\r\n\r\n')
+                    break
+            self.checksum.update(data)
+            bytes_transferred += len(data)
+            if chunked:
+                # framed once, shared by all the connections
+                framed = io.frame_chunk(data)
+            else:
+                framed = data
+            for conn in list(current_conns):
+                if not conn.failed:
+                    conn.queue.put(framed)
+                else:
+                    current_conns.remove(conn)
+
+            quorum = self._check_quorum(current_conns)
+            if not quorum:
+                raise exc.OioException("RAWX write failure")
+
+        for conn in current_conns:
+            if conn.queue.unfinished_tasks:
+                conn.queue.join()
+        return bytes_transferred
+
+    def wait(self):
+        """
+        Reads the responses of the chunks.
+        """
+        current_conns = self._conns
+        failed_chunks = self._failed_chunks
+        bytes_transferred = self._bytes_transferred
         success_chunks = []
 
+        pile = GreenPile(len(self.meta_chunk))
+
         for conn in current_conns:
             if conn.failed:
                 failed_chunks.append(conn.chunk)
+                io.release_conn(conn)
                 continue
             pile.spawn(self._get_response, conn)
 
@@ -163,16 +226,18 @@ class ReplicatedChunkWriteHandler(object):
                     failed_chunks.append(conn.chunk)
                     logger.error("Wrong status code from %s (%s)",
                                  conn.chunk, resp.status)
-            conn.close()
+            io.release_conn(conn, resp)
 
         for (conn, resp) in pile:
             if resp:
                 _handle_resp(conn, resp)
+            else:
+                io.release_conn(conn)
         quorum = self._check_quorum(success_chunks)
         if not quorum:
             raise exc.OioException("RAWX write failure")
 
-        meta_checksum = self.checksum.hexdigest()
+        meta_checksum = self._meta_checksum
         for chunk in success_chunks:
             chunk["size"] = bytes_transferred
             chunk["hash"] = meta_checksum
@@ -184,8 +249,10 @@ class ReplicatedChunkWriteHandler(object):
             data = conn.queue.get()
             if not conn.failed:
                 try:
-                    with ChunkWriteTimeout(io.CHUNK_TIMEOUT):
+                    with ChunkWriteTimeout(self.settings.chunk_timeout):
+                        start = time.time()
                         conn.send(data)
+                        conn.send_time += time.time() - start
                 except (Exception, ChunkWriteTimeout):
                     conn.failed = True
             conn.queue.task_done()
@@ -193,6 +260,8 @@ class ReplicatedChunkWriteHandler(object):
     def _get_response(self, conn):
         try:
             resp = conn.getresponse(True)
+            # drain the response so the connection can be reused
+            resp.read()
         except (Exception, Timeout):
             resp = None
             logger.exception("Failed to read response %s", conn.chunk)
@@ -201,20 +270,31 @@ class ReplicatedChunkWriteHandler(object):
 
 class ReplicatedWriteHandler(io.WriteHandler):
     def stream(self):
-        global_checksum = hashlib.md5()
+        global_checksum = self.checksum
         total_bytes_transferred = 0
         content_chunks = []
 
-        for pos in range(len(self.chunks)):
-            meta_chunk = self.chunks[pos]
-
-            # chunks are all identical
-            # so take the first size
-            size = meta_chunk[0]["size"]
-            handler = ReplicatedChunkWriteHandler(
-                self.sysmeta, meta_chunk, global_checksum, self.storage_method)
-            bytes_transferred, checksum, chunks = handler.stream(self.source,
-                                                                 size)
+        def handlers():
+            remaining = self.sysmeta.get('content_length')
+            if remaining is not None:
+                remaining = int(remaining) - self.offset
+            for pos, meta_chunk in self._meta_chunks():
+                # chunks are all identical
+                # so take the first size
+                size = meta_chunk[0]["size"]
+                # the exact size of the meta chunk, if known
+                length = None
+                if remaining is not None:
+                    length = min(int(size), remaining)
+                    remaining -= length
+                handler = ReplicatedChunkWriteHandler(
+                    self.sysmeta, meta_chunk, global_checksum,
+                    self.storage_method, content_length=length,
+                    settings=self.settings)
+                yield handler, size
+
+        for bytes_transferred, checksum, chunks in \
+                self._stream_meta_chunks(handlers()):
             content_chunks += chunks
             total_bytes_transferred += bytes_transferred
 
@@ -1,9 +1,17 @@
+import logging
+import threading
+from collections import OrderedDict
 from oiopy import exceptions as exc
 from pyeclib.ec_iface import ECDriver
 
 
+logger = logging.getLogger(__name__)
+
 EC_SEGMENT_SIZE = 1048576
 
+# max number of storage methods kept in cache
+CACHE_SIZE = 64
+
 
 ec_type_to_pyeclib_type = {
     'isa_l_rs_vand': 'isa_l_rs_vand',
@@ -28,20 +36,64 @@ def parse_chunk_method(chunk_method):
 
 
 class StorageMethods(object):
-    def __init__(self, methods):
+    """
+    Builds the storage methods from chunk method strings.
+
+    Built storage methods are kept in a LRU cache,
+    so the EC drivers are only initialized once.
+    """
+    def __init__(self, methods, cache_size=CACHE_SIZE):
         self.index = methods
-        self.cache = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
 
     def load(self, chunk_method):
-        method = self.cache.get(chunk_method)
-        if method:
-            return method
+        with self._lock:
+            method = self.cache.pop(chunk_method, None)
+            if method is not None:
+                # put it back as the most recently used
+                self.cache[chunk_method] = method
+                self.stats['hits'] += 1
+                return method
+            self.stats['misses'] += 1
+        method = self._build(chunk_method)
+        with self._lock:
+            # another thread may have built it meanwhile
+            method = self.cache.pop(chunk_method, method)
+            self.cache[chunk_method] = method
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return method
+
+    def _build(self, chunk_method):
         try:
-            chunk_method, params = parse_chunk_method(chunk_method)
-            cls = self.index[chunk_method]
+            name, params = parse_chunk_method(chunk_method)
+            cls = self.index[name]
+            return cls.build(params)
         except Exception as e:
             raise exc.InvalidStorageMethod(str(e))
-        return cls.build(params)
+
+    def preload(self, chunk_methods):
+        """
+        Load chunk methods in cache,
+        typically the ones used by the policies of the namespace.
+
+        :returns: the list of chunk methods that could not be loaded
+        """
+        failed = []
+        for chunk_method in chunk_methods:
+            try:
+                self.load(chunk_method)
+            except exc.InvalidStorageMethod as e:
+                logger.warn("Failed to load %s (%s)", chunk_method, e)
+                failed.append(chunk_method)
+        return failed
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
 
 
 class StorageMethod(object):
@@ -131,6 +131,10 @@ def http_header_from_ranges(ranges):
 
 
 def convert_ranges(ranges, length):
+    """
+    Resolve the ranges against the length of the data,
+    the ends of the returned ranges are inclusive.
+    """
     if length is None or not ranges or ranges == []:
         return None
     result = []
@@ -142,18 +146,18 @@ def convert_ranges(ranges, length):
                 continue
             elif end > length:
                 # all content must be returned
-                result.append((0, length))
+                result.append((0, length - 1))
             else:
-                result.append((length - end, length))
+                result.append((length - end, length - 1))
             continue
         if end is None:
             if start < length:
-                result.append((start, length))
+                result.append((start, length - 1))
             else:
                 # skip
                 continue
         elif start < length:
-            result.append((start, min(end, length)))
+            result.append((start, min(end, length - 1)))
 
     return result
 
@@ -0,0 +1,231 @@
+"""
+Benchmark of ObjectStorageAPI against in-process proxy and rawx
+stand-ins, for each chunk method and object size.
+
+Run the benchmark and save the results:
+
+    python -m tests.benchmark.run --output bench.json
+
+or with tox, the arguments following -- being passed along:
+
+    tox -e benchmark -- --output bench.json
+
+Compare the results of two runs, typically of two commits:
+
+    python -m tests.benchmark.run --compare before.json after.json
+
+CPU time includes the work of the stand-in services, which run in
+the same process. Peak RSS is the peak of the process so far,
+so it never decreases from one scenario to the next.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from cStringIO import StringIO
+
+from oiopy.constants import object_headers
+from oiopy.object_storage import ObjectStorageAPI
+from tests.benchmark.servers import start_services, stop_services, POLICIES
+
+
+NAMESPACE = 'BENCH'
+ACCOUNT = 'bench'
+SIZES = [65536, 1048576, 16777216]
+ITERATIONS = 10
+LIST_OBJECTS = 10000
+LIST_LIMIT = 1000
+
+
+def _usage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def measure(name, chunk_method, size, iterations, func):
+    """
+    Call func(i) iterations times and return the measures.
+
+    :param size: number of bytes transferred by each call
+    """
+    cpu_start, _rss = _usage()
+    start = time.time()
+    for i in range(iterations):
+        func(i)
+    elapsed = max(time.time() - start, 0.000001)
+    cpu_end, peak_rss = _usage()
+    return {
+        'op': name,
+        'chunk_method': chunk_method,
+        'size': size,
+        'iterations': iterations,
+        'elapsed': elapsed,
+        'mb_per_s': size * iterations / elapsed / 1048576,
+        'ops_per_s': iterations / elapsed,
+        'cpu_time': cpu_end - cpu_start,
+        'peak_rss_kb': peak_rss,
+    }
+
+
+def _consume(stream, expected):
+    size = 0
+    for data in stream:
+        size += len(data)
+    if size != expected:
+        raise Exception('read %d bytes instead of %d' % (size, expected))
+
+
+def bench_policy(api, policy, sizes, iterations):
+    container = 'bench-%s' % policy
+    results = []
+    for size in sizes:
+        data = os.urandom(size)
+        obj = 'obj-%d' % size
+
+        def create(_i):
+            api.object_create(ACCOUNT, container, obj_name=obj,
+                              file_or_path=StringIO(data),
+                              content_length=size, policy=policy)
+
+        def fetch(_i):
+            _meta, stream = api.object_fetch(ACCOUNT, container, obj)
+            _consume(stream, size)
+
+        # the middle half of the object
+        range_start = size // 4
+        range_end = range_start + size // 2 - 1
+
+        def fetch_range(_i):
+            _meta, stream = api.object_fetch(
+                ACCOUNT, container, obj, ranges=[(range_start, range_end)])
+            _consume(stream, range_end - range_start + 1)
+
+        results.append(measure('create', policy, size, iterations, create))
+        results.append(measure('fetch', policy, size, iterations, fetch))
+        results.append(measure('fetch_range', policy, size // 2,
+                               iterations, fetch_range))
+    return results
+
+
+def bench_list(api, proxy, nb_objects, iterations):
+    container = 'bench-list'
+    # fill the listing directly, the objects themselves are not needed
+    content = proxy.containers.setdefault((ACCOUNT, container), {})
+    for i in range(nb_objects):
+        headers = {object_headers['size']: '0',
+                   object_headers['hash']: 'D41D8CD98F00B204E9800998ECF8427E'}
+        content['obj-%08d' % i] = (headers, [])
+
+    def list_objects(i):
+        marker = 'obj-%08d' % ((i * LIST_LIMIT) % nb_objects)
+        api.object_list(ACCOUNT, container, limit=LIST_LIMIT, marker=marker)
+
+    return [measure('list', None, 0, iterations, list_objects)]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, iterations, policies, list_objects):
+    proxy = start_services(NAMESPACE)
+    try:
+        api = ObjectStorageAPI(NAMESPACE, proxy.endpoint)
+        results = []
+        for policy in policies:
+            results += bench_policy(api, policy, sizes, iterations)
+        if list_objects:
+            results += bench_list(api, proxy, list_objects, iterations)
+    finally:
+        stop_services(proxy)
+    return {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.time(),
+        'results': results,
+    }
+
+
+def _key(result):
+    return result['op'], result['chunk_method'], result['size']
+
+
+def compare(before, after, out=sys.stdout):
+    """
+    Print the throughput of each scenario of two runs.
+    """
+    previous = dict((_key(r), r) for r in before['results'])
+    out.write('%-12s %-6s %10s %12s %12s %8s\n' % (
+        'op', 'method', 'size', 'before', 'after', 'ratio'))
+    for result in after['results']:
+        old = previous.get(_key(result))
+        # listings move no bytes
+        metric = 'mb_per_s' if result['size'] else 'ops_per_s'
+        new_value = result[metric]
+        old_value = old[metric] if old else None
+        ratio = new_value / old_value if old_value else None
+        out.write('%-12s %-6s %10d %12s %12.2f %8s\n' % (
+            result['op'], result['chunk_method'] or '-', result['size'],
+            '%.2f' % old_value if old_value is not None else '-',
+            new_value, '%.2f' % ratio if ratio is not None else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--output', metavar='<file>',
+        help='Save the results to <file> (default: standard output)')
+    parser.add_argument(
+        '--sizes', metavar='<size>[,<size>...]',
+        default=','.join(str(s) for s in SIZES),
+        help='Object sizes in bytes')
+    parser.add_argument(
+        '--iterations', metavar='<iterations>', type=int,
+        default=ITERATIONS,
+        help='Number of operations of each scenario')
+    parser.add_argument(
+        '--policy', metavar='<policy>', action='append',
+        choices=sorted(POLICIES),
+        help='Chunk method to benchmark (default: all)')
+    parser.add_argument(
+        '--list-objects', metavar='<count>', type=int,
+        default=LIST_OBJECTS,
+        help='Number of objects of the listed container, 0 to skip')
+    parser.add_argument(
+        '--compare', metavar='<file>', nargs=2,
+        help='Compare the results of two runs')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        compare(before, after)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    report = run(sizes, args.iterations,
+                 args.policy or sorted(POLICIES), args.list_objects)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
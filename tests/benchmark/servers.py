@@ -0,0 +1,285 @@
+"""
+In-process stand-ins for the proxy and the rawx services.
+
+They only implement what ObjectStorageAPI needs to create, fetch
+and list objects, but actually move the bytes through local sockets.
+"""
+
+import json
+import socket
+import uuid
+from urlparse import parse_qs
+
+import eventlet
+from eventlet import wsgi
+
+from oiopy.constants import object_headers
+
+
+CHUNK_SIZE = 4194304
+
+POLICIES = {
+    'plain': 'plain/nb_copy=3',
+    'ec': 'ec/algo=liberasurecode_rs_vand,k=6,m=3',
+}
+
+EC_SEGMENT_SIZE = 1048576
+
+
+class _NullLog(object):
+    def write(self, *args):
+        pass
+
+
+class _Protocol(wsgi.HttpProtocol):
+    # the headers and the body of a response are buffered,
+    # then sent with a single write
+    wbufsize = CHUNK_SIZE + 65536
+
+    def setup(self):
+        wsgi.HttpProtocol.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def _serve(app):
+    sock = eventlet.listen(('127.0.0.1', 0))
+    server = eventlet.spawn(wsgi.server, sock, app, log=_NullLog(),
+                            log_output=False, protocol=_Protocol)
+    return server, '127.0.0.1:%d' % sock.getsockname()[1]
+
+
+def _parse_range(value, length):
+    # only single ranges are sent by the readers
+    start, end = value.split('=', 1)[1].split('-')
+    if not start:
+        start = max(length - int(end), 0)
+        end = length - 1
+    else:
+        start = int(start)
+        end = min(int(end), length - 1) if end else length - 1
+    return start, end
+
+
+class FakeRawx(object):
+    """
+    Stores the chunks in memory.
+    """
+    def __init__(self):
+        self.chunks = {}
+        self.server = None
+        self.addr = None
+
+    def start(self):
+        self.server, self.addr = _serve(self)
+        return self
+
+    def stop(self):
+        self.server.kill()
+
+    def __call__(self, env, start_response):
+        method = env['REQUEST_METHOD']
+        path = env['PATH_INFO']
+        if method == 'PUT':
+            return self._put(env, path, start_response)
+        elif method == 'GET':
+            return self._get(env, path, start_response)
+        start_response('405 Method Not Allowed', [('Content-Length', '0')])
+        return ['']
+
+    def _put(self, env, path, start_response):
+        body = env['wsgi.input']
+        parts = []
+        while True:
+            data = body.read(65536)
+            if not data:
+                break
+            parts.append(data)
+        if env.get('HTTP_TRAILER'):
+            # the input only consumed the first trailer line
+            while body.rfile.readline() not in ('\r\n', '\n', ''):
+                pass
+        self.chunks[path] = ''.join(parts)
+        start_response('201 Created', [('Content-Length', '0')])
+        return ['']
+
+    def _get(self, env, path, start_response):
+        data = self.chunks.get(path)
+        if data is None:
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return ['']
+        headers = []
+        status = '200 OK'
+        if env.get('HTTP_RANGE'):
+            start, end = _parse_range(env['HTTP_RANGE'], len(data))
+            headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, end, len(data))))
+            data = data[start:end + 1]
+            status = '206 Partial Content'
+        headers.append(('Content-Length', str(len(data))))
+        start_response(status, headers)
+        return [data]
+
+    def clear(self):
+        self.chunks.clear()
+
+
+class FakeProxy(object):
+    """
+    Serves the content and container requests of a single namespace.
+    """
+    def __init__(self, namespace, rawx, chunk_size=CHUNK_SIZE):
+        self.namespace = namespace
+        self.rawx = rawx
+        self.chunk_size = chunk_size
+        # (account, container) -> {path: content}
+        self.containers = {}
+        self.server = None
+        self.addr = None
+
+    def start(self):
+        self.server, self.addr = _serve(self)
+        return self
+
+    def stop(self):
+        self.server.kill()
+
+    @property
+    def endpoint(self):
+        return 'http://%s' % self.addr
+
+    def __call__(self, env, start_response):
+        prefix = '/v3.0/%s/' % self.namespace
+        path = env['PATH_INFO']
+        params = dict((k, v[0]) for k, v in
+                      parse_qs(env.get('QUERY_STRING', '')).items())
+        length = int(env.get('CONTENT_LENGTH') or 0)
+        body = env['wsgi.input'].read(length) if length else ''
+        action = path[len(prefix):] if path.startswith(prefix) else None
+        handler = {
+            'content/prepare': self._prepare,
+            'content/create': self._create,
+            'content/show': self._show,
+            'container/list': self._list,
+        }.get(action)
+        if handler is None:
+            return self._reply(start_response, 404, {'status': 404})
+        return handler(env, params, body, start_response)
+
+    def _reply(self, start_response, status, body, headers=None):
+        data = json.dumps(body)
+        headers = list((headers or {}).items())
+        headers.append(('Content-Type', 'application/json'))
+        headers.append(('Content-Length', str(len(data))))
+        start_response('%d X' % status, headers)
+        return [data]
+
+    def _prepare(self, env, params, body, start_response):
+        args = json.loads(body)
+        size = int(args['size'])
+        policy = args.get('policy') or 'plain'
+        chunk_method = POLICIES[policy]
+
+        chunks = []
+        if policy == 'ec':
+            k, m = 6, 3
+            # same upper bound as the EC write handler
+            meta_size = k * self.chunk_size
+            meta_size -= meta_size % EC_SEGMENT_SIZE
+            nb_copy = k + m
+        else:
+            meta_size = self.chunk_size
+            nb_copy = 3
+        nb_meta = max(1, (size + meta_size - 1) // meta_size)
+        for pos in range(nb_meta):
+            for i in range(nb_copy):
+                rawx = self.rawx[(pos * nb_copy + i) % len(self.rawx)]
+                chunk_pos = ('%d.%d' % (pos, i)) if policy == 'ec' \
+                    else str(pos)
+                chunks.append({
+                    'url': 'http://%s/%s' % (rawx.addr,
+                                             uuid.uuid4().hex.upper()),
+                    'pos': chunk_pos,
+                    'size': self.chunk_size,
+                    'hash': '00000000000000000000000000000000'})
+
+        headers = {
+            'X-oio-ns-chunk-size': str(self.chunk_size),
+            object_headers['id']: uuid.uuid4().hex.upper(),
+            object_headers['version']: '1',
+            object_headers['policy']: policy,
+            object_headers['mime_type']: 'application/octet-stream',
+            object_headers['chunk_method']: chunk_method,
+        }
+        return self._reply(start_response, 200, chunks, headers)
+
+    def _create(self, env, params, body, start_response):
+        chunks = json.loads(body)
+        headers = {}
+        for key in object_headers.values():
+            value = env.get('HTTP_' + key.upper().replace('-', '_'))
+            if value is not None:
+                headers[key] = value
+        headers[object_headers['name']] = params['path']
+        container = self.containers.setdefault(
+            (params['acct'], params['ref']), {})
+        old = container.get(params['path'])
+        container[params['path']] = (headers, chunks)
+        if old:
+            # forget the chunks of the previous version
+            for chunk in old[1]:
+                self._rawx_of(chunk).chunks.pop(
+                    '/' + chunk['url'].rsplit('/', 1)[1], None)
+        return self._reply(start_response, 200, {})
+
+    def _rawx_of(self, chunk):
+        addr = chunk['url'].split('/')[2]
+        for rawx in self.rawx:
+            if rawx.addr == addr:
+                return rawx
+
+    def _show(self, env, params, body, start_response):
+        container = self.containers.get((params['acct'], params['ref']), {})
+        content = container.get(params['path'])
+        if content is None:
+            return self._reply(start_response, 404,
+                               {'status': 420, 'message': 'not found'})
+        headers, chunks = content
+        return self._reply(start_response, 200, chunks, headers)
+
+    def _list(self, env, params, body, start_response):
+        container = self.containers.get((params['acct'], params['ref']), {})
+        prefix = params.get('prefix') or ''
+        marker = params.get('marker') or ''
+        end_marker = params.get('end_marker')
+        limit = int(params.get('max') or 1000)
+        names = sorted(name for name in container
+                       if name.startswith(prefix) and name > marker and
+                       (not end_marker or name < end_marker))
+        objects = []
+        for name in names[:limit]:
+            headers, _chunks = container[name]
+            objects.append({
+                'name': name,
+                'size': int(headers.get(object_headers['size'], 0)),
+                'hash': headers.get(object_headers['hash']),
+                'ver': 1,
+                'ctime': 0})
+        headers = {'x-oio-list-truncated': str(len(names) > limit).lower()}
+        return self._reply(start_response, 200,
+                           {'objects': objects, 'prefixes': []}, headers)
+
+
+def start_services(namespace, nb_rawx=9, chunk_size=CHUNK_SIZE):
+    """
+    Start a proxy and nb_rawx rawx services.
+
+    :returns: the proxy, its rawx services are in proxy.rawx
+    """
+    rawx = [FakeRawx().start() for _i in range(nb_rawx)]
+    return FakeProxy(namespace, rawx, chunk_size=chunk_size).start()
+
+
+def stop_services(proxy):
+    for rawx in proxy.rawx:
+        rawx.stop()
+    proxy.stop()
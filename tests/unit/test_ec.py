@@ -1,13 +1,17 @@
+import time
 import unittest
 import random
 from cStringIO import StringIO
+from io import BytesIO
 from collections import defaultdict
 from eventlet import Timeout
 from hashlib import md5
 from oiopy.fakes import set_http_connect, set_http_requests
 from oiopy.storage_method import STORAGE_METHODS
 from oiopy.ec import ECChunkWriteHandler, ECChunkDownloadHandler, \
-    ECRebuildHandler
+    ECRebuildHandler, ec_encode
+from oiopy import io
+from oiopy.io import HOST_STATS
 from oiopy import exceptions as exc
 from oiopy.constants import chunk_headers
 from tests.unit import empty_stream, decode_chunked_body, \
@@ -16,6 +20,8 @@ from tests.unit import empty_stream, decode_chunked_body, \
 
 class TestEC(unittest.TestCase):
     def setUp(self):
+        # readers try the services depending on what was measured
+        HOST_STATS.clear()
         self.chunk_method = 'ec/algo=liberasurecode_rs_vand,k=6,m=2'
         storage_method = STORAGE_METHODS.load(self.chunk_method)
         self.storage_method = storage_method
@@ -194,7 +200,44 @@ class TestEC(unittest.TestCase):
             self.assertRaises(Exception, handler.stream, source,
                               size)
 
+    def test_write_io_settings(self):
+        test_data = '1234' * self.storage_method.ec_segment_size
+        nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
+        transfers = []
+
+        class SlowSource(object):
+            def __init__(self):
+                self.data = StringIO(test_data)
+
+            def read(self, size):
+                time.sleep(0.01)
+                return self.data.read(size)
+
+        settings = io.IOSettings()
+        settings.add_transfer = lambda *args: transfers.append(args)
+        with set_http_connect(*([201] * nb)):
+            handler = ECChunkWriteHandler(self.sysmeta, self.meta_chunk(),
+                                          self.checksum(),
+                                          self.storage_method,
+                                          settings=settings)
+            handler.stream(SlowSource(), len(test_data))
+
+        self.assertEqual(len(transfers), 1)
+        nb_bytes, duration = transfers[0]
+        # the fragments of one connection, with their headers
+        self.assertGreater(
+            nb_bytes, len(test_data) // self.storage_method.ec_nb_data)
+        # the time spent reading the source is not measured
+        self.assertLess(duration, 0.01)
+
     def test_write_transfer(self):
+        self._test_write_transfer(StringIO)
+
+    def test_write_transfer_readinto(self):
+        # BytesIO source is read with readinto
+        self._test_write_transfer(BytesIO)
+
+    def _test_write_transfer(self, source_cls):
         checksum = self.checksum()
         segment_size = self.storage_method.ec_segment_size
         test_data = ('1234' * segment_size)[:-10]
@@ -202,7 +245,7 @@ class TestEC(unittest.TestCase):
         test_data_checksum = self.checksum(test_data).hexdigest()
         nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
         resps = [201] * nb
-        source = StringIO(test_data)
+        source = source_cls(test_data)
 
         put_reqs = defaultdict(lambda: {'parts': []})
 
@@ -251,6 +294,29 @@ class TestEC(unittest.TestCase):
         self.assertEqual(
             test_data_checksum, self.checksum(final_data).hexdigest())
 
+    def test_encode(self):
+        segment_size = self.storage_method.ec_segment_size
+        nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
+        test_data = ''.join(chr(random.randint(0, 255))
+                            for _i in range(1000)) * (segment_size // 400)
+        parts = [test_data[:10], test_data[10:segment_size + 20],
+                 test_data[segment_size + 20:]]
+
+        encoder = ec_encode(self.storage_method, nb)
+        encoder.send(None)
+        segments = []
+        for part in parts:
+            result = encoder.send(part)
+            if result is not None:
+                segments.extend(result)
+        segments.extend(encoder.send(''))
+
+        expected = [self.storage_method.driver.encode(
+            test_data[x:x + segment_size])
+            for x in range(0, len(test_data), segment_size)]
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(segments, expected)
+
     def _make_ec_chunks(self, data):
         segment_size = self.storage_method.ec_segment_size
 
@@ -367,6 +433,93 @@ class TestEC(unittest.TestCase):
 
         return test_data, ec_chunks
 
+    def _read_fastest(self, responses, test_data, extra_readers):
+        def get_response(req):
+            return responses.pop(0) if responses else FakeResponse(404)
+
+        meta_chunk = self.meta_chunk()
+        meta_chunk[0]['size'] = len(test_data)
+        data = ''
+        with set_http_requests(get_response) as conn_record:
+            handler = ECChunkDownloadHandler(
+                self.storage_method, meta_chunk, None, None, {},
+                extra_readers=extra_readers)
+            stream = handler.get_stream()
+            for part in stream:
+                for x in part['iter']:
+                    data += x
+        return data, len(conn_record)
+
+    def test_read_fastest(self):
+        test_data, ec_chunks = self._make_ec_meta_resp()
+        nb_data = self.storage_method.ec_nb_data
+
+        # the first chunk is slow
+        responses = [FakeResponse(200, ec_chunks[0], slow=0.05)]
+        responses += [FakeResponse(200, ec_chunks[i])
+                      for i in range(1, nb_data + 1)]
+
+        with Timeout(1):
+            data, nb_requests = self._read_fastest(responses, test_data, 1)
+        self.assertEqual(len(data), len(test_data))
+        self.assertEqual(data, test_data)
+        self.assertEqual(nb_requests, nb_data + 1)
+
+    def test_read_fastest_reader_failure(self):
+        test_data, ec_chunks = self._make_ec_meta_resp()
+        nb_data = self.storage_method.ec_nb_data
+        fragment_size = self.storage_method.ec_fragment_size
+
+        # the first chunk stops after one fragment
+        headers = {'Content-Length': len(ec_chunks[0])}
+        responses = [FakeResponse(200, ec_chunks[0][:fragment_size],
+                                  headers)]
+        responses += [FakeResponse(200, ec_chunks[i])
+                      for i in range(1, nb_data + 2)]
+
+        data, nb_requests = self._read_fastest(responses, test_data, 2)
+        self.assertEqual(data, test_data)
+        self.assertEqual(nb_requests, nb_data + 2)
+
+    def _read_paths(self, meta_chunk):
+        test_data, ec_chunks = self._make_ec_meta_resp()
+
+        paths = []
+
+        def get_response(req):
+            paths.append(req['path'])
+            return FakeResponse(200, ec_chunks[int(req['path'][1:])])
+
+        meta_chunk[0]['size'] = len(test_data)
+        data = ''
+        with set_http_requests(get_response):
+            handler = ECChunkDownloadHandler(
+                self.storage_method, meta_chunk, None, None, {})
+            stream = handler.get_stream()
+            for part in stream:
+                for x in part['iter']:
+                    data += x
+        self.assertEqual(data, test_data)
+        return sorted(paths)
+
+    def test_read_data_fragments_first(self):
+        nb_data = self.storage_method.ec_nb_data
+        # parity chunks first
+        meta_chunk = list(reversed(self.meta_chunk()))
+        paths = self._read_paths(meta_chunk)
+        self.assertEqual(paths, ['/%d' % i for i in range(nb_data)])
+
+    def test_read_unhealthy_data_fragment(self):
+        HOST_STATS.add_error('127.0.0.1:7000')
+        paths = self._read_paths(self.meta_chunk())
+        self.assertEqual(paths, ['/1', '/2', '/3', '/4', '/5', '/6'])
+        # the other services answered
+        stats = HOST_STATS.snapshot()
+        self.assertFalse(stats['127.0.0.1:7000']['healthy'])
+        self.assertTrue(stats['127.0.0.1:7006']['healthy'])
+        self.assertEqual(stats['127.0.0.1:7006']['requests'], 1)
+        self.assertNotIn('127.0.0.1:7007', stats)
+
     def test_read_zero_byte(self):
         empty = ''
 
@@ -432,7 +585,10 @@ class TestEC(unittest.TestCase):
             FakeResponse(206, ec_chunks[7][:fragment_size], headers),
         ]
 
+        ranges = []
+
         def get_response(req):
+            ranges.append(req['headers'].get('Range'))
             return responses.pop(0) if responses else FakeResponse(404)
 
         headers = {}
@@ -457,6 +613,11 @@ class TestEC(unittest.TestCase):
         self.assertEqual(parts[0]['end'], 4)
         self.assertEqual(data, '2341')
         self.assertEqual(len(conn_record), self.storage_method.ec_nb_data)
+        # only the first fragment of each chunk is requested
+        self.assertEqual(
+            ranges,
+            ['bytes=0-%d' % (fragment_size - 1)] *
+            self.storage_method.ec_nb_data)
 
     def test_read_range_unsatisfiable(self):
 
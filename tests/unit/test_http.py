@@ -0,0 +1,268 @@
+import socket
+import unittest
+import eventlet
+from mock import patch
+from oiopy.http import ConnectionPool, PooledAdapter, http_connect
+
+
+class FakeResponse(object):
+    def __init__(self, closed=True, will_close=False, chunked=False,
+                 length=0):
+        self.closed = closed
+        self.will_close = will_close
+        self.chunked = chunked
+        self.length = length
+
+    def isclosed(self):
+        return self.closed
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+
+    def _connected(self, conn):
+        # give the connection an idle socket
+        local, remote = socket.socketpair()
+        self.socks.append(remote)
+        conn.sock = local
+        return remote
+
+    def test_get_new(self):
+        pool = ConnectionPool()
+        conn = pool.get('127.0.0.1:6000')
+        self.assertEqual(conn.pool_key, '127.0.0.1:6000')
+        self.assertEqual(pool.stats['misses'], 1)
+        self.assertEqual(pool.stats['hits'], 0)
+
+    def test_reuse(self):
+        pool = ConnectionPool()
+        conn = pool.get('127.0.0.1:6000')
+        self._connected(conn)
+        pool.release(conn, FakeResponse())
+        self.assertEqual(len(pool), 1)
+
+        # other host
+        other = pool.get('127.0.0.1:6001')
+        self.assertIsNot(other, conn)
+
+        self.assertIs(pool.get('127.0.0.1:6000'), conn)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.stats['hits'], 1)
+        self.assertEqual(pool.stats['misses'], 2)
+
+    def test_release_not_reusable(self):
+        pool = ConnectionPool()
+        resps = [
+            None,
+            # response not fully read
+            FakeResponse(closed=False, length=10),
+            # response closed before the end
+            FakeResponse(closed=True, length=10),
+            # server asked to close
+            FakeResponse(will_close=True),
+            FakeResponse(chunked=True),
+        ]
+        for resp in resps:
+            conn = pool.get('127.0.0.1:6000')
+            self._connected(conn)
+            pool.release(conn, resp)
+            self.assertEqual(len(pool), 0)
+            self.assertEqual(conn.sock, None)
+
+    def test_dropped(self):
+        pool = ConnectionPool()
+        conn = pool.get('127.0.0.1:6000')
+        remote = self._connected(conn)
+        pool.release(conn, FakeResponse())
+        # remote end closed the connection while idle
+        remote.close()
+        self.assertIsNot(pool.get('127.0.0.1:6000'), conn)
+        self.assertEqual(pool.stats['discarded'], 1)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(idle_timeout=0)
+        conn = pool.get('127.0.0.1:6000')
+        self._connected(conn)
+        pool.release(conn, FakeResponse())
+        self.assertIsNot(pool.get('127.0.0.1:6000'), conn)
+
+    def test_max_per_host(self):
+        pool = ConnectionPool(max_per_host=2)
+        conns = [pool.get('127.0.0.1:6000') for _i in range(3)]
+        for conn in conns:
+            self._connected(conn)
+            pool.release(conn, FakeResponse())
+        self.assertEqual(len(pool), 2)
+        # the oldest connection has been closed
+        self.assertEqual(conns[0].sock, None)
+        self.assertIs(pool.get('127.0.0.1:6000'), conns[2])
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=2)
+        conns = [pool.get('127.0.0.1:600%d' % i) for i in range(3)]
+        for conn in conns:
+            self._connected(conn)
+            pool.release(conn, FakeResponse())
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(conns[2].sock, None)
+
+    def test_clear(self):
+        pool = ConnectionPool()
+        conn = pool.get('127.0.0.1:6000')
+        self._connected(conn)
+        pool.release(conn, FakeResponse())
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(conn.sock, None)
+
+
+class FakeServer(object):
+    """
+    HTTP server answering each request with its body,
+    closing the connections after the first request when told to.
+    """
+    def __init__(self):
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.addr = '127.0.0.1:%d' % self.sock.getsockname()[1]
+        self.close_after_first = eventlet.event.Event()
+        self.accepted = []
+        self.thread = eventlet.spawn(self._serve)
+
+    def _serve(self):
+        while True:
+            sock, _addr = self.sock.accept()
+            self.accepted.append(sock)
+            eventlet.spawn(self._handle, sock)
+
+    def _handle(self, sock):
+        reader = sock.makefile('rb')
+        nb_requests = 0
+        while True:
+            length = 0
+            line = reader.readline()
+            if not line:
+                break
+            while line not in ('\r\n', ''):
+                name, _sep, value = line.partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+                line = reader.readline()
+            body = reader.read(length)
+            sock.sendall('HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s'
+                         % (len(body), body))
+            nb_requests += 1
+            if nb_requests == 1:
+                self.close_after_first.wait()
+                break
+        reader.close()
+        sock.close()
+
+    def stop(self):
+        self.thread.kill()
+        self.sock.close()
+
+
+class PooledConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _nodelay(self, conn):
+        return conn.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+    def _request(self, pool, method, body=None):
+        headers = {'Content-Length': len(body or '')}
+        conn = http_connect(self.server.addr, method, '/', headers,
+                            pool=pool)
+        if body:
+            conn.send(body)
+        resp = conn.getresponse()
+        data = resp.read()
+        pool.release(conn, resp)
+        return conn, resp, data
+
+    def test_nodelay(self):
+        pool = ConnectionPool()
+        conn, _resp, _data = self._request(pool, 'GET')
+        self.assertTrue(self._nodelay(conn))
+        self.assertIs(pool.get(self.server.addr), conn)
+        self.assertTrue(self._nodelay(conn))
+
+    def _test_closed_after_check(self, method, body=None):
+        pool = ConnectionPool()
+        conn, _resp, _data = self._request(pool, method, body)
+        # the remote end closes the connection
+        # after it has been checked by the pool
+        self.server.close_after_first.send()
+        eventlet.sleep(0.01)
+        with patch('oiopy.http._is_dropped', return_value=False):
+            reused, resp, data = self._request(pool, method, body)
+        self.assertIs(reused, conn)
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(data, body or '')
+        self.assertEqual(len(self.server.accepted), 2)
+
+    def test_get_closed_after_check(self):
+        self._test_closed_after_check('GET')
+
+    def test_put_closed_after_check(self):
+        self._test_closed_after_check('PUT', 'x' * 1024)
+
+
+class PooledAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+
+    def _get_pool(self, adapter):
+        return adapter.poolmanager.connection_from_url(
+            'http://127.0.0.1:6000/')
+
+    def _connected(self, conn):
+        local, remote = socket.socketpair()
+        self.socks.append(remote)
+        conn.sock = local
+        return conn
+
+    def test_reuse(self):
+        adapter = PooledAdapter(pool_maxsize=2)
+        pool = self._get_pool(adapter)
+        conn = self._connected(pool._get_conn())
+        pool._put_conn(conn)
+        self.assertTrue(pool._get_conn() is conn)
+        self.assertEqual(adapter.stats,
+                         {'hits': 1, 'misses': 1, 'discarded': 0})
+
+    def test_idle_timeout(self):
+        adapter = PooledAdapter(idle_timeout=10)
+        pool = self._get_pool(adapter)
+        conn = self._connected(pool._get_conn())
+        pool._put_conn(conn)
+        conn.idle_since -= 20
+        conn = pool._get_conn()
+        self.assertEqual(conn.sock, None)
+        self.assertEqual(adapter.stats,
+                         {'hits': 0, 'misses': 2, 'discarded': 1})
+
+    def test_no_keep_alive(self):
+        adapter = PooledAdapter(keep_alive=False)
+        pool = self._get_pool(adapter)
+        conn = self._connected(pool._get_conn())
+        pool._put_conn(conn)
+        self.assertEqual(pool._get_conn().sock, None)
+        self.assertEqual(adapter.stats['misses'], 2)
+
+    def test_resize(self):
+        adapter = PooledAdapter(pool_maxsize=2)
+        adapter.resize(20)
+        self.assertEqual(self._get_pool(adapter).pool.maxsize, 20)
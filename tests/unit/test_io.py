@@ -1,7 +1,15 @@
+import time
 import unittest
-from mock import patch
-from oiopy.io import ChunkReader, discard_bytes
+from cStringIO import StringIO
+from mock import MagicMock as Mock, patch
+from eventlet import sleep, Timeout
+from oiopy.io import ChunkReader, WriteHandler, LatencyStats, HostStats, \
+    HOST_STATS, discard_bytes, prefetch, frame_chunk, \
+    IOSettings, IOTuner, StreamSource
+from oiopy import io
 from oiopy import exceptions as exc
+from oiopy.fakes import set_http_requests
+from tests.unit import FakeResponse
 
 
 class FakeSource(object):
@@ -89,6 +97,43 @@ class IOTest(unittest.TestCase):
         data = list(it)
         self.assertEqual(data, ['1234abcd', '1234abcd', '1234abcd', '1234ab'])
 
+    def test_reader_buf_read_sizes(self):
+        reader = ChunkReader(None, 4, {})
+        reader.discard_bytes = 3
+
+        class SizedSource(FakeSource):
+            def __init__(self, data):
+                super(SizedSource, self).__init__([])
+                self.buf = data
+                self.sizes = []
+
+            def read(self, size):
+                self.sizes.append(size)
+                d, self.buf = self.buf[:size], self.buf[size:]
+                return d
+
+        source = SizedSource('xyz1234abcd12')
+        it = reader._create_iter({}, source)
+
+        data = list(it)
+        self.assertEqual(data, ['1234', 'abcd', '12'])
+        self.assertEqual(reader.discard_bytes, 0)
+        # only the bytes to discard or to complete a record are requested
+        self.assertEqual(source.sizes, [3, 4, 4, 4, 2])
+
+    def test_reader_read_chunk_size(self):
+        reader = ChunkReader(None, None, {}, read_chunk_size=3)
+        sizes = []
+
+        class SizedSource(FakeSource):
+            def read(self, size):
+                sizes.append(size)
+                return super(SizedSource, self).read(size)
+
+        it = reader._create_iter({}, SizedSource(['abcdefgh']))
+        self.assertEqual(''.join(it), 'abcdefgh')
+        self.assertEqual(set(sizes), set([3]))
+
     def test_reader_buf_resume(self):
         chunk = {}
 
@@ -104,3 +149,301 @@ class IOTest(unittest.TestCase):
             data = list(it)
 
         self.assertEqual(data, ['1234abcd', '5678efgh'])
+
+    def _hedged_read(self, get_response, hedge_delay):
+        chunks = [{'url': 'http://127.0.0.1:600%d/AAAA' % i}
+                  for i in range(3)]
+        with set_http_requests(get_response) as conn_record:
+            reader = ChunkReader(iter(chunks), None, {},
+                                 hedge_delay=hedge_delay)
+            data = ''
+            for part in reader.get_iter():
+                for d in part['iter']:
+                    data += d
+        return data, [conn.req['host'] for conn in conn_record.records]
+
+    def test_reader_hedged(self):
+        def get_response(req):
+            if req['host'] == '127.0.0.1:6000':
+                # headers take too long
+                sleep(0.1)
+                return FakeResponse(200, 'slow')
+            return FakeResponse(200, 'fast')
+
+        data, hosts = self._hedged_read(get_response, 0.01)
+        self.assertEqual(data, 'fast')
+        self.assertEqual(hosts, ['127.0.0.1:6000', '127.0.0.1:6001'])
+
+    def test_reader_hedged_first_fast(self):
+        def get_response(req):
+            return FakeResponse(200, req['host'])
+
+        data, hosts = self._hedged_read(get_response, 0.01)
+        self.assertEqual(data, '127.0.0.1:6000')
+        self.assertEqual(hosts, ['127.0.0.1:6000'])
+
+    def test_reader_hedged_error(self):
+        def get_response(req):
+            if req['host'] == '127.0.0.1:6000':
+                return FakeResponse(500)
+            return FakeResponse(200, req['host'])
+
+        # an error does not wait for the delay
+        with Timeout(1):
+            data, hosts = self._hedged_read(get_response, 10)
+        self.assertEqual(data, '127.0.0.1:6001')
+        self.assertEqual(hosts, ['127.0.0.1:6000', '127.0.0.1:6001'])
+
+    def test_latency_stats(self):
+        stats = LatencyStats(size=100, min_samples=10)
+        for i in range(9):
+            stats.add(i)
+        self.assertEqual(stats.percentile(95), None)
+        for i in range(9, 200):
+            stats.add(i)
+        # only the last 100 are kept
+        self.assertEqual(stats.percentile(0), 100)
+        self.assertEqual(stats.percentile(95), 195)
+        self.assertEqual(stats.percentile(100), 199)
+
+    def test_host_stats(self):
+        stats = HostStats(alpha=0.5, error_half_life=10, ttl=100)
+        chunks = [{'url': 'http://127.0.0.1:600%d/AAAA' % i}
+                  for i in range(4)]
+        now = [1000.0]
+        with patch('oiopy.io.time.time', lambda: now[0]):
+            stats.add_response('127.0.0.1:6000', 0.2)
+            stats.add_response('127.0.0.1:6000', 0.4)
+            stats.add_response('127.0.0.1:6001', 0.1)
+            stats.add_transfer('127.0.0.1:6001', 1048576, 1.0)
+            stats.add_response('127.0.0.1:6002', 0.01)
+            stats.add_error('127.0.0.1:6002')
+            self.assertAlmostEqual(stats.cost('127.0.0.1:6000'), 0.3)
+            self.assertAlmostEqual(stats.cost('127.0.0.1:6001'), 1.1)
+            self.assertFalse(stats.healthy('127.0.0.1:6002'))
+            # unknown services cost the median of the measured ones
+            self.assertAlmostEqual(stats.prior(), 0.3)
+            self.assertAlmostEqual(stats.cost('127.0.0.1:6003'), 0.3)
+            # unhealthy services last
+            self.assertEqual(
+                [c['url'][17:21] for c in stats.sort(chunks)],
+                ['6000', '6003', '6001', '6002'])
+
+            # the errors decay
+            now[0] += 20
+            self.assertAlmostEqual(
+                stats.snapshot()['127.0.0.1:6002']['errors'], 0.25)
+            self.assertTrue(stats.healthy('127.0.0.1:6002'))
+            self.assertEqual(
+                [c['url'][17:21] for c in stats.sort(chunks)],
+                ['6002', '6000', '6003', '6001'])
+
+            # old measures are forgotten
+            now[0] += 100
+            self.assertEqual(stats.snapshot(), {})
+
+    def test_reader_host_stats(self):
+        HOST_STATS.clear()
+
+        def get_response(req):
+            if req['host'] == '127.0.0.1:6000':
+                return FakeResponse(503)
+            return FakeResponse(200, 'data')
+
+        data, _hosts = self._hedged_read(get_response, None)
+        self.assertEqual(data, 'data')
+        stats = HOST_STATS.snapshot()
+        self.assertEqual(stats['127.0.0.1:6000']['failures'], 1)
+        self.assertFalse(stats['127.0.0.1:6000']['healthy'])
+        self.assertEqual(stats['127.0.0.1:6001']['requests'], 1)
+        self.assertTrue(stats['127.0.0.1:6001']['throughput'] > 0)
+        HOST_STATS.clear()
+
+    def test_reader_host_stats_throughput(self):
+        HOST_STATS.clear()
+        self.addCleanup(HOST_STATS.clear)
+        reader = ChunkReader(None, None, {}, read_chunk_size=4)
+        chunk = {'url': 'http://127.0.0.1:6005/AAAA'}
+        for _data in reader._create_iter(chunk, FakeSource(['abcdefgh'])):
+            # the time the records are not consumed is not measured
+            time.sleep(0.05)
+        stats = HOST_STATS.snapshot()
+        self.assertTrue(stats['127.0.0.1:6005']['throughput'] > 8 / 0.05)
+
+    def test_frame_chunk(self):
+        data = 'x' * 300
+        self.assertEqual(frame_chunk(data), '12c\r\n' + data + '\r\n')
+
+    def test_prefetch(self):
+        started = []
+
+        def stream(i):
+            started.append(i)
+            for j in range(3):
+                sleep(0)
+                yield '%d.%d' % (i, j)
+
+        for read_ahead in (0, 1, 2, 5):
+            del started[:]
+            streams = [stream(i) for i in range(4)]
+            it = prefetch(streams, read_ahead, 2, 1)
+            self.assertEqual(next(it), '0.0')
+            # the next streams are already started
+            self.assertEqual(started, range(min(read_ahead + 1, 4)))
+            data = list(it)
+            self.assertEqual(data, ['0.1', '0.2', '1.0', '1.1', '1.2',
+                                    '2.0', '2.1', '2.2', '3.0', '3.1',
+                                    '3.2'])
+
+    def test_prefetch_error(self):
+        def stream(fail):
+            yield 'a'
+            if fail:
+                raise exc.OioException('failure')
+            yield 'b'
+
+        it = prefetch([stream(False), stream(True), stream(False)], 2,
+                      10, 1)
+        self.assertEqual([next(it) for _i in range(3)], ['a', 'b', 'a'])
+        self.assertRaises(exc.OioException, next, it)
+
+    def test_write_pipeline(self):
+        events = []
+
+        class FakeHandler(object):
+            def __init__(self, pos):
+                self.pos = pos
+
+            def write(self, source, size):
+                events.append(('write', self.pos))
+
+            def wait(self):
+                sleep(0.01)
+                events.append(('wait', self.pos))
+                return self.pos
+
+        for depth in (0, 1, 2):
+            del events[:]
+            handler = WriteHandler(None, {}, {}, None, {},
+                                   pipeline_depth=depth)
+            results = handler._stream_meta_chunks(
+                (FakeHandler(pos), 0) for pos in range(4))
+            self.assertEqual(results, range(4))
+            writes = [pos for e, pos in events if e == 'write']
+            waits = [pos for e, pos in events if e == 'wait']
+            self.assertEqual(writes, range(4))
+            self.assertEqual(waits, range(4))
+            # meta chunk N+1 is written before N responses
+            # when the pipeline is enabled
+            self.assertEqual(events.index(('write', 1)) <
+                             events.index(('wait', 0)), depth > 0)
+
+    def test_write_pipeline_error(self):
+        done = []
+
+        class FakeHandler(object):
+            def __init__(self, pos):
+                self.pos = pos
+
+            def write(self, source, size):
+                pass
+
+            def wait(self):
+                sleep(0.01)
+                if self.pos == 1:
+                    raise exc.OioException('failure')
+                return (self.pos, )
+
+        handler = WriteHandler(None, {}, {}, None, {}, pipeline_depth=1,
+                               checkpoint=done.append)
+        stderr = StringIO()
+        with patch('sys.stderr', stderr):
+            self.assertRaises(
+                exc.OioException, handler._stream_meta_chunks,
+                ((FakeHandler(pos), 0) for pos in range(4)))
+            sleep(0.02)
+        self.assertEqual(done, [0])
+        # raised in the caller only, not printed by the hub
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_io_settings(self):
+        settings = IOSettings(chunk_timeout=10)
+        self.assertEqual(settings.write_chunk_size, io.WRITE_CHUNK_SIZE)
+        self.assertEqual(settings.chunk_timeout, 10)
+        call = settings.copy(write_chunk_size=1024, chunk_timeout=None)
+        self.assertEqual(call.write_chunk_size, 1024)
+        self.assertEqual(call.chunk_timeout, 10)
+        self.assertEqual(settings.write_chunk_size, io.WRITE_CHUNK_SIZE)
+        self.assertRaises(TypeError, settings.copy, block_size=1024)
+
+    def test_io_settings_tuner(self):
+        tuner = IOTuner(1024, 2)
+        settings = IOSettings(tuner=tuner)
+        tuner.write_chunk_size = 2048
+        call = settings.copy()
+        self.assertEqual(call.write_chunk_size, 2048)
+        self.assertEqual(call.put_queue_depth, 2)
+        self.assertTrue(call.tuner is tuner)
+        # explicit values are not measured
+        self.assertTrue(settings.copy(put_queue_depth=4).tuner is None)
+        self.assertTrue(settings.copy(chunk_timeout=5).tuner is tuner)
+        # the transfers are measured with the values they used
+        tuner.add_transfer = Mock()
+        call.add_transfer(100, 1.0)
+        tuner.add_transfer.assert_called_once_with(100, 1.0, 2048, 2)
+
+    def test_io_tuner(self):
+        tuner = IOTuner(1024, 2, max_chunk_size=8192, samples=2)
+        # throughput per connection for a given block size
+        throughputs = {1024: 100.0, 2048: 200.0, 4096: 210.0, 8192: 400.0}
+
+        def transfer():
+            tp = throughputs[tuner.write_chunk_size]
+            tuner.add_transfer(100 * 1024, 100 * 1024 / tp,
+                               tuner.write_chunk_size, tuner.put_queue_depth)
+
+        transfer()
+        self.assertEqual(tuner.write_chunk_size, 1024)
+        transfer()
+        self.assertEqual((tuner.write_chunk_size, tuner.put_queue_depth),
+                         (2048, 4))
+        # too small to be measured
+        tuner.add_transfer(8 * 2048 - 1, 1.0, 2048, 4)
+        # started with the values of the previous step
+        tuner.add_transfer(100 * 1024, 1000.0, 1024, 2)
+        for _i in range(4):
+            transfer()
+        # 4096 does not improve enough, back to 2048
+        self.assertEqual((tuner.write_chunk_size, tuner.put_queue_depth),
+                         (2048, 4))
+        self.assertTrue(tuner.settled)
+        transfer()
+        self.assertEqual(tuner.snapshot(),
+                         {'write_chunk_size': 2048, 'put_queue_depth': 4,
+                          'throughput': 200.0, 'settled': True})
+
+    def test_io_tuner_bounds(self):
+        tuner = IOTuner(1024, 2, max_chunk_size=2048, max_queue_depth=4,
+                        samples=1)
+        for tp in (100.0, 200.0):
+            tuner.add_transfer(100 * 1024, 100 * 1024 / tp,
+                               tuner.write_chunk_size, tuner.put_queue_depth)
+        self.assertEqual((tuner.write_chunk_size, tuner.put_queue_depth),
+                         (2048, 4))
+        self.assertTrue(tuner.settled)
+
+    def test_stream_source(self):
+        source = StreamSource(iter(['abcde', '', 'fg']))
+        self.assertFalse(source.at_eof())
+        self.assertEqual(source.read(3), 'abc')
+        self.assertEqual(source.read(3), 'de')
+        self.assertFalse(source.at_eof())
+        self.assertEqual(source.read(3), 'fg')
+        self.assertTrue(source.at_eof())
+        self.assertEqual(source.read(3), '')
+
+        source = StreamSource(StringIO('abcdefg'), read_size=4)
+        self.assertEqual(source.read(), 'abcd')
+        self.assertEqual(source.read(2), 'ef')
+        self.assertEqual(source.read(2), 'g')
+        self.assertTrue(source.at_eof())
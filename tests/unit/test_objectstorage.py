@@ -1,16 +1,26 @@
+from collections import defaultdict
+from hashlib import md5
 import json
 from mock import MagicMock as Mock
+import os
 import random
+import shutil
+import tempfile
 import unittest
+from eventlet import sleep
 
 
 from oiopy import exceptions
 from oiopy import fakes
 from oiopy import utils
-from oiopy.constants import container_headers, object_headers
+from oiopy.constants import chunk_headers, container_headers, \
+    object_headers
 from oiopy.object_storage import handle_object_not_found
 from oiopy.object_storage import handle_container_not_found
-from oiopy.object_storage import _sort_chunks
+from oiopy.object_storage import _sort_chunks, ServiceCache, \
+    get_meta_ranges, shard_boundaries
+from oiopy.http import requests
+from tests.unit import FakeResponse, decode_chunked_body
 
 
 class ObjectStorageTest(unittest.TestCase):
@@ -63,6 +73,60 @@ class ObjectStorageTest(unittest.TestCase):
             headers=self.headers)
         self.assertEqual(len(containers), 1)
 
+    def test_account_request_service_cache(self):
+        api = self.api
+        resp = fakes.FakeResponse()
+        resp.status_code = 200
+        lb_body = [{'addr': '1.2.3.4:6009'}]
+
+        def fake_request(method, uri, endpoint=None, **kwargs):
+            if uri.endswith('lb/choose'):
+                return resp, lb_body
+            return resp, {'id': self.account}
+
+        api._request = Mock(side_effect=fake_request)
+        for _i in range(3):
+            api.account_show(self.account)
+        lb_calls = [c for c in api._request.call_args_list
+                    if c[0][1].endswith('lb/choose')]
+        self.assertEqual(len(lb_calls), 1)
+        self.assertEqual(api.service_cache.stats['misses'], 1)
+        self.assertEqual(api.service_cache.stats['hits'], 2)
+
+        # connection errors evict the service
+        api._request = Mock(side_effect=[
+            requests.ConnectionError(), (resp, lb_body)])
+        self.assertRaises(requests.ConnectionError,
+                          api.account_show, self.account)
+        self.assertEqual(api.service_cache.stats['evictions'], 1)
+        self.assertEqual(api._get_service_url('account'),
+                         'http://1.2.3.4:6009/')
+
+    def test_service_cache(self):
+        urls = ['http://1.2.3.4:6009/', 'http://1.2.3.5:6009/']
+        choose = Mock(side_effect=lambda srv_type: [urls.pop(0)])
+        cache = ServiceCache(choose, ttl=30, size=2)
+        self.assertEqual(cache.get('account'), 'http://1.2.3.4:6009/')
+        self.assertEqual(cache.get('account'), 'http://1.2.3.4:6009/')
+        self.assertEqual(choose.call_count, 1)
+
+        # allow to grow the cache
+        cache._last_choose['account'] -= 20
+        self.assertEqual(cache.get('account'), 'http://1.2.3.5:6009/')
+        # rotate through the cached services
+        chosen = set(cache.get('account') for _i in range(4))
+        self.assertEqual(len(chosen), 2)
+        self.assertEqual(choose.call_count, 2)
+
+        cache.evict('account', 'http://1.2.3.5:6009/')
+        self.assertEqual(cache.get('account'), 'http://1.2.3.4:6009/')
+
+        # expired services are not used
+        cache._services['account'][0][1] = 0
+        choose.side_effect = lambda srv_type: ['http://1.2.3.6:6009/']
+        self.assertEqual(cache.get('account'), 'http://1.2.3.6:6009/')
+        self.assertEqual(choose.call_count, 3)
+
     def test_object_list(self):
         api = self.api
         marker = utils.random_string()
@@ -87,6 +151,246 @@ class ObjectStorageTest(unittest.TestCase):
             'GET', uri, params=params, headers=self.headers)
         self.assertEqual(len(l['objects']), 2)
 
+    def _list_request(self, names, truncated=None):
+        """
+        Fake container/list requests on a container holding names.
+        """
+        def fake_request(method, uri, params=None, headers=None):
+            marker = params['marker'] or ''
+            prefix = params['prefix'] or ''
+            end_marker = params['end_marker']
+            entries = sorted(n for n in names
+                             if n > marker and n.startswith(prefix) and
+                             (end_marker is None or n < end_marker))
+            limit = params['max']
+            resp = fakes.FakeResponse()
+            if truncated:
+                resp.headers['x-oio-list-truncated'] = \
+                    str(len(entries) > limit).lower()
+            body = {'objects': [{'name': n} for n in entries[:limit]]}
+            return resp, body
+        return Mock(side_effect=fake_request)
+
+    def test_object_list_iter(self):
+        api = self.api
+        names = ['obj-%03d' % i for i in range(25)]
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_iter(
+            self.account, self.container, page_size=10)
+        self.assertEqual([obj['name'] for obj in listing], names)
+        # the last page is not full, no need for another request
+        self.assertEqual(api._request.call_count, 3)
+        markers = [c[1]['params']['marker']
+                   for c in api._request.call_args_list]
+        self.assertEqual(markers, [None, 'obj-009', 'obj-019'])
+
+    def test_object_list_iter_limit(self):
+        api = self.api
+        names = ['obj-%03d' % i for i in range(25)]
+        api._request = self._list_request(names)
+        listing = api.object_list_iter(
+            self.account, self.container, limit=15, marker='obj-004',
+            page_size=10)
+        self.assertEqual([obj['name'] for obj in listing], names[5:20])
+        sizes = [c[1]['params']['max'] for c in api._request.call_args_list]
+        self.assertEqual(sizes, [10, 5])
+
+    def test_object_list_iter_prefetch(self):
+        api = self.api
+        names = ['obj-%03d' % i for i in range(30)]
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_iter(
+            self.account, self.container, page_size=10)
+        next(listing)
+        sleep(0)
+        # the second page is requested while the first one is consumed
+        self.assertEqual(api._request.call_count, 2)
+        listing.close()
+
+    def test_object_list_iter_not_found(self):
+        api = self.api
+        api._request = Mock(side_effect=exceptions.NotFound(404))
+        listing = api.object_list_iter(self.account, self.container)
+        self.assertRaises(exceptions.NoSuchContainer, list, listing)
+
+    def test_object_list_parallel(self):
+        api = self.api
+        names = ['%s%s' % (c, i) for c in 'AQbcdz_' for i in range(12)]
+        # names matching the start of the ranges
+        names += ['b', 'c', 'z']
+        names.sort()
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_parallel(
+            self.account, self.container, page_size=5, concurrency=4,
+            alphabet='bcdQ')
+        self.assertEqual([obj['name'] for obj in listing], names)
+
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_parallel(
+            self.account, self.container, page_size=5, prefix='b',
+            marker='b1', end_marker='b5', concurrency=4)
+        self.assertEqual([obj['name'] for obj in listing],
+                         ['b10', 'b11', 'b2', 'b3', 'b4'])
+
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_parallel(
+            self.account, self.container, page_size=5, limit=30)
+        self.assertEqual([obj['name'] for obj in listing], names[:30])
+
+    def test_object_list_parallel_single_page(self):
+        api = self.api
+        names = ['obj-%03d' % i for i in range(5)]
+        api._request = self._list_request(names, truncated=True)
+        listing = api.object_list_parallel(
+            self.account, self.container, page_size=10)
+        self.assertEqual([obj['name'] for obj in listing], names)
+        self.assertEqual(api._request.call_count, 1)
+
+    def test_shard_boundaries(self):
+        self.assertEqual(shard_boundaries(None, 'cab'), ['a', 'b', 'c'])
+        self.assertEqual(shard_boundaries('p/', 'ab', end_marker='p/b'),
+                         ['p/a'])
+        # split after the prefix shared by the sampled names
+        self.assertEqual(
+            shard_boundaries('obj-', '0123', first='obj-00000',
+                             last='obj-00999'),
+            ['obj-01', 'obj-02', 'obj-03'])
+        self.assertEqual(
+            shard_boundaries('', 'abc', first='a0', last='b7'),
+            ['c'])
+        # the shared names end with a character out of the alphabet
+        self.assertEqual(
+            shard_boundaries('photos/', 'abcd', first='photos/2016/a.jpg',
+                             last='photos/2016/b.jpg'),
+            ['photos/2016/c', 'photos/2016/d'])
+
+    def test_object_delete_many(self):
+        api = self.api
+        deleted = []
+
+        def fake_request(method, uri, params=None, headers=None):
+            if uri.endswith('container/list'):
+                return self._list_request(['a1', 'a2', 'b1'])(
+                    method, uri, params=params, headers=headers)
+            name = params['path']
+            if name == 'missing':
+                raise exceptions.NotFound(404)
+            if name == 'broken':
+                raise exceptions.ClientException(500)
+            # let the other deletions start
+            sleep(0.01 if name == 'x' else 0)
+            deleted.append(name)
+            return fakes.FakeResponse(), None
+
+        api._request = Mock(side_effect=fake_request)
+        results = list(api.object_delete_many(
+            self.account, self.container, ['x', 'missing', 'broken', 'y'],
+            prefix='a', concurrency=3))
+        self.assertEqual([name for name, _e in results],
+                         ['x', 'missing', 'broken', 'y', 'a1', 'a2'])
+        self.assertEqual(results[0][1], None)
+        self.assertTrue(isinstance(results[1][1], exceptions.NoSuchObject))
+        self.assertTrue(isinstance(results[2][1], exceptions.ClientException))
+        self.assertEqual(results[3][1], None)
+        # the slow deletion did not delay the next ones
+        self.assertEqual(deleted, ['y', 'a1', 'a2', 'x'])
+
+        self.assertRaises(ValueError, api.object_delete_many,
+                          self.account, self.container)
+
+    def test_object_show_many(self):
+        api = self.api
+
+        def fake_request(method, uri, params=None, headers=None, data=None):
+            if params['path'] == 'missing':
+                raise exceptions.NotFound(404)
+            resp = fakes.FakeResponse()
+            resp.headers = {object_headers['name']: params['path']}
+            return resp, {'key': params['path']}
+
+        api._request = Mock(side_effect=fake_request)
+        results = list(api.object_show_many(
+            self.account, self.container, ['a', 'missing', 'b'],
+            concurrency=20))
+        self.assertEqual([name for name, _r in results],
+                         ['a', 'missing', 'b'])
+        self.assertEqual(results[0][1]['name'], 'a')
+        self.assertEqual(results[2][1]['properties'], {'key': 'b'})
+        self.assertTrue(isinstance(results[1][1], exceptions.NoSuchObject))
+        # the connections of the coroutines are kept
+        adapter = api.session.get_adapter('http://1.2.3.4:8000')
+        self.assertEqual(adapter._pool_maxsize, 20)
+
+    def test_object_properties_many(self):
+        api = self.api
+        api._request = Mock(return_value=(fakes.FakeResponse(), None))
+        results = list(api.object_set_properties_many(
+            self.account, self.container,
+            [('a', {'k': 'v'}), ('b', {'k': 'w'})], clear=True))
+        self.assertEqual(results, [('a', None), ('b', None)])
+        uri = "%s/content/set_properties" % self.uri_base
+        params = {'acct': self.account, 'ref': self.container,
+                  'path': 'b', 'flush': 1}
+        api._request.assert_called_with(
+            'POST', uri, data=json.dumps({'k': 'w'}), params=params,
+            headers=None)
+
+        results = list(api.object_del_properties_many(
+            self.account, self.container, {'a': ['k']}.items()))
+        self.assertEqual(results, [('a', None)])
+        uri = "%s/content/del_properties" % self.uri_base
+        params = {'acct': self.account, 'ref': self.container, 'path': 'a'}
+        api._request.assert_called_with(
+            'POST', uri, data=json.dumps(['k']), params=params,
+            headers=None)
+
+    def test_container_list_iter(self):
+        api = self.api
+        names = ['ct-%03d' % i for i in range(20)]
+
+        def fake_request(method, uri, endpoint=None, params=None,
+                         headers=None):
+            marker = params['marker'] or ''
+            entries = sorted(n for n in names if n > marker)
+            listing = [[n, 0, 0, 0] for n in entries[:params['limit']]]
+            return fakes.FakeResponse(), {'listing': listing}
+
+        api._request = Mock(side_effect=fake_request)
+        api._get_service_url = Mock(return_value='fake_endpoint')
+        listing = api.container_list_iter(self.account, page_size=10)
+        self.assertEqual([c[0] for c in listing], names)
+        # the second page was full, the third one is empty
+        self.assertEqual(api._request.call_count, 3)
+
+    def test_pool_settings(self):
+        api = fakes.FakeStorageAPI("NS", "http://1.2.3.4:8000",
+                                   pool_size=50, pool_block=True,
+                                   pool_idle_timeout=2)
+        adapter = api.session.get_adapter('http://1.2.3.4:8000')
+        self.assertEqual(adapter._pool_maxsize, 50)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter.idle_timeout, 2)
+        # the directory shares the connections
+        self.assertTrue(api.directory.session is api.session)
+        adapter.stats['hits'] += 3
+        self.assertEqual(api.pool_stats(),
+                         {'hits': 3, 'misses': 0, 'discarded': 0})
+
+    def test_io_settings(self):
+        api = fakes.FakeStorageAPI("NS", "http://1.2.3.4:8000",
+                                   chunk_timeout=10, read_chunk_size=4)
+        self.assertEqual(api.io_settings.chunk_timeout, 10)
+        self.assertIsNone(api.io_tuning())
+        settings = api._io_settings({'chunk_timeout': 20})
+        self.assertEqual(settings.chunk_timeout, 20)
+        self.assertEqual(settings.read_chunk_size, 4)
+        self.assertEqual(api.io_settings.chunk_timeout, 10)
+
+        api = fakes.FakeStorageAPI("NS", "http://1.2.3.4:8000",
+                                   write_chunk_size=1024, io_autotune=True)
+        self.assertEqual(api.io_tuning()['write_chunk_size'], 1024)
+        self.assertFalse(api.io_tuning()['settled'])
+
     def test_container_show(self):
         api = self.api
         resp = fakes.FakeResponse()
@@ -227,6 +531,309 @@ class ObjectStorageTest(unittest.TestCase):
             exceptions.FileNotFound, api.object_create, self.account,
             self.container, name)
 
+    def test_object_create_size_header(self):
+        data = 'abcdefghijklmnopqrstuvwxy'
+        meta = {'X-oio-ns-chunk-size': '100',
+                object_headers['id']: 'A0A0',
+                object_headers['version']: '1',
+                object_headers['policy']: 'SINGLE',
+                object_headers['mime_type']: 'octet/stream',
+                object_headers['chunk_method']: 'plain/nb_copy=1'}
+        raw_chunks = [{'url': 'http://1.2.3.4:6000/AAAA', 'pos': '0',
+                       'size': 100}]
+        self.api._content_prepare = Mock(return_value=(meta, raw_chunks))
+        self.api._content_create = Mock(return_value=({}, None))
+        with fakes.set_http_connect(201):
+            self.api.object_create(self.account, self.container, data=data,
+                                   obj_name='obj')
+        args, kwargs = self.api._content_create.call_args
+        # header values must be strings
+        self.assertEqual(kwargs['headers'][object_headers['size']], '25')
+
+    def _prepare_chunks(self, chunk_method, nb_copy, chunk_size=10):
+        ec = chunk_method.startswith('ec/')
+
+        # the proxy prepares new chunks at each call
+        def prepare(account, container, obj_name, size, **kwargs):
+            meta = {'X-oio-ns-chunk-size': str(chunk_size),
+                    object_headers['id']: 'A0A0',
+                    object_headers['version']: '1',
+                    object_headers['policy']: kwargs['policy'] or 'SINGLE',
+                    object_headers['mime_type']: 'octet/stream',
+                    object_headers['chunk_method']: chunk_method}
+            self.prepare_sizes.append(size)
+            # as many meta chunks as the announced size needs
+            return meta, [{'url': 'http://1.2.3.4:600%d/%s' % (
+                               i, utils.random_string()),
+                           'pos': '%d.%d' % (pos, i) if ec else str(pos),
+                           'size': chunk_size}
+                          for pos in range(max(1, -(-size // chunk_size)))
+                          for i in range(nb_copy)]
+        self.prepare_sizes = []
+        self.api._content_prepare = Mock(side_effect=prepare)
+        self.api._content_create = Mock(return_value=({}, None))
+
+    def test_object_create_checkpoint(self):
+        self._prepare_chunks('plain/nb_copy=2', 2)
+        data = 'abcdefghijklmnopqrstuvwxy'
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        checkpoint = os.path.join(tmpdir, 'upload')
+        puts = []
+
+        def cb_request(conn_id, host, method, path, headers, **kwargs):
+            puts.append((path, headers[chunk_headers['chunk_pos']]))
+
+        # the second meta chunk loses its quorum
+        with fakes.set_http_connect(201, 201, 500, 500, 201, 201,
+                                    cb_request=cb_request):
+            self.assertRaises(
+                exceptions.OioException, self.api.object_create,
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state['next_pos'], 1)
+        self.assertEqual(state['offset'], 10)
+        self.assertEqual(state['checksum'], md5(data[:10]).hexdigest())
+        self.assertFalse(self.api._content_create.called)
+
+        failed_paths = set(path for path, _pos in puts)
+        del puts[:]
+        with fakes.set_http_connect(*([201] * 4), cb_request=cb_request):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        # only the meta chunks after the checkpoint are written,
+        # to new chunks
+        self.assertEqual(sorted(pos for _path, pos in puts),
+                         ['1', '1', '2', '2'])
+        self.assertFalse(failed_paths & set(p for p, _pos in puts))
+        self.assertEqual(self.prepare_sizes, [25, 15])
+        self.assertEqual(size, len(data))
+        self.assertEqual(checksum, md5(data).hexdigest())
+        self.assertEqual([c['pos'] for c in chunks],
+                         ['0', '0', '1', '1', '2', '2'])
+        self.assertEqual([c['size'] for c in chunks], [10] * 4 + [5] * 2)
+        args, kwargs = self.api._content_create.call_args
+        self.assertEqual(args[3], chunks)
+        self.assertEqual(kwargs['headers'][object_headers['size']], '25')
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_object_create_checkpoint_rawx_conflict(self):
+        self._prepare_chunks('plain/nb_copy=2', 2)
+        data = 'abcdefghijklmnopqrstuvwxy'
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        checkpoint = os.path.join(tmpdir, 'upload')
+        stored = set()
+        failing = ['1']
+
+        # the rawx services reject a second PUT of a chunk
+        def cb(req):
+            path = req['path']
+            if path in stored:
+                return FakeResponse(409)
+            if req['headers'][chunk_headers['chunk_pos']] in failing:
+                return FakeResponse(500)
+            stored.add(path)
+            return FakeResponse(201)
+
+        # the third meta chunk is written
+        # before the failure of the second one is known
+        self.api.write_pipeline_depth = 1
+        with fakes.set_http_requests(cb) as conns:
+            self.assertRaises(
+                exceptions.OioException, self.api.object_create,
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        self.assertEqual(len(conns), 6)
+        # the chunks written are stored,
+        # even when their response has not been read
+        stored.update(
+            conn.req['path'] for conn in conns.records
+            if conn.req['headers'][chunk_headers['chunk_pos']] not in failing)
+
+        del failing[:]
+        with fakes.set_http_requests(cb) as conns:
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        self.assertEqual(len(conns), 4)
+        self.assertEqual(size, len(data))
+        self.assertEqual(checksum, md5(data).hexdigest())
+        self.assertEqual(len(chunks), 6)
+        self.assertEqual(len(set(c['url'] for c in chunks)), 6)
+
+    def test_object_create_checkpoint_ec(self):
+        # a meta chunk holds two segments
+        self._prepare_chunks(
+            'ec/algo=liberasurecode_rs_vand,k=2,m=1', 3, chunk_size=1048576)
+        data = 'x' * 2097152 + 'y' * 100
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        checkpoint = os.path.join(tmpdir, 'upload')
+        puts = []
+
+        def cb_request(conn_id, host, method, path, headers, **kwargs):
+            puts.append((path, headers[chunk_headers['chunk_pos']]))
+
+        # the second meta chunk loses its quorum
+        with fakes.set_http_connect(201, 201, 201, 500, 500, 500,
+                                    cb_request=cb_request):
+            self.assertRaises(
+                exceptions.OioException, self.api.object_create,
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state['next_pos'], 1)
+        self.assertEqual(state['offset'], 2097152)
+        self.assertEqual(state['checksum'], md5(data[:2097152]).hexdigest())
+
+        failed_paths = set(path for path, _pos in puts)
+        del puts[:]
+        with fakes.set_http_connect(*([201] * 3), cb_request=cb_request):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, data=data, obj_name='obj',
+                checkpoint=checkpoint)
+        # only the meta chunk after the checkpoint is written,
+        # to new chunks
+        self.assertEqual(sorted(pos for _path, pos in puts),
+                         ['1.0', '1.1', '1.2'])
+        self.assertFalse(failed_paths & set(p for p, _pos in puts))
+        self.assertEqual(self.prepare_sizes, [len(data), 100])
+        self.assertEqual(size, len(data))
+        self.assertEqual(checksum, md5(data).hexdigest())
+        self.assertEqual(sorted(c['pos'] for c in chunks),
+                         ['0.0', '0.1', '0.2', '1.0', '1.1', '1.2'])
+        args, kwargs = self.api._content_create.call_args
+        self.assertEqual(kwargs['headers'][object_headers['size']],
+                         str(len(data)))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_object_create_checkpoint_source_changed(self):
+        checkpoint = tempfile.NamedTemporaryFile()
+        json.dump({'key': [self.account, self.container, 'obj', 3, None,
+                           None],
+                   'sysmeta': {'chunk_method': 'plain/nb_copy=2'},
+                   'chunks': [], 'next_pos': 1, 'offset': 2,
+                   'checksum': md5('ab').hexdigest(), 'done': []},
+                  checkpoint)
+        checkpoint.flush()
+        self.assertRaises(
+            exceptions.SourceReadError, self.api.object_create,
+            self.account, self.container, data='xyz', obj_name='obj',
+            checkpoint=checkpoint.name)
+
+    def test_object_create_stream(self):
+        self._prepare_chunks('plain/nb_copy=1', 1)
+        data = 'abcdefghijklmnopqrstuvwxy'
+        parts = defaultdict(list)
+
+        def cb_body(conn_id, part):
+            parts[conn_id].append(part)
+
+        with fakes.set_http_connect(201, 201, 201, cb_body=cb_body):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, obj_name='obj',
+                data=(data[i:i + 4] for i in range(0, len(data), 4)))
+        self.assertEqual(size, len(data))
+        self.assertEqual(checksum, md5(data).hexdigest())
+        self.assertEqual([(c['pos'], c['size']) for c in chunks],
+                         [('0', 10), ('1', 10), ('2', 5)])
+        self.assertEqual(self.api._content_prepare.call_count, 3)
+        # the same policy for all the meta chunks
+        self.assertEqual(
+            [kw['policy'] for _a, kw in
+             self.api._content_prepare.call_args_list],
+            [None, 'SINGLE', 'SINGLE'])
+        # the next meta chunks are prepared with their full size
+        self.assertEqual(self.prepare_sizes, [1, 10, 10])
+        body = ''.join(decode_chunked_body(''.join(parts[i]))[0]
+                       for i in range(3))
+        self.assertEqual(body, data)
+        args, kwargs = self.api._content_create.call_args
+        self.assertEqual(kwargs['headers'][object_headers['size']], '25')
+
+    def test_object_create_stream_size_hint(self):
+        self._prepare_chunks('plain/nb_copy=1', 1)
+        data = 'abcdefghijklmnopqrstuvwxy'
+        with fakes.set_http_connect(201, 201, 201):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, obj_name='obj',
+                data=iter([data]), size_hint=15)
+        self.assertEqual(size, len(data))
+        self.assertEqual([(c['pos'], c['size']) for c in chunks],
+                         [('0', 10), ('1', 10), ('2', 5)])
+        # the meta chunks prepared with the hint are used first
+        self.assertEqual(self.prepare_sizes, [15, 10])
+        self.assertEqual(
+            [kw['policy'] for _a, kw in
+             self.api._content_prepare.call_args_list], [None, 'SINGLE'])
+
+    def test_object_create_stream_meta_chunk_boundary(self):
+        self._prepare_chunks('plain/nb_copy=1', 1)
+        r, w = os.pipe()
+        os.write(w, 'x' * 20)
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            with fakes.set_http_connect(201, 201):
+                chunks, size, checksum = self.api.object_create(
+                    self.account, self.container, f, obj_name='obj')
+        # no empty meta chunk after the last one
+        self.assertEqual([(c['pos'], c['size']) for c in chunks],
+                         [('0', 10), ('1', 10)])
+        self.assertEqual(size, 20)
+
+    def test_object_create_stream_empty(self):
+        self._prepare_chunks('plain/nb_copy=1', 1)
+        with fakes.set_http_connect(201):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, obj_name='obj', data=iter([]))
+        self.assertEqual([(c['pos'], c['size']) for c in chunks], [('0', 0)])
+        self.assertEqual(checksum, md5().hexdigest())
+
+    def test_object_create_stream_ec(self):
+        self._prepare_chunks(
+            'ec/algo=liberasurecode_rs_vand,k=2,m=1', 3, chunk_size=1048576)
+        # a meta chunk holds two segments
+        data = 'x' * 2097152 + 'y' * 100
+        with fakes.set_http_connect(*([201] * 6)):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, obj_name='obj',
+                data=iter([data]))
+        self.assertEqual(size, len(data))
+        self.assertEqual(sorted(c['pos'] for c in chunks),
+                         ['0.0', '0.1', '0.2', '1.0', '1.1', '1.2'])
+
+    def test_object_create_iterable_content_length(self):
+        self._prepare_chunks('plain/nb_copy=1', 1)
+        data = 'abcdefghijklmnopqrstuvwxy'
+        parts = defaultdict(list)
+
+        def cb_body(conn_id, part):
+            parts[conn_id].append(part)
+
+        with fakes.set_http_connect(201, 201, 201, cb_body=cb_body):
+            chunks, size, checksum = self.api.object_create(
+                self.account, self.container, obj_name='obj',
+                data=(data[i:i + 4] for i in range(0, len(data), 4)),
+                content_length=len(data))
+        self.assertEqual(size, len(data))
+        self.assertEqual(checksum, md5(data).hexdigest())
+        self.assertEqual([(c['pos'], c['size']) for c in chunks],
+                         [('0', 10), ('1', 10), ('2', 5)])
+        # the chunks are prepared at once with the length
+        self.assertEqual(self.prepare_sizes, [len(data)])
+        self.assertEqual(''.join(''.join(parts[i]) for i in range(3)), data)
+
+    def test_object_create_stream_checkpoint(self):
+        self.assertRaises(
+            ValueError, self.api.object_create, self.account,
+            self.container, obj_name='obj', data=iter(['x']),
+            checkpoint='/tmp/checkpoint')
+
     def test_object_update(self):
         api = self.api
 
@@ -319,3 +926,59 @@ class ObjectStorageTest(unittest.TestCase):
                  "pos": "1.2", "size": 32, "num": 2}]
         }
         self.assertEqual(chunks, sorted_chunks)
+
+    def test_get_meta_ranges(self):
+        chunks = {0: [{'size': 10}], 1: [{'size': 10}], 2: [{'size': 5}]}
+        self.assertEqual(get_meta_ranges([(None, None)], chunks),
+                         [(0, None, None), (1, None, None), (2, None, None)])
+        self.assertEqual(get_meta_ranges([(5, 14), (22, None)], chunks),
+                         [(0, 5, None), (1, 0, 4), (2, 2, None)])
+        # ranges on meta chunks boundaries
+        self.assertEqual(get_meta_ranges([(10, 19), (9, 9)], chunks),
+                         [(1, None, None), (0, 9, None)])
+        # suffix byte range
+        self.assertEqual(get_meta_ranges([(None, 7)], chunks),
+                         [(1, 8, None), (2, None, None)])
+        # out of the content
+        self.assertEqual(get_meta_ranges([(25, None)], chunks), [])
+
+    def test_object_fetch_ranges(self):
+        data = 'abcdefghijklmnopqrstuvwxy'
+        raw_chunks = []
+        for pos, (start, end) in enumerate([(0, 10), (10, 20), (20, 25)]):
+            for i in range(2):
+                raw_chunks.append({
+                    'url': 'http://1.2.3.4:600%d/%d' % (i, pos),
+                    'pos': str(pos), 'size': end - start,
+                    'data': data[start:end]})
+        meta = {'chunk-method': 'plain/nb_copy=2'}
+        self.api.object_analyze = Mock(return_value=(meta, raw_chunks))
+
+        requested = []
+
+        def get_response(req):
+            pos = int(req['path'].split('/')[-1])
+            chunk_data = raw_chunks[pos * 2]['data']
+            req_range = req['headers'].get('Range')
+            requested.append((req['path'], req_range))
+            if not req_range:
+                return FakeResponse(200, chunk_data)
+            start, end = utils.ranges_from_http_header(req_range)[0]
+            if end is None:
+                end = len(chunk_data) - 1
+            part = chunk_data[start:end + 1]
+            headers = {'Content-Length': str(len(part)),
+                       'Content-Range': 'bytes %d-%d/%d' % (
+                           start, end, len(chunk_data))}
+            return FakeResponse(206, part, headers)
+
+        ranges = [(5, 14), (22, None), (None, 2)]
+        with fakes.set_http_requests(get_response):
+            meta, stream = self.api.object_fetch(
+                self.account, self.container, 'obj', ranges=ranges)
+            result = ''.join(stream)
+        self.assertEqual(result, data[5:15] + data[22:] + data[-2:])
+        self.assertEqual(
+            requested,
+            [('/0', 'bytes=5-'), ('/1', 'bytes=0-4'), ('/2', 'bytes=2-'),
+             ('/2', 'bytes=3-')])
@@ -1,3 +1,4 @@
+import time
 import unittest
 from collections import defaultdict
 from cStringIO import StringIO
@@ -5,7 +6,8 @@ from hashlib import md5
 from eventlet import Timeout
 from oiopy import exceptions as exc
 from oiopy.fakes import set_http_connect, set_http_requests
-from oiopy.replication import ReplicatedChunkWriteHandler
+from oiopy.replication import ReplicatedChunkWriteHandler, \
+    ReplicatedWriteHandler
 from oiopy.storage_method import STORAGE_METHODS
 from tests.unit import CHUNK_SIZE, EMPTY_CHECKSUM, empty_stream, \
     decode_chunked_body, FakeResponse
@@ -232,6 +234,139 @@ class TestReplication(unittest.TestCase):
             self.assertEqual(len(test_data), len(body))
             self.assertEqual(self.checksum(body).hexdigest(), final_checksum)
 
+    def test_write_pipeline(self):
+        test_data = ('1234' * 1024)[:-10]
+        size = len(test_data)
+        chunks = {}
+        for pos in range(3):
+            chunks[pos] = [
+                {'url': 'http://127.0.0.1:700%d/%d' % (i, pos),
+                 'pos': str(pos), 'size': size / 3 + 1}
+                for i in range(3)]
+        nb = sum(len(c) for c in chunks.values())
+        put_reqs = defaultdict(lambda: {'parts': []})
+
+        def cb_body(conn_id, part):
+            put_reqs[conn_id]['parts'].append(part)
+
+        with set_http_connect(*([201] * nb), cb_body=cb_body):
+            handler = ReplicatedWriteHandler(
+                StringIO(test_data), self.sysmeta, chunks,
+                self.storage_method, {}, pipeline_depth=1)
+            content_chunks, bytes_transferred, checksum = handler.stream()
+
+        self.assertEqual(bytes_transferred, size)
+        self.assertEqual(checksum, self.checksum(test_data).hexdigest())
+        self.assertEqual([c['pos'] for c in content_chunks],
+                         ['0'] * 3 + ['1'] * 3 + ['2'] * 3)
+        body = ''
+        for conn_id in range(0, nb, 3):
+            body += decode_chunked_body(
+                ''.join(put_reqs[conn_id]['parts']))[0]
+        self.assertEqual(body, test_data)
+
+    def test_write_content_length(self):
+        test_data = ('1234' * 1024)[:-10]
+        size = len(test_data)
+        meta_chunk = self.meta_chunk()
+        nb = len(meta_chunk)
+        put_reqs = defaultdict(lambda: {'parts': []})
+
+        def cb_request(conn_id, host, method, path, headers, **kwargs):
+            put_reqs[conn_id]['headers'] = headers
+
+        def cb_body(conn_id, part):
+            put_reqs[conn_id]['parts'].append(part)
+
+        with set_http_connect(*([201] * nb), cb_body=cb_body,
+                              cb_request=cb_request):
+            handler = ReplicatedChunkWriteHandler(
+                self.sysmeta, meta_chunk, self.checksum(),
+                self.storage_method, content_length=size)
+            bytes_transferred, checksum, chunks = handler.stream(
+                StringIO(test_data), CHUNK_SIZE)
+
+        self.assertEqual(bytes_transferred, size)
+        self.assertEqual(checksum, self.checksum(test_data).hexdigest())
+        self.assertEqual(len(put_reqs), nb)
+        for req in put_reqs.values():
+            self.assertEqual(req['headers']['content-length'], str(size))
+            self.assertNotIn('transfer-encoding', req['headers'])
+            # the raw bytes, without any framing nor terminator
+            self.assertEqual(''.join(req['parts']), test_data)
+
+    def test_write_content_length_short_source(self):
+        test_data = '1234' * 10
+        meta_chunk = self.meta_chunk()
+        with set_http_connect(*([201] * len(meta_chunk))):
+            handler = ReplicatedChunkWriteHandler(
+                self.sysmeta, meta_chunk, self.checksum(),
+                self.storage_method, content_length=len(test_data) + 1)
+            self.assertRaises(exc.SourceReadError, handler.stream,
+                              StringIO(test_data), CHUNK_SIZE)
+
+    def test_write_pipeline_content_length(self):
+        test_data = ('1234' * 1024)[:-10]
+        size = len(test_data)
+        sysmeta = dict(self.sysmeta, content_length=size)
+        chunks = {}
+        for pos in range(3):
+            chunks[pos] = [
+                {'url': 'http://127.0.0.1:700%d/%d' % (i, pos),
+                 'pos': str(pos), 'size': size / 3 + 1}
+                for i in range(3)]
+        nb = sum(len(c) for c in chunks.values())
+        lengths = {}
+
+        def cb_request(conn_id, host, method, path, headers, **kwargs):
+            lengths[path] = int(headers['content-length'])
+
+        with set_http_connect(*([201] * nb), cb_request=cb_request):
+            handler = ReplicatedWriteHandler(
+                StringIO(test_data), sysmeta, chunks,
+                self.storage_method, {}, pipeline_depth=1)
+            content_chunks, bytes_transferred, checksum = handler.stream()
+
+        self.assertEqual(bytes_transferred, size)
+        self.assertEqual(checksum, self.checksum(test_data).hexdigest())
+        # the last meta chunk only holds the remaining bytes
+        self.assertEqual(lengths, {
+            '/0': size / 3 + 1, '/1': size / 3 + 1,
+            '/2': size - 2 * (size / 3 + 1)})
+
+    def test_write_io_settings(self):
+        test_data = '1234' * 100
+        meta_chunk = self.meta_chunk()
+        nb = len(meta_chunk)
+        put_reqs = defaultdict(list)
+        transfers = []
+
+        def cb_body(conn_id, part):
+            put_reqs[conn_id].append(part)
+
+        class SlowSource(object):
+            def __init__(self):
+                self.data = StringIO(test_data)
+
+            def read(self, size):
+                time.sleep(0.01)
+                return self.data.read(size)
+
+        settings = io.IOSettings(write_chunk_size=100)
+        settings.add_transfer = lambda *args: transfers.append(args)
+        with set_http_connect(*([201] * nb), cb_body=cb_body):
+            handler = ReplicatedChunkWriteHandler(
+                self.sysmeta, meta_chunk, self.checksum(),
+                self.storage_method, content_length=len(test_data),
+                settings=settings)
+            handler.stream(SlowSource(), CHUNK_SIZE)
+
+        for parts in put_reqs.values():
+            self.assertEqual([len(p) for p in parts], [100] * 4)
+        self.assertEqual([nb_bytes for nb_bytes, _d in transfers], [400])
+        # the time spent reading the source is not measured
+        self.assertLess(transfers[0][1], 0.01)
+
     def test_read(self):
         test_data = ('1234' * 1024)[:-10]
         data_checksum = self.checksum(test_data).hexdigest()
@@ -0,0 +1,49 @@
+import unittest
+from oiopy import exceptions as exc
+from oiopy.storage_method import StorageMethods, ReplicatedStorageMethod, \
+    ECStorageMethod
+
+
+class StorageMethodsTest(unittest.TestCase):
+    def setUp(self):
+        self.methods = StorageMethods(
+            {'plain': ReplicatedStorageMethod, 'ec': ECStorageMethod},
+            cache_size=2)
+
+    def test_load_cached(self):
+        method = self.methods.load('plain/nb_copy=3')
+        self.assertEqual(method.nb_copy, 3)
+        self.assertIs(self.methods.load('plain/nb_copy=3'), method)
+        self.assertEqual(self.methods.stats, {'hits': 1, 'misses': 1})
+
+        ec_method = 'ec/algo=liberasurecode_rs_vand,k=6,m=2'
+        method = self.methods.load(ec_method)
+        self.assertEqual(method.ec_nb_data, 6)
+        self.assertIs(self.methods.load(ec_method), method)
+        self.assertEqual(self.methods.stats, {'hits': 2, 'misses': 2})
+
+    def test_load_invalid(self):
+        self.assertRaises(exc.InvalidStorageMethod, self.methods.load,
+                          'unknown/nb_copy=3')
+        self.assertRaises(exc.InvalidStorageMethod, self.methods.load,
+                          'plain/')
+        self.assertRaises(exc.InvalidStorageMethod, self.methods.load,
+                          'plain/nb_copy=x')
+        self.assertEqual(len(self.methods.cache), 0)
+
+    def test_cache_bounded(self):
+        method1 = self.methods.load('plain/nb_copy=1')
+        self.methods.load('plain/nb_copy=2')
+        # method1 is now the most recently used
+        self.methods.load('plain/nb_copy=1')
+        self.methods.load('plain/nb_copy=3')
+        self.assertEqual(len(self.methods.cache), 2)
+        self.assertNotIn('plain/nb_copy=2', self.methods.cache)
+        self.assertIs(self.methods.load('plain/nb_copy=1'), method1)
+
+    def test_preload(self):
+        failed = self.methods.preload(['plain/nb_copy=3', 'unknown'])
+        self.assertEqual(failed, ['unknown'])
+        self.assertIn('plain/nb_copy=3', self.methods.cache)
+        self.methods.load('plain/nb_copy=3')
+        self.assertEqual(self.methods.stats['hits'], 1)
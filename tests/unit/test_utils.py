@@ -0,0 +1,19 @@
+import unittest
+
+from oiopy import utils
+
+
+class UtilsTest(unittest.TestCase):
+    def test_convert_ranges(self):
+        self.assertEqual(utils.convert_ranges([(0, 9)], 10), [(0, 9)])
+        # the ends are inclusive, the last byte is length - 1
+        self.assertEqual(utils.convert_ranges([(2, 20)], 10), [(2, 9)])
+        self.assertEqual(utils.convert_ranges([(2, None)], 10), [(2, 9)])
+        self.assertEqual(utils.convert_ranges([(None, 3)], 10), [(7, 9)])
+        self.assertEqual(utils.convert_ranges([(None, 20)], 10), [(0, 9)])
+
+    def test_convert_ranges_unsatisfiable(self):
+        self.assertEqual(utils.convert_ranges([(10, None)], 10), [])
+        self.assertEqual(utils.convert_ranges([(12, 20)], 10), [])
+        self.assertEqual(utils.convert_ranges([(None, 0)], 10), [])
+        self.assertEqual(utils.convert_ranges([(0, 9)], None), None)